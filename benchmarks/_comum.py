@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""Preparação comum aos benchmarks, importada antes do main: diretório temporário próprio para o banco e os
+snapshots (o main lê ZAR_DATABASE e ZAR_SNAPSHOT_DIR na importação, então nada toca a base de produção) e
+src/ no sys.path. Variáveis já definidas no ambiente são respeitadas.
+
+Uso: from _comum import TMP_DIR  (no topo de cada script de benchmarks/, antes de `import main`)
+"""
+import os
+import sys
+import tempfile
+
+TMP_DIR = tempfile.mkdtemp(prefix='zar_bench_')
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', 'src'))
+
+os.environ.setdefault('ZAR_DATABASE', os.path.join(TMP_DIR, 'bench.db'))
+os.environ.setdefault('ZAR_SNAPSHOT_DIR', os.path.join(TMP_DIR, 'snapshots'))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
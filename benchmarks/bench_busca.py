@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Mede as buscas do chatbot no índice FTS5 (produto, fornecedor, solicitação, pedido) sobre linhas do
+gerador_planilhas, carregadas pelo mesmo caminho da ingestão (sem passar pelo .xlsx, para ir rápido a 1M).
+
+Uso: python benchmarks/bench_busca.py [--linhas 1000000] [--repeticoes 50]
+"""
+import argparse
+import itertools
+import time
+
+import _comum  # noqa: F401 (banco temporário e src/ no sys.path, antes do main)
+
+import pandas as pd  # noqa: E402
+
+import main  # noqa: E402
+from gerador_planilhas import cabecalho, gerar_linhas  # noqa: E402
+
+main.logger.setLevel('WARNING')
+
+BUSCAS = [
+    ('buscar parafusos', 'termo comum'),
+    ('buscar parafuso sextavado', 'dois termos comuns juntos'),
+    ('pedidos do fornecedor 0123', 'coluna Fornecedor'),
+    ('onde está a compra de válvulas esfera 02491', 'coluna Produto, com acento e plural'),
+    ('buscar toner disjuntor', 'dois termos comuns que nunca aparecem juntos'),
+    ('buscar 100500', 'número da solicitação'),
+    ('buscar xyzzy', 'sem resultado'),
+]
+
+
+def carregar(linhas):
+    main.ensure_db() # Importar o main não cria o esquema; a primeira requisição ou carga é que cria
+    header = cabecalho()
+    present_original_cols, _ = main.map_excel_columns(header)
+    rows = gerar_linhas(linhas)
+    parsers = main.ColumnParsers() # Um por carga, como em _transformed_chunks
+
+    def chunks():
+        offset = 0
+        while True:
+            block = list(itertools.islice(rows, main.STREAM_CHUNK_SIZE))
+            if not block:
+                return
+            frame = pd.DataFrame(block, columns=header, index=range(offset, offset + len(block)))
+            offset += len(block)
+            parsed, rejected = main.transform_dataframe(frame, present_original_cols, parsers)
+            yield parsed, len(rejected)
+
+    timer = main.StageTimer()
+    ok, message = main._load_parsed_chunks(chunks(), 'sintetico.xlsx', None, False, lambda *args: None, timer)
+    assert ok, message
+    return timer.totals
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--linhas', type=int, default=1000000)
+    parser.add_argument('--repeticoes', type=int, default=50)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    totals = carregar(args.linhas)
+    print(f"{args.linhas} linhas carregadas em {time.perf_counter() - start:.1f} s "
+          f"(índice de busca: {totals.get('indice_busca', 0):.1f} s)\n")
+
+    cursor = main.get_read_db().cursor()
+    for message, description in BUSCAS:
+        intent, params = main.chat_router.route(message)
+        intent.handler(cursor, **params)
+        latencies = []
+        for _ in range(args.repeticoes):
+            start = time.perf_counter()
+            intent.handler(cursor, **params)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000
+        print(f"{message:<46} p50 {p50:6.2f} ms  p99 {p99:6.2f} ms  ({description})")
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Compara o acesso ao SQLite antigo (uma conexão nova por requisição, journal padrão)
+com a camada atual (conexões de leitura por thread + WAL), com e sem uma carga escrevendo em paralelo.
+
+Uso: python benchmarks/bench_conexoes.py [--linhas 200000] [--threads 4] [--consultas 2000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import threading
+import time
+
+from _comum import TMP_DIR
+
+import main  # noqa: E402
+
+COLS = [col for col in main.INTERNAL_COLUMNS if col != 'id']
+
+
+def synthetic_rows(n, seed=42):
+    rnd = random.Random(seed)
+    etapas = ['01_SOLICITADA', '02_COTAR', '05_COTADA', '08_PEDIDO', '10_RECEBIDA']
+    status = ['aprovado', 'pendente', 'finalizado', 'cancelado', 'não aprovado']
+    for i in range(n):
+        row = dict.fromkeys(COLS)
+        row.update({
+            'Solicitacao': str(100000 + i), 'Comprador': rnd.choice(['Miriam', 'Irineu', 'Outro']),
+            'Status': rnd.choice(status), 'Etapa': rnd.choice(etapas), 'DiasAtrSol': rnd.randint(0, 60),
+            'VlrTotal': round(rnd.uniform(10, 5000), 2), 'LeadTimeCompra': rnd.randint(0, 30),
+            'LeadTimeCompraContrato': 0, 'LeadTimeEntrega': rnd.randint(0, 40), 'AtrasoEntrega': rnd.randint(0, 10),
+        })
+        yield tuple(row[col] for col in COLS)
+
+
+def populate(path, n, wal):
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA journal_mode = {'WAL' if wal else 'DELETE'}")
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS solicitacoes")
+    main.create_solicitacoes_table(cursor)
+    conn.commit()
+    conn.executemany(f"INSERT INTO solicitacoes ({', '.join(COLS)}) VALUES ({', '.join('?' * len(COLS))})", synthetic_rows(n))
+    for index_name, index_cols in main.SOLICITACOES_INDEXES.items():
+        conn.execute(f"CREATE INDEX {index_name} ON solicitacoes ({index_cols})")
+    conn.execute("CREATE TABLE carga (x)")
+    conn.commit()
+    conn.close()
+
+
+def legacy_connection(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def chat_like_query(conn, n):
+    # Consultas indexadas, para medir o custo de conexão e de bloqueio e não o de varredura
+    solicitacao = str(100000 + random.randrange(n))
+    conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='solicitacoes'").fetchone()
+    conn.execute("SELECT Status, Etapa, Comprador FROM solicitacoes WHERE Solicitacao = ?", (solicitacao,)).fetchone()
+    conn.execute("SELECT COUNT(*) FROM solicitacoes WHERE Etapa = '02_COTAR' AND DiasAtrSol > 50").fetchone()
+
+
+def writer_loop(open_writer, stop):
+    # Simula a ingestão: lotes grandes com commit, como a carga na tabela sombra
+    conn = open_writer()
+    payload = [(random.random(),) for _ in range(50000)]
+    while not stop.is_set():
+        conn.executemany("INSERT INTO carga VALUES (?)", payload)
+        conn.commit()
+        conn.execute("DELETE FROM carga")
+        conn.commit()
+
+
+def run(label, open_reader, release_reader, open_writer, args, with_writer):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def reader():
+        local_lat = []
+        for _ in range(args.consultas // args.threads):
+            start = time.perf_counter()
+            try:
+                conn = open_reader()
+                chat_like_query(conn, args.linhas)
+                release_reader(conn)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            local_lat.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local_lat)
+
+    writer = threading.Thread(target=writer_loop, args=(open_writer, stop)) if with_writer else None
+    if writer:
+        writer.start()
+        time.sleep(0.2)
+    threads = [threading.Thread(target=reader) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if writer:
+        writer.join()
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{label:<34} {len(latencies) / elapsed:>9.0f} req/s  p50 {p(0.50):7.2f} ms  p99 {p(0.99):8.2f} ms  "
+          f"mediana {statistics.median(latencies) * 1000:6.2f} ms  erros {len(errors)}")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--linhas', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--consultas', type=int, default=2000)
+    args = parser.parse_args()
+
+    legacy_db = os.path.join(TMP_DIR, 'legado.db')
+    populate(legacy_db, args.linhas, wal=False)
+    populate(main.DATABASE, args.linhas, wal=True)
+    print(f"{args.linhas} linhas, {args.threads} threads, {args.consultas} requisições por cenário\n")
+
+    for with_writer in (False, True):
+        suffix = ' + escrita' if with_writer else ''
+        run(f"legado (connect por req.){suffix}", lambda: legacy_connection(legacy_db), lambda c: c.close(),
+            lambda: sqlite3.connect(legacy_db, check_same_thread=False), args, with_writer)
+        run(f"pool por thread + WAL{suffix}", main.get_read_db, lambda c: None,
+            lambda: main._configure_connection(sqlite3.connect(main.DATABASE, check_same_thread=False)), args, with_writer)
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Compara o roteamento antigo do chat (uma cadeia de re.search com IGNORECASE, testada em sequência)
+com o IntentRouter (uma única alternância pré-compilada sobre a mensagem normalizada).
+
+Registra intenções sintéticas além das reais para simular o crescimento do chatbot.
+Uso: python benchmarks/bench_intencoes.py [--intencoes 24] [--mensagens 20000]
+"""
+import argparse
+import random
+import re
+import time
+
+import _comum  # noqa: F401 (banco temporário e src/ no sys.path, antes do main)
+
+import main  # noqa: E402
+
+LEGACY_PATTERNS = [
+    r'(?:status|estado)\s+(?:da\s+)?(?:solicitação|solicitacao|pedido)\s+(\w+)',
+    r'(?:quantas|numero de)\s+(?:solicitações|solicitacoes|pedidos)\s+(?:estão|estao)\s+pendentes',
+    r'(?:quais|listar)\s+(?:solicitações|solicitacoes|pedidos)\s+(?:com|com mais de|acima de)\s+(\d+)\s+dias\s+(?:de\s+)?(?:atraso|atrasadas)',
+]
+
+SUBJECTS = ['fornecedor', 'comprador', 'produto', 'centro de custo', 'filial', 'contrato', 'cotacao', 'nota fiscal']
+VERBS = ['mostrar', 'listar', 'resumir', 'contar', 'exibir', 'detalhar']
+
+
+def synthetic_patterns(n):
+    patterns = []
+    for i in range(n):
+        verb = VERBS[i % len(VERBS)]
+        subject = SUBJECTS[(i // len(VERBS)) % len(SUBJECTS)]
+        patterns.append(rf'{verb}\s+(?:o\s+|a\s+)?{subject}\s+(\w+)\s+extra{i}')
+    return patterns
+
+
+def build_messages(n, extra, seed=7):
+    rnd = random.Random(seed)
+    samples = ['Status da solicitação 12345', 'quantas solicitações estão pendentes?',
+               'Listar pedidos com mais de 7 dias de atraso', 'bom dia, tudo bem?',
+               'qual o prazo médio de entrega do fornecedor acme']
+    for i in range(extra):
+        samples.append(f'{VERBS[i % len(VERBS)]} {SUBJECTS[(i // len(VERBS)) % len(SUBJECTS)]} X{i} extra{i}')
+    return [rnd.choice(samples) for _ in range(n)]
+
+
+def legacy_route(patterns, message):
+    # Mesmo custo do chat_api original: cada padrão é procurado de novo (cache interno do re incluso)
+    for index, pattern in enumerate(patterns):
+        match = re.search(pattern, message, re.IGNORECASE)
+        if match:
+            return index, match.groups()
+    return None, ()
+
+
+def run(label, fn, messages):
+    start = time.perf_counter()
+    for message in messages:
+        fn(message)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(messages) / elapsed:>12,.0f} msg/s")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--intencoes', type=int, default=24)
+    parser.add_argument('--mensagens', type=int, default=20000)
+    args = parser.parse_args()
+
+    extra = synthetic_patterns(args.intencoes)
+    legacy = LEGACY_PATTERNS + extra
+
+    router = main.IntentRouter()
+    for intent in main.chat_router.intents:
+        router.intent(intent.name, intent.pattern, intent.extract)(intent.handler)
+    for i, pattern in enumerate(extra):
+        router.intent(f'sintetica_{i}', pattern, lambda groups: {'alvo': groups[0]})(lambda cursor, alvo: alvo)
+    router.compile()
+
+    messages = build_messages(args.mensagens, args.intencoes)
+    print(f"{len(legacy)} intenções, {len(messages)} mensagens")
+    run('cadeia re.search', lambda m: legacy_route(legacy, m), messages)
+    run('IntentRouter', router.route, messages)
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Compara as intenções do chat e o dashboard respondidos pelo SQLite com o motor colunar em memória
+(ZAR_COLUMNAR_ENGINE), com o cache de respostas desligado para medir a consulta em si.
+
+Uso: python benchmarks/bench_motor_colunar.py [--linhas 200000] [--consultas 5000]
+"""
+import argparse
+import random
+import time
+
+import _comum  # noqa: F401 (banco temporário e src/ no sys.path, antes do main)
+
+import main  # noqa: E402
+
+COLS = main.INTERNAL_COLUMNS
+
+
+def synthetic_rows(n, seed=42):
+    rnd = random.Random(seed)
+    etapas = ['01_SOLICITADA', '02_COTAR', '05_COTADA', '08_PEDIDO', '10_RECEBIDA', None]
+    status = ['aprovado', 'pendente', 'finalizado', 'cancelado', 'não aprovado', '']
+    for i in range(n):
+        row = dict.fromkeys(COLS)
+        row.update({
+            'Solicitacao': str(100000 + i), 'Comprador': rnd.choice(['Miriam', 'Irineu', 'Outro']),
+            'Status': rnd.choice(status), 'Etapa': rnd.choice(etapas), 'DiasAtrSol': rnd.randint(0, 60),
+            'VlrTotal': round(rnd.uniform(10, 5000), 2), 'LeadTimeCompra': rnd.randint(0, 30),
+            'LeadTimeCompraContrato': 0, 'LeadTimeEntrega': rnd.randint(0, 40), 'AtrasoEntrega': rnd.randint(0, 10),
+        })
+        yield tuple(row[col] for col in COLS)
+
+
+def populate(n):
+    main.ensure_db() # Importar o main não cria o esquema; a primeira requisição ou carga é que cria
+    rows = main.add_row_keys(list(synthetic_rows(n)))
+    cols = COLS + main.ROW_KEY_COLUMNS
+    with main.db_writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM solicitacoes")
+        cursor.executemany(f"INSERT INTO solicitacoes ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", rows)
+        main.store_dashboard_data(cursor, main.compute_dashboard_data(cursor), 'sintetico.xlsx')
+
+
+def messages(n, linhas, seed=7):
+    rnd = random.Random(seed)
+    templates = [
+        lambda: f"status da solicitação {100000 + rnd.randrange(linhas)}",
+        lambda: "quantas solicitações estão pendentes?",
+        lambda: f"listar pedidos com mais de {rnd.choice([7, 30, 55])} dias de atraso",
+    ]
+    return [rnd.choice(templates)() for _ in range(n)]
+
+
+def measure(label, client, batch):
+    latencies = []
+    for message in batch:
+        start = time.perf_counter()
+        response = client.post('/api/chat', json={'message': message})
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{label:<22} p50 {p(0.50):7.3f} ms  p99 {p(0.99):7.3f} ms  max {latencies[-1] * 1000:7.2f} ms")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--linhas', type=int, default=200000)
+    parser.add_argument('--consultas', type=int, default=5000)
+    args = parser.parse_args()
+
+    populate(args.linhas)
+    main.chat_answer_cache.max_entries = 0
+    client = main.app.test_client()
+    batch = messages(args.consultas, args.linhas)
+    print(f"{args.linhas} linhas, {args.consultas} mensagens em /api/chat (cache de respostas desligado)\n")
+
+    main.COLUMNAR_ENGINE = False
+    measure('SQLite', client, batch)
+
+    main.COLUMNAR_ENGINE = True
+    start = time.perf_counter()
+    dataset = main.get_columnar_dataset()
+    print(f"{'carga do motor':<22} {(time.perf_counter() - start) * 1000:7.1f} ms ({dataset.size} linhas)")
+    measure('motor colunar', client, batch)
+
+    # Handlers isolados, sem o custo do Flask
+    for name, params in [('status_solicitacao', {'solicitacao_id': '150000'}), ('pendentes', {}), ('atraso', {'dias_atraso': 30})]:
+        intent = main.chat_router.get(name)
+        cursor = main.get_read_db().cursor()
+        for label, call in (('SQLite', lambda: intent.handler(cursor, **params)),
+                            ('motor', lambda: main.chat_router.columnar_handlers[name](dataset, **params))):
+            start = time.perf_counter()
+            for _ in range(200):
+                call()
+            print(f"  {name:<20} {label:<7} {(time.perf_counter() - start) / 200 * 1e6:9.1f} µs")
+
+    start = time.perf_counter()
+    main.compute_dashboard_data(main.get_read_db().cursor())
+    print(f"\n{'dashboard SQLite':<22} {(time.perf_counter() - start) * 1000:7.1f} ms")
+    start = time.perf_counter()
+    dataset._dashboard = None
+    dataset.dashboard_data()
+    print(f"{'dashboard motor':<22} {(time.perf_counter() - start) * 1000:7.1f} ms (calculado uma vez por versão)")
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Mede a conversão das colunas de data (DtAprovSol, DtAprovPedido, DtPedido, DtEntregaOrig, DtReceb) e de preço
+(PrecoUnitario, VlrTotal) na ingestão, sobre linhas do gerador_planilhas em blocos de STREAM_CHUNK_SIZE, como na
+leitura do Excel. Tempos reportados por 100 mil linhas.
+
+Compara três formas de converter as mesmas colunas:
+  célula a célula   parse_date/clean_price em cada célula (medido numa amostra e projetado para 100 mil);
+  distintos/bloco   parse_date em cada valor distinto do bloco e limpeza de preço célula a célula (regex);
+  ColumnParsers     formato inferido uma vez por coluna, só os distintos ainda não vistos na carga são convertidos.
+Mostra também o transform_dataframe inteiro com um ColumnParsers por carga e um novo a cada bloco.
+
+Uso: python benchmarks/bench_transformacao.py [--linhas 100000] [--amostra-celula 2000] [--repeticoes 3]
+"""
+import argparse
+import time
+import warnings
+
+import _comum  # noqa: F401 (banco temporário e src/ no sys.path, antes do main)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import main  # noqa: E402
+from gerador_planilhas import cabecalho, gerar_linhas  # noqa: E402
+
+main.logger.setLevel('ERROR')
+# O parse_date avisa a cada data ambígua (ex.: 31/02); os avisos só atrapalhariam a leitura dos resultados
+warnings.filterwarnings('ignore', category=UserWarning)
+
+COLUNAS_DATA = ['DtAprovSol', 'DtAprovPedido', 'DtPedido', 'DtEntregaOrig', 'DtReceb']
+
+
+def blocos(linhas, semente):
+    header = cabecalho()
+    present_original_cols, _ = main.map_excel_columns(header)
+    df = pd.DataFrame(list(gerar_linhas(linhas, semente)), columns=header)
+    return [df.iloc[i:i + main.STREAM_CHUNK_SIZE] for i in range(0, len(df), main.STREAM_CHUNK_SIZE)], present_original_cols
+
+
+def por_celula(frames, cols):
+    for frame in frames:
+        for col in COLUNAS_DATA:
+            [main.parse_date(v) for v in frame[cols[col]]]
+        for col in main.PRICE_COLUMNS:
+            [main.clean_price(v) for v in frame[cols[col]]]
+
+
+def distintos_por_bloco(frames, cols):
+    # Conversão anterior ao ColumnParsers: parse_date por valor distinto do bloco, regex em todas as células de preço
+    for frame in frames:
+        for col in COLUNAS_DATA:
+            values = frame[cols[col]].astype(object)
+            codes, uniques = pd.factorize(values[values.notna()])
+            np.array([main.parse_date(u) for u in uniques], dtype=object)[codes]
+        for col in main.PRICE_COLUMNS:
+            cleaned = frame[cols[col]].astype(object).astype(str).str.replace(r'[R$\s.]', '', regex=True).str.replace(',', '.', regex=False)
+            codes, uniques = pd.factorize(cleaned)
+            converted = []
+            for u in uniques:
+                try:
+                    converted.append(float(u) if u else None)
+                except ValueError:
+                    converted.append(None)
+            np.array(converted, dtype=object)[codes]
+
+
+def column_parsers(frames, cols):
+    parsers = main.ColumnParsers()
+    for frame in frames:
+        for col in COLUNAS_DATA:
+            parsers.dates(col, frame[cols[col]])
+        for col in main.PRICE_COLUMNS:
+            parsers.prices(col, frame[cols[col]])
+    return parsers
+
+
+def transform_por_carga(frames, cols):
+    parsers = main.ColumnParsers()
+    for frame in frames:
+        main.transform_dataframe(frame, cols, parsers)
+
+
+def transform_por_bloco(frames, cols):
+    for frame in frames:
+        main.transform_dataframe(frame, cols)
+
+
+def melhor_tempo(funcao, frames, cols, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        start = time.perf_counter()
+        funcao(frames, cols)
+        tempos.append(time.perf_counter() - start)
+    return min(tempos)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--linhas', type=int, default=100000)
+    parser.add_argument('--amostra-celula', type=int, default=2000)
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    frames, cols = blocos(args.linhas, args.semente)
+    escala = 100000 / args.linhas
+    amostra = [frames[0].iloc[:args.amostra_celula]]
+    celula = melhor_tempo(por_celula, amostra, cols, 1) * 100000 / len(amostra[0])
+    distintos = melhor_tempo(distintos_por_bloco, frames, cols, args.repeticoes) * escala
+    parsers = melhor_tempo(column_parsers, frames, cols, args.repeticoes) * escala
+    print(f"{args.linhas} linhas em blocos de {main.STREAM_CHUNK_SIZE}; tempos por 100 mil linhas\n")
+    print("Conversão de datas e preços:")
+    print(f"  {'célula a célula':<18} {celula:8.2f} s  (projetado de {len(amostra[0])} linhas)")
+    print(f"  {'distintos/bloco':<18} {distintos:8.2f} s  ({celula / distintos:6.1f}x mais rápido que célula a célula)")
+    print(f"  {'ColumnParsers':<18} {parsers:8.2f} s  ({celula / parsers:6.1f}x mais rápido que célula a célula, "
+          f"{distintos / parsers:.1f}x que distintos/bloco)")
+
+    por_carga = melhor_tempo(transform_por_carga, frames, cols, args.repeticoes) * escala
+    por_bloco = melhor_tempo(transform_por_bloco, frames, cols, args.repeticoes) * escala
+    print("\ntransform_dataframe completo:")
+    print(f"  {'parsers por carga':<18} {por_carga:8.2f} s")
+    print(f"  {'parsers por bloco':<18} {por_bloco:8.2f} s")
+
+    resultado = column_parsers(frames, cols)
+    print(f"\nFormatos inferidos: {resultado.date_formats}")
+    print(f"Valores inválidos por coluna: {resultado.invalid}")
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Gera planilhas sintéticas de compras no formato exportado pelo ERP (cabeçalhos do COLUMN_MAPPING),
+reprodutíveis pela semente: mesma semente e mesmo número de linhas produzem o mesmo arquivo.
+
+Como no Excel real, o cabeçalho de preço vem por padrão na variação corrompida 'Pre‡o Unit\tário', as datas são
+textos dd/mm/aaaa e os preços textos 'R$ 1.234,56'. As etapas seguem o fluxo da compra (sem pedido antes de
+'08_PEDIDO', sem recebimento antes de '10_RECEBIDA') e uma pequena fração das datas é inválida.
+
+Uso: python benchmarks/gerador_planilhas.py saida.xlsx [--linhas 100000] [--semente 42] [--cabecalho correto]
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+import numpy as np
+from openpyxl import Workbook
+
+CABECALHO_PRECO = {'corrompido': 'Pre‡o Unit\tário', 'correto': 'Preço Unitário'}
+ETAPAS = ['01_SOLICITADA', '02_COTAR', '05_COTADA', '08_PEDIDO', '10_RECEBIDA']
+ETAPAS_PESOS = [0.10, 0.15, 0.10, 0.25, 0.40]
+ESTADOS = ['aprovado', 'Aprovado ', 'pendente', 'finalizado', 'cancelado', 'Nao aprovado', None]
+ESTADOS_PESOS = [0.45, 0.05, 0.20, 0.15, 0.07, 0.05, 0.03]
+# Variações de caixa/espaços que o transform normaliza, mais compradores fora da lista (viram 'Outro')
+COMPRADORES = ['Miriam', 'Irineu', 'miriam ', ' IRINEU', 'Carlos', 'Ana Paula', None]
+COMPRADORES_PESOS = [0.38, 0.38, 0.05, 0.05, 0.07, 0.05, 0.02]
+ITENS = ['PARAFUSO SEXTAVADO', 'LUVA NITRÍLICA', 'CABO FLEXÍVEL', 'ROLAMENTO', 'PAPEL A4', 'TONER',
+         'DISJUNTOR', 'VÁLVULA ESFERA', 'CORREIA DENTADA', 'ÓLEO HIDRÁULICO', 'FILTRO DE AR', 'ELETRODO']
+DATA_INICIAL = date(2023, 1, 2)
+DIAS_NO_PERIODO = 730
+TAXA_DATAS_INVALIDAS = 0.002
+
+
+def cabecalho(variante='corrompido'):
+    return ['Solicitação', 'DtAprovSol', 'Comprador', 'Fornec', 'Descrição', 'Qt.Solicitada',
+            CABECALHO_PRECO[variante], 'Vlr Total', 'DtAprovPedido', 'Dt.Pedido', 'Pedido', 'Dt.EntregaOrig',
+            'Dt.Receb', 'Estado', 'Etapa', 'Dias Atr Sol']
+
+
+def _moeda(valor):
+    # 1234.5 -> 'R$ 1.234,50'
+    return 'R$ ' + f'{valor:,.2f}'.translate(str.maketrans(',.', '.,'))
+
+
+def _datas(rng, dias, presentes):
+    # Dias desde DATA_INICIAL -> 'dd/mm/aaaa' (None onde a data não existe); algumas viram 31/02 (inválida)
+    tabela = np.array([(DATA_INICIAL + timedelta(days=d)).strftime('%d/%m/%Y') for d in range(DIAS_NO_PERIODO + 200)], dtype=object)
+    textos = np.full(len(dias), None, dtype=object)
+    textos[presentes] = tabela[np.clip(dias[presentes], 0, len(tabela) - 1)]
+    invalidas = presentes & (rng.random(len(dias)) < TAXA_DATAS_INVALIDAS)
+    textos[invalidas] = '31/02/2024'
+    return textos
+
+
+def gerar_linhas(linhas, semente=42):
+    # Gera as linhas (tuplas na ordem de cabecalho()) em blocos, sem montar a planilha inteira na memória
+    rng = np.random.default_rng(semente)
+    bloco = 50000
+    solicitacao = 100000
+    for inicio in range(0, linhas, bloco):
+        n = min(bloco, linhas - inicio)
+        # Solicitações com 1 a 3 itens seguidos
+        novos = rng.random(n) < 0.6
+        novos[0] = True
+        solicitacoes = solicitacao + np.cumsum(novos)
+        solicitacao = int(solicitacoes[-1])
+
+        etapa = rng.choice(len(ETAPAS), size=n, p=ETAPAS_PESOS)
+        com_pedido = etapa >= 3
+        recebida = etapa == 4
+        aprov_sol = rng.integers(0, DIAS_NO_PERIODO, size=n)
+        # ~5% de contratos: pedido emitido antes da aprovação da solicitação
+        pedido_dias = aprov_sol + np.where(rng.random(n) < 0.05, -rng.integers(1, 30, size=n), rng.integers(0, 25, size=n))
+        aprov_pedido = pedido_dias + rng.integers(0, 4, size=n)
+        entrega_orig = pedido_dias + rng.integers(5, 45, size=n)
+        receb = entrega_orig + rng.integers(-7, 20, size=n)
+
+        qtde = rng.integers(1, 500, size=n)
+        preco = np.round(rng.lognormal(3.5, 1.2, size=n), 2)
+        pedidos = 4500000 + rng.integers(0, max(linhas, 1000), size=n)
+
+        colunas = [
+            solicitacoes.tolist(),
+            _datas(rng, aprov_sol, np.ones(n, dtype=bool)),
+            rng.choice(np.array(COMPRADORES, dtype=object), size=n, p=COMPRADORES_PESOS),
+            [f'FORNECEDOR {f:04d} LTDA' for f in rng.integers(0, 400, size=n)],
+            [f'{ITENS[p % len(ITENS)]} {p:05d}' for p in rng.integers(0, 5000, size=n)],
+            qtde.tolist(),
+            [_moeda(p) for p in preco],
+            [_moeda(v) for v in np.round(preco * qtde, 2)],
+            _datas(rng, aprov_pedido, com_pedido),
+            _datas(rng, pedido_dias, com_pedido),
+            np.where(com_pedido, pedidos, None).tolist(),
+            _datas(rng, entrega_orig, com_pedido),
+            _datas(rng, receb, recebida),
+            rng.choice(np.array(ESTADOS, dtype=object), size=n, p=ESTADOS_PESOS),
+            np.array(ETAPAS, dtype=object)[etapa],
+            rng.integers(0, 90, size=n).tolist(),
+        ]
+        yield from zip(*colunas)
+
+
+def gerar_planilha(caminho, linhas, semente=42, variante_cabecalho='corrompido'):
+    # Grava a planilha com o openpyxl em modo write-only (linha a linha, memória constante)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Planilha1')
+    ws.append(cabecalho(variante_cabecalho))
+    for linha in gerar_linhas(linhas, semente):
+        ws.append(linha)
+    wb.save(caminho)
+    return caminho
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('saida')
+    parser.add_argument('--linhas', type=int, default=100000)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--cabecalho', choices=sorted(CABECALHO_PRECO), default='corrompido')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    gerar_planilha(args.saida, args.linhas, args.semente, args.cabecalho)
+    print(f"{args.linhas} linhas gravadas em {args.saida} ({time.perf_counter() - start:.1f} s)")
+
+
+if __name__ == '__main__':
+    main()
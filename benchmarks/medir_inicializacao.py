@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Mede, em processos Python novos, o custo de subir cada papel do sistema: tempo de importação do main, tempo do
+primeiro trabalho e memória residente (RSS) ao final, e se pandas/numpy chegaram a ser carregados.
+
+Papéis medidos:
+  importacao  só `import main` (o que todo processo paga: worker web, worker do pool de ingestão, scripts);
+  web         importação + primeiras requisições (/admin/api/dashboard e /api/chat) pelo test client do Flask;
+  ingestao    importação + carga de uma planilha pequena por process_and_load_excel;
+  pool        importação + parse_sheet de uma planilha, como um processo do pool de ingestão (spawn).
+
+Uso: python benchmarks/medir_inicializacao.py [--repeticoes 5] [--linhas 2000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from _comum import SRC_DIR, TMP_DIR
+
+from gerador_planilhas import gerar_planilha  # noqa: E402
+
+PAPEIS = ('importacao', 'web', 'ingestao', 'pool')
+
+# Roda no processo filho: importa o main, executa o trabalho do papel e imprime as medidas em JSON
+FILHO = r'''
+import json, os, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+import main
+importacao = time.perf_counter() - start
+main.logger.setLevel('WARNING')
+papel, planilha = {papel!r}, {planilha!r}
+start = time.perf_counter()
+if papel == 'web':
+    client = main.app.test_client()
+    assert client.get('/admin/api/dashboard').status_code == 401
+    assert client.post('/api/chat', json={{'message': 'ajuda'}}).status_code == 200
+elif papel == 'ingestao':
+    ok, message = main.process_and_load_excel(planilha, content_hash=None)
+    assert ok, message
+elif papel == 'pool':
+    main.parse_sheet(planilha, None)
+trabalho = time.perf_counter() - start
+print(json.dumps({{'importacao': importacao, 'trabalho': trabalho, 'rss': main.resident_memory_bytes(),
+                  'pandas': 'pandas' in sys.modules, 'numpy': 'numpy' in sys.modules}}))
+'''
+
+
+def medir(papel, planilha, repeticao):
+    env = dict(os.environ)
+    # Banco novo a cada execução: mede também a criação do esquema na primeira requisição/carga
+    env['ZAR_DATABASE'] = os.path.join(TMP_DIR, f'{papel}_{repeticao}.db')
+    env['ZAR_SNAPSHOT_DIR'] = os.path.join(TMP_DIR, f'snapshots_{papel}_{repeticao}')
+    codigo = FILHO.format(src=os.path.abspath(SRC_DIR), papel=papel, planilha=planilha)
+    saida = subprocess.run([sys.executable, '-c', codigo], cwd=TMP_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--linhas', type=int, default=2000)
+    args = parser.parse_args()
+
+    planilha = gerar_planilha(os.path.join(TMP_DIR, 'pequena.xlsx'), args.linhas)
+    print(f"{args.repeticoes} processos por papel, planilha de {args.linhas} linhas (medianas)\n")
+    for papel in PAPEIS:
+        medidas = [medir(papel, planilha, i) for i in range(args.repeticoes)]
+        mediana = lambda chave: statistics.median(m[chave] for m in medidas)
+        bibliotecas = 'sim' if medidas[-1]['pandas'] or medidas[-1]['numpy'] else 'não'
+        print(f"{papel:<11} importação {mediana('importacao') * 1000:7.1f} ms  trabalho {mediana('trabalho') * 1000:8.1f} ms  "
+              f"RSS {mediana('rss') / 2**20:6.1f} MiB  pandas/numpy carregados: {bibliotecas}")
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Suíte de desempenho dos três caminhos quentes — ingestão (process_and_load_excel), dashboard
+(get_dashboard_data e o recálculo compute_dashboard_data) e chat (/api/chat pelo test client do Flask) —
+sobre planilhas do gerador_planilhas em várias escalas.
+
+Cada medida é reportada como vazão (linhas ou requisições por segundo) e percentis de latência. Os resultados
+podem ser gravados como baseline (JSON) e as execuções seguintes são comparadas com ele: p50/p90 acima da
+tolerância contam como regressão e o script sai com código 1. O p99 é reportado, mas não entra na comparação
+por oscilar demais entre execuções.
+
+O baseline compartilhado fica em benchmarks/baseline.json (escalas 1000 e 10000, versionado). Máquina,
+frequência da CPU e carga do sistema variam entre execuções; por isso cada execução mede também uma carga fixa
+de referência (Python + SQLite em memória) e a comparação usa os tempos relativos a ela, não os absolutos.
+Quem muda o desempenho de propósito grava o baseline de novo com --salvar-baseline e o versiona junto.
+
+As planilhas geradas ficam em cache em --planilhas (mesma escala e semente = mesmo arquivo).
+Uso: python benchmarks/suite_desempenho.py [--escalas 1000,10000,100000] [--repeticoes 3] [--consultas 2000]
+                                           [--salvar-baseline] [--baseline benchmarks/baseline.json]
+Para 1M de linhas: --escalas 1000000 --repeticoes 1 (só a geração da planilha leva alguns minutos).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from _comum import BENCH_DIR
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import main  # noqa: E402
+from gerador_planilhas import gerar_planilha  # noqa: E402
+
+main.logger.setLevel(logging.WARNING) # Os logs de cada carga encobririam os resultados
+
+BASELINE_PADRAO = os.path.join(BENCH_DIR, 'baseline.json')
+METRICAS_COMPARADAS = ('p50_ms', 'p90_ms')
+REFERENCIA_LINHAS = 50000
+
+
+def resumo(latencias, itens_por_amostra=1):
+    # Percentis (ms) e vazão (itens/s) de uma lista de latências em segundos
+    ordenadas = sorted(latencias)
+    p = lambda q: ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))] * 1000
+    return {
+        'amostras': len(ordenadas),
+        'p50_ms': round(p(0.50), 3),
+        'p90_ms': round(p(0.90), 3),
+        'p99_ms': round(p(0.99), 3),
+        'max_ms': round(ordenadas[-1] * 1000, 3),
+        'por_s': round(len(ordenadas) * itens_por_amostra / sum(ordenadas), 1),
+    }
+
+
+def planilha(diretorio, linhas, semente):
+    caminho = os.path.join(diretorio, f'compras_{linhas}_{semente}.xlsx')
+    if not os.path.exists(caminho):
+        start = time.perf_counter()
+        gerar_planilha(caminho, linhas, semente)
+        print(f"  planilha de {linhas} linhas gerada em {time.perf_counter() - start:.1f} s")
+    return caminho
+
+
+def medir_ingestao(caminho, linhas, repeticoes):
+    # O hash do conteúdo decide se a carga é pulada ou lida do snapshot; cada repetição usa um hash próprio
+    # para que todas leiam o Excel de verdade. Depois, alternar entre os dois últimos hashes (snapshots ainda não
+    # descartados por SNAPSHOT_KEEP) mede a carga via snapshot.
+    base = main.file_content_hash(caminho)
+    hashes = [f'{base}-{i}' for i in range(max(repeticoes, 2))]
+    excel, snapshot = [], []
+    for content_hash in hashes[:repeticoes]:
+        start = time.perf_counter()
+        ok, message = main.process_and_load_excel(caminho, content_hash=content_hash)
+        excel.append(time.perf_counter() - start)
+        assert ok, message
+    if repeticoes == 1: # Garante um hash publicado diferente do que será relido
+        main.process_and_load_excel(caminho, content_hash=hashes[1])
+    for i in range(repeticoes):
+        start = time.perf_counter()
+        ok, message = main.process_and_load_excel(caminho, content_hash=hashes[len(hashes) - 2 + i % 2])
+        snapshot.append(time.perf_counter() - start)
+        assert ok, message
+    return resumo(excel, linhas), resumo(snapshot, linhas)
+
+
+def medir_dashboard(consultas, repeticoes):
+    leituras = []
+    for _ in range(consultas):
+        start = time.perf_counter()
+        data = main.get_dashboard_data()
+        leituras.append(time.perf_counter() - start)
+    assert not data.get('tabela_vazia'), data
+    recalculos = []
+    cursor = main.get_read_db().cursor()
+    for _ in range(repeticoes):
+        start = time.perf_counter()
+        main.compute_dashboard_data(cursor)
+        recalculos.append(time.perf_counter() - start)
+    return resumo(leituras), resumo(recalculos)
+
+
+def mensagens_chat(n, solicitacoes, semente=7):
+    rnd = random.Random(semente)
+    modelos = [
+        lambda: f"status da solicitação {rnd.choice(solicitacoes)}",
+        lambda: "quantas solicitações estão pendentes?",
+        lambda: f"listar pedidos com mais de {rnd.choice([7, 30, 60, 85])} dias de atraso",
+        lambda: "mostrar mais",
+    ]
+    return [rnd.choice(modelos)() for _ in range(n)]
+
+
+def medir_chat(client, mensagens):
+    latencias = []
+    for mensagem in mensagens:
+        start = time.perf_counter()
+        response = client.post('/api/chat', json={'message': mensagem})
+        latencias.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data
+    return resumo(latencias)
+
+
+def executar(args):
+    os.makedirs(args.planilhas, exist_ok=True)
+    client = main.app.test_client()
+    max_entries = main.chat_answer_cache.max_entries
+    resultados = {}
+    for linhas in args.escalas:
+        print(f"\n{linhas} linhas")
+        caminho = planilha(args.planilhas, linhas, args.semente)
+        medidas = {}
+        medidas['ingestao_excel'], medidas['ingestao_snapshot'] = medir_ingestao(caminho, linhas, args.repeticoes)
+        medidas['dashboard_leitura'], medidas['dashboard_recalculo'] = medir_dashboard(args.consultas, args.repeticoes)
+
+        solicitacoes = [row[0] for row in main.get_read_db().execute("SELECT DISTINCT Solicitacao FROM solicitacoes LIMIT 5000")]
+        mensagens = mensagens_chat(args.consultas, solicitacoes, args.semente)
+        main.chat_answer_cache.max_entries = 0 # Sem cache: mede a consulta de cada mensagem
+        medidas['chat_sem_cache'] = medir_chat(client, mensagens)
+        main.chat_answer_cache.max_entries = max_entries
+        main.chat_answer_cache.clear()
+        medidas['chat_com_cache'] = medir_chat(client, mensagens)
+
+        for nome, medida in medidas.items():
+            print(f"  {nome:<22} p50 {medida['p50_ms']:10.3f} ms  p90 {medida['p90_ms']:10.3f} ms  "
+                  f"p99 {medida['p99_ms']:10.3f} ms  {medida['por_s']:>12,.1f}/s")
+        resultados[str(linhas)] = medidas
+    return resultados
+
+
+def referencia(repeticoes=5):
+    # Mediana (ms) de uma carga fixa que não depende do main: inserção, índice e GROUP BY num SQLite em memória
+    tempos = []
+    for _ in range(repeticoes):
+        start = time.perf_counter()
+        conn = sqlite3.connect(':memory:')
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, chave TEXT, valor REAL)")
+        conn.executemany("INSERT INTO t (chave, valor) VALUES (?, ?)",
+                         ((f'chave {i % 997}', i * 0.5) for i in range(REFERENCIA_LINHAS)))
+        conn.execute("CREATE INDEX t_chave ON t (chave)")
+        conn.execute("SELECT chave, SUM(valor) FROM t GROUP BY chave").fetchall()
+        conn.close()
+        tempos.append(time.perf_counter() - start)
+    return statistics.median(tempos) * 1000
+
+
+def ambiente():
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'processador': platform.machine(),
+        'sqlite': sqlite3.sqlite_version,
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'motor_colunar': main.COLUMNAR_ENGINE,
+    }
+
+
+def comparar(resultados, referencia_ms, baseline, tolerancia):
+    # Lista de (escala, medida, métrica, esperado, atual) que pioraram além da tolerância. O esperado é o valor
+    # do baseline escalado pela razão entre as referências das duas execuções
+    fator = referencia_ms / baseline['ambiente']['referencia_ms']
+    regressoes = []
+    for escala, medidas in resultados.items():
+        for nome, medida in medidas.items():
+            anterior = baseline.get('resultados', {}).get(escala, {}).get(nome)
+            if not anterior:
+                continue
+            for metrica in METRICAS_COMPARADAS:
+                esperado = anterior[metrica] * fator
+                if medida[metrica] > esperado * (1 + tolerancia):
+                    regressoes.append((escala, nome, metrica, esperado, medida[metrica]))
+    return regressoes
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--escalas', type=lambda s: [int(v) for v in s.split(',')], default=[1000, 10000, 100000])
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--consultas', type=int, default=2000)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--planilhas', default=os.path.join(tempfile.gettempdir(), 'zar_planilhas_bench'))
+    parser.add_argument('--baseline', default=BASELINE_PADRAO)
+    parser.add_argument('--salvar-baseline', action='store_true')
+    parser.add_argument('--tolerancia', type=float, default=0.25)
+    parser.add_argument('--saida', help='grava também os resultados desta execução neste JSON')
+    args = parser.parse_args()
+
+    antes = referencia()
+    atual = {'ambiente': ambiente(), 'resultados': executar(args)}
+    # Referência medida antes e depois das medidas, para pegar também a variação durante a execução
+    atual['ambiente']['referencia_ms'] = round((antes + referencia()) / 2, 3)
+    print(f"\nReferência (carga fixa): {atual['ambiente']['referencia_ms']:.1f} ms")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(atual, f, ensure_ascii=False, indent=2)
+
+    if args.salvar_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(atual, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline gravado em {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nSem baseline em {args.baseline}; rode com --salvar-baseline para criar um.")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if 'referencia_ms' not in baseline['ambiente']:
+        print(f"\nBaseline em {args.baseline} sem medida de referência; grave-o de novo com --salvar-baseline.")
+        return 0
+    if baseline['ambiente'].get('plataforma') != atual['ambiente']['plataforma']:
+        print(f"\nAviso: baseline gravado em outro ambiente ({baseline['ambiente'].get('plataforma')}); "
+              f"a referência só desconta diferenças de velocidade, não de arquitetura.")
+    regressoes = comparar(atual['resultados'], atual['ambiente']['referencia_ms'], baseline, args.tolerancia)
+    if not regressoes:
+        print(f"\nNenhuma regressão acima de {args.tolerancia:.0%} em relação ao baseline de {baseline['ambiente']['data']} "
+              f"(referência lá: {baseline['ambiente']['referencia_ms']:.1f} ms).")
+        return 0
+    print(f"\nRegressões acima de {args.tolerancia:.0%} (esperado = baseline x {atual['ambiente']['referencia_ms']:.1f} / "
+          f"{baseline['ambiente']['referencia_ms']:.1f} ms de referência):")
+    for escala, nome, metrica, esperado, valor in regressoes:
+        print(f"  {escala} linhas  {nome:<22} {metrica}: esperado {esperado:.3f} -> {valor:.3f} ({valor / esperado - 1:+.0%})")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main_bench())
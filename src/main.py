@@ -1,15 +1,52 @@
 # -*- coding: utf-8 -*-
+import time
+_IMPORT_STARTED = time.perf_counter()
 import os
+import sys
 import sqlite3
-import pandas as pd
+import importlib
+import inspect
 import hashlib
+import hmac
+import base64
+import json
+import csv
+import io
+import tempfile
 import re
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+import unicodedata
+import itertools
+import uuid
+import zipfile
+import threading
+import bisect
+import multiprocessing
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict, namedtuple
+from datetime import datetime, date
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, Response, stream_with_context, g
 from werkzeug.utils import secure_filename
-import numpy as np
 import logging
 
+# pandas e numpy (e o openpyxl, que vem junto na leitura do Excel) só servem à ingestão, aos snapshots e ao
+# motor colunar. Custam centenas de ms e dezenas de MB por processo, então são importados no primeiro uso:
+# um worker que só atende chat, login e dashboard nunca os carrega.
+class _LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+pd = _LazyModule('pandas')
+np = _LazyModule('numpy')
+
 # --- Configuração de Logging ---
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,9 +60,48 @@ app.secret_key = os.urandom(24)
 SRC_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(SRC_DIR)
 
-DATABASE = os.path.join(BASE_DIR, 'database.db')
+DATABASE = os.environ.get('ZAR_DATABASE', os.path.join(BASE_DIR, 'database.db'))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
+# Snapshots .npz das planilhas já processadas (um por conteúdo). Retenção: ficam os SNAPSHOT_KEEP mais recentes,
+# e os com mais de SNAPSHOT_MAX_AGE_DAYS dias (0 = sem limite) também saem; o da versão publicada nunca sai.
+# Os agregados de tendência de cada versão (tendencia_rollup) ficam no banco mesmo sem o snapshot.
+SNAPSHOT_FOLDER = os.environ.get('ZAR_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'snapshots'))
+SNAPSHOT_KEEP = int(os.environ.get('ZAR_SNAPSHOT_KEEP', 5))
+SNAPSHOT_MAX_AGE_DAYS = float(os.environ.get('ZAR_SNAPSHOT_MAX_AGE_DAYS', 0))
 ALLOWED_EXTENSIONS = {'xlsx'}
+# Arquivos a partir deste tamanho são lidos em modo streaming (openpyxl read-only, em blocos)
+STREAMING_MIN_FILE_SIZE = 10 * 1024 * 1024
+STREAM_CHUNK_SIZE = 10000
+# Linhas lidas antes do primeiro bloco para decidir quais colunas de data o pd.read_excel leria como datetime64
+STREAM_DATE_SCAN_ROWS = 50000
+# Cargas com várias planilhas ou pastas de trabalho: cada planilha é lida e transformada num processo
+# do pool (padrão: um processo por núcleo disponível; 1 = tudo no próprio processo, sem pool)
+INGESTION_PROCESSES = int(os.environ.get('ZAR_INGESTION_PROCESSES', 0)) or (
+    len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1)
+# Cache de respostas do chatbot: número máximo de entradas e validade em segundos (0 = sem expiração;
+# a troca de versão do conjunto de dados já invalida tudo)
+CHAT_CACHE_MAX_ENTRIES = int(os.environ.get('ZAR_CHAT_CACHE_MAX_ENTRIES', 1024))
+CHAT_CACHE_TTL = float(os.environ.get('ZAR_CHAT_CACHE_TTL', 0))
+# Listas do chatbot: linhas por página em /api/chat ("mostrar mais") e por bloco em /api/chat/stream
+CHAT_PAGE_SIZE = 20
+CHAT_STREAM_BATCH_SIZE = 500
+# Buscas do chatbot (índice FTS5): resultados mostrados e ocorrências mais recentes ordenadas por relevância
+CHAT_SEARCH_LIMIT = 10
+CHAT_SEARCH_CANDIDATES = 200
+# API do dashboard: linhas por página da tabela de cotações atrasadas (padrão e máximo aceito em ?tamanho=)
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 500
+# Exportação de solicitações: linhas lidas do cursor por bloco e tamanho dos pedaços do .xlsx enviados na resposta
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FILE_CHUNK_SIZE = 64 * 1024
+# Motor colunar em memória (opcional): chat e dashboard respondidos a partir de arrays NumPy
+COLUMNAR_ENGINE = os.environ.get('ZAR_COLUMNAR_ENGINE', '0') == '1'
+# Logs de lentidão (opcionais): consultas SQL e requisições acima destes limites, em ms, viram WARNING (0 = desligado)
+SLOW_QUERY_MS = float(os.environ.get('ZAR_SLOW_QUERY_MS', 0))
+SLOW_REQUEST_MS = float(os.environ.get('ZAR_SLOW_REQUEST_MS', 0))
+# /metrics exige sessão do admin ou, para o coletor (Prometheus), o cabeçalho 'Authorization: Bearer <token>'
+# com este token. Sem token configurado só a sessão do admin passa.
+METRICS_TOKEN = os.environ.get('ZAR_METRICS_TOKEN', '')
 ADMIN_PASSWORD_HASH = hashlib.sha256('#compras321!'.encode()).hexdigest()
 
 if not os.path.exists(UPLOAD_FOLDER):
@@ -63,8 +139,12 @@ INTERNAL_COLUMNS = [
     'Produto', 'Qtde', 'PrecoUnitario', 'PrecoUnitarioOrig', 'Moeda', 'VlrTotal',
     'DtAprovPedido', 'DtPedido', 'Pedido', 'DtEntregaOrig', 'DtEntregaAtual',
     'DtReceb', 'Status', 'Etapa', 'DiasAtrSol',
-    'LeadTimeCompra', 'LeadTimeEntrega', 'AtrasoEntrega'
+    'LeadTimeCompra', 'LeadTimeCompraContrato', 'LeadTimeEntrega', 'AtrasoEntrega'
 ]
+# Cada linha carregada leva sua chave natural (com o número da ocorrência, pois a combinação pode se
+# repetir na planilha) e o hash do conteúdo mapeado: é o que a carga incremental compara.
+NATURAL_KEY_COLUMNS = ['Solicitacao', 'Pedido', 'Produto']
+ROW_KEY_COLUMNS = ['ChaveNatural', 'HashLinha']
 
 # --- Funções Auxiliares ---
 def allowed_file(filename):
@@ -125,191 +205,1079 @@ def calculate_atraso_entrega(dt_receb_str, dt_entrega_orig_str):
     delta = (dt_receb - dt_entrega_orig).days
     return max(0, delta)
 
+# --- Métricas e Instrumentação ---
+# Contadores e histogramas em memória, expostos em /metrics no formato texto do Prometheus. Os valores são
+# por processo: com vários workers do gunicorn, cada coleta vê só o worker que atendeu a requisição.
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+INGESTION_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+METRICS = []
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{{{_label_text(self.labels, label_values)}}} {value}' for label_values, value in values)
+        return lines
+
+class Histogram:
+    # Guarda a contagem de cada faixa (não acumulada) e a soma; render() acumula como o Prometheus espera
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.labels, self.buckets = name, help_text, tuple(labels), list(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value) # Primeira faixa com le >= valor; len(buckets) = +Inf
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            series = sorted((label_values, list(counts), total) for label_values, (counts, total) in self._series.items())
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_values, counts, total in series:
+            labels = _label_text(self.labels, label_values)
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+def render_metrics(extra_lines=()):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+REQUEST_SECONDS = Histogram('zar_http_request_duration_seconds', 'Tempo de resposta por rota (até o envio dos cabeçalhos).',
+                            ('rota', 'metodo', 'status'))
+QUERY_SECONDS = Histogram('zar_sql_query_duration_seconds', 'Tempo de cada consulta SQL nomeada (execute + fetch).', ('consulta',))
+QUERY_ROWS = Counter('zar_sql_query_rows_total', 'Linhas devolvidas pelas consultas SQL nomeadas.', ('consulta',))
+INGESTION_STAGE_SECONDS = Histogram('zar_ingestion_stage_duration_seconds', 'Tempo total de cada etapa por carga de planilha.',
+                                    ('etapa',), INGESTION_BUCKETS)
+INGESTION_ROWS = Counter('zar_ingestion_rows_total', 'Linhas processadas e descartadas pelas cargas.', ('resultado',))
+INGESTION_INVALID_VALUES = Counter('zar_ingestion_invalid_values_total', 'Datas e preços inválidos nas cargas, por coluna.', ('coluna',))
+CHAT_INTENTS = Counter('zar_chat_intent_total', 'Mensagens do chatbot por intenção reconhecida.', ('intencao',))
+
+def record_query(name, sql, elapsed, rows):
+    QUERY_SECONDS.observe(elapsed, name)
+    QUERY_ROWS.inc(name, amount=rows)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning(f"Consulta lenta '{name}': {elapsed * 1000:.1f} ms, {rows} linhas. SQL: {' '.join(sql.split())}")
+
+def timed_query(conn_or_cursor, name, sql, params=(), fetch='all'):
+    # Executa a consulta e já busca o resultado (fetchall, ou fetchone com fetch='one'), medindo os dois
+    start = time.perf_counter()
+    cursor = conn_or_cursor.execute(sql, params)
+    if fetch == 'one':
+        result = cursor.fetchone()
+        rows = 0 if result is None else 1
+    else:
+        result = cursor.fetchall()
+        rows = len(result)
+    record_query(name, sql, time.perf_counter() - start, rows)
+    return result
+
+class StageTimer:
+    # Acumula o tempo de cada etapa de uma carga (várias passagens por bloco somam na mesma etapa)
+    # e os valores inválidos por coluna contados na transformação
+    def __init__(self):
+        self.totals = {}
+        self.invalid = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+    def iterate(self, name, iterable):
+        # Repassa os itens contando como 'name' só o tempo gasto para produzi-los
+        iterator = iter(iterable)
+        done = object()
+        try:
+            while True:
+                with self.stage(name):
+                    item = next(iterator, done)
+                if item is done:
+                    return
+                yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def add(self, totals):
+        # Soma tempos medidos em outro processo (os do pool de ingestão)
+        for name, total in totals.items():
+            self.totals[name] = self.totals.get(name, 0.0) + total
+
+    def count_invalid(self, counts):
+        for col, count in counts.items():
+            self.invalid[col] = self.invalid.get(col, 0) + count
+
+    def finish(self, file_name, rows_processed, rows_rejected):
+        for name, total in self.totals.items():
+            INGESTION_STAGE_SECONDS.observe(total, name)
+        INGESTION_ROWS.inc('processadas', amount=rows_processed)
+        INGESTION_ROWS.inc('descartadas', amount=rows_rejected)
+        summary = ', '.join(f'{name} {total:.2f} s' for name, total in self.totals.items())
+        logger.info(f"Tempos da carga de {file_name}: {summary}.")
+        for col, count in self.invalid.items():
+            INGESTION_INVALID_VALUES.inc(col, amount=count)
+        if self.invalid:
+            summary = ', '.join(f'{col} {count}' for col, count in sorted(self.invalid.items()))
+            logger.warning(f"Valores inválidos na carga de {file_name} (gravados vazios ou linha descartada): {summary}.")
+
 # --- Funções do Banco de Dados ---
+# Toda conexão recebe estes PRAGMAs. O banco roda em WAL (persistente no arquivo, ativado pelo escritor):
+# leitores não bloqueiam o escritor e continuam vendo a versão anterior até o commit.
+SQLITE_PRAGMAS = (
+    ('synchronous', 'NORMAL'), # Seguro em WAL; dispensa fsync a cada commit
+    ('cache_size', -65536), # 64 MB de cache de páginas
+    ('mmap_size', 268435456), # 256 MB lidos via mmap
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+
+_db_local = threading.local()
+_db_writer_lock = threading.RLock()
+_db_writer = {'key': None, 'conn': None}
+
+def _configure_connection(conn):
+    conn.row_factory = sqlite3.Row
+    for pragma, value in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
 def get_db():
+    # Conexão avulsa de leitura e escrita; quem abre fecha
     try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
-        # logger.info(f"Conectado ao banco de dados: {DATABASE}") # Log excessivo
-        return conn
+        return _configure_connection(sqlite3.connect(DATABASE))
     except sqlite3.Error as e:
         logger.error(f"Erro ao conectar ao banco de dados {DATABASE}: {e}")
         return None
 
-def init_db(force_create=False):
-    conn = get_db()
-    if not conn:
-        logger.error("init_db: Falha ao obter conexão com o banco de dados.")
-        return
-    cursor = conn.cursor()
+def get_read_db():
+    # Conexão somente leitura (mode=ro) reaproveitada entre requisições da mesma thread. Não deve ser fechada.
+    # A chave inclui o pid para que workers criados por fork não herdem a conexão do processo pai.
+    key = (os.getpid(), DATABASE)
+    if getattr(_db_local, 'key', None) == key:
+        return _db_local.conn
     try:
-        if force_create:
-            cursor.execute("DROP TABLE IF EXISTS solicitacoes")
-            logger.info("Tabela 'solicitacoes' existente removida (force_create=True).")
-
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='solicitacoes'")
-        table_exists = cursor.fetchone()
-        if not table_exists:
-            logger.info("Criando tabela 'solicitacoes'...")
-            cols_definition = []
-            for col in INTERNAL_COLUMNS:
-                if col == 'id': continue
-                col_type = 'INTEGER' if col in ['DiasAtrSol', 'LeadTimeEntrega', 'AtrasoEntrega'] else \
-                           'REAL' if col in ['Qtde', 'PrecoUnitario', 'VlrTotal'] else \
-                           'TEXT'
-                cols_definition.append(f'{col} {col_type}')
-
-            create_table_sql = f"""
-                CREATE TABLE solicitacoes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    {', '.join(cols_definition)}
-                )
-            """
-            cursor.execute(create_table_sql)
+        conn = _configure_connection(sqlite3.connect(f"{Path(DATABASE).as_uri()}?mode=ro", uri=True))
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao abrir conexão de leitura em {DATABASE}: {e}")
+        return None
+    _db_local.key, _db_local.conn = key, conn
+    _db_local.data_version = None # PRAGMA data_version é por conexão
+    return conn
+
+@contextmanager
+def db_writer():
+    # Única conexão de escrita do processo, serializada por um lock. Faz commit na saída e rollback em erro.
+    # Cargas longas devem abrir um bloco destes por lote, para não segurar o lock entre um lote e outro.
+    with _db_writer_lock:
+        key = (os.getpid(), DATABASE)
+        if _db_writer['key'] != key:
+            conn = _configure_connection(sqlite3.connect(DATABASE, check_same_thread=False))
+            conn.execute("PRAGMA journal_mode = WAL")
+            _db_writer['key'], _db_writer['conn'] = key, conn
+        conn = _db_writer['conn']
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+def column_type(col):
+    return 'INTEGER' if col in ['DiasAtrSol', 'LeadTimeCompra', 'LeadTimeCompraContrato', 'LeadTimeEntrega', 'AtrasoEntrega'] else \
+           'REAL' if col in ['Qtde', 'PrecoUnitario', 'VlrTotal'] else \
+           'TEXT'
+
+def create_solicitacoes_table(cursor, table_name='solicitacoes'):
+    cols_definition = []
+    for col in INTERNAL_COLUMNS + ROW_KEY_COLUMNS:
+        if col == 'id': continue
+        cols_definition.append(f'{col} {column_type(col)}')
+
+    create_table_sql = f"""
+        CREATE TABLE {table_name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {', '.join(cols_definition)}
+        )
+    """
+    cursor.execute(create_table_sql)
+
+# --- Migrações de Esquema ---
+# A versão do esquema fica em PRAGMA user_version. Tabelas novas já nascem na versão atual;
+# bancos antigos recebem as migrações pendentes, cada uma em sua própria transação.
+SOLICITACOES_INDEXES = {
+    'idx_solicitacoes_solicitacao': 'Solicitacao',
+    'idx_solicitacoes_etapa_dias': 'Etapa, DiasAtrSol',
+    'idx_solicitacoes_comprador': 'Comprador',
+    'idx_solicitacoes_status_comprador': 'Status, Comprador, VlrTotal',
+    # Ordem (DiasAtrSol, id) das listas de atraso paginadas: o rowid já faz parte de cada entrada
+    'idx_solicitacoes_dias_atr_sol': 'DiasAtrSol',
+}
+
+def create_solicitacoes_indexes(cursor):
+    for index_name, index_cols in SOLICITACOES_INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON solicitacoes ({index_cols})")
+
+# Índice de texto (FTS5) das buscas do chatbot, com conteúdo externo: guarda só os termos e aponta para
+# 'solicitacoes' pelo id. remove_diacritics 2 deixa a busca insensível a acentos. Cargas completas montam
+# um índice sombra junto com a tabela sombra e trocam os dois na mesma transação.
+SEARCH_INDEX_TABLE = 'solicitacoes_busca'
+SEARCH_COLUMNS = ['Produto', 'Fornecedor', 'Solicitacao', 'Pedido']
+
+def create_search_index(cursor, table_name=SEARCH_INDEX_TABLE):
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE {table_name} USING fts5(
+            {', '.join(SEARCH_COLUMNS)},
+            content='solicitacoes', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+
+def index_search_rows(cursor, source_table='solicitacoes', index_table=SEARCH_INDEX_TABLE, min_id=None, ids=None):
+    # Indexa as linhas de source_table com id > min_id, ou as de ids (lista de tuplas (id,))
+    cols = ', '.join(SEARCH_COLUMNS)
+    sql = f"INSERT INTO {index_table} (rowid, {cols}) SELECT id, {cols} FROM {source_table}"
+    if ids is not None:
+        cursor.executemany(f"{sql} WHERE id = ?", ids)
+    else:
+        cursor.execute(f"{sql} WHERE id > ?", (min_id or 0,))
+
+def unindex_search_rows(cursor, ids):
+    # Conteúdo externo: a remoção precisa dos valores indexados, lidos de 'solicitacoes' antes de alterá-la
+    cols = ', '.join(SEARCH_COLUMNS)
+    cursor.executemany(f"INSERT INTO {SEARCH_INDEX_TABLE} ({SEARCH_INDEX_TABLE}, rowid, {cols}) "
+                       f"SELECT 'delete', id, {cols} FROM solicitacoes WHERE id = ?", ids)
+
+# Esquema de 'solicitacoes' na versão 1, congelado aqui: as migrações antigas não podem depender de
+# INTERNAL_COLUMNS, create_solicitacoes_table ou SOLICITACOES_INDEXES, que acompanham o esquema atual
+_MIGRATION_1_COLUMNS = [
+    ('Solicitacao', 'TEXT'), ('DtAbertura', 'TEXT'), ('DtAprovSol', 'TEXT'), ('Comprador', 'TEXT'), ('Fornecedor', 'TEXT'),
+    ('Produto', 'TEXT'), ('Qtde', 'REAL'), ('PrecoUnitario', 'REAL'), ('PrecoUnitarioOrig', 'TEXT'), ('Moeda', 'TEXT'),
+    ('VlrTotal', 'REAL'), ('DtAprovPedido', 'TEXT'), ('DtPedido', 'TEXT'), ('Pedido', 'TEXT'), ('DtEntregaOrig', 'TEXT'),
+    ('DtEntregaAtual', 'TEXT'), ('DtReceb', 'TEXT'), ('Status', 'TEXT'), ('Etapa', 'TEXT'), ('DiasAtrSol', 'INTEGER'),
+    ('LeadTimeCompra', 'INTEGER'), ('LeadTimeCompraContrato', 'INTEGER'), ('LeadTimeEntrega', 'INTEGER'), ('AtrasoEntrega', 'INTEGER'),
+]
+_MIGRATION_1_INDEXES = {
+    'idx_solicitacoes_solicitacao': 'Solicitacao',
+    'idx_solicitacoes_etapa_dias': 'Etapa, DiasAtrSol',
+    'idx_solicitacoes_comprador': 'Comprador',
+    'idx_solicitacoes_status_comprador': 'Status, Comprador, VlrTotal',
+}
+
+def _migration_1(cursor):
+    # LeadTimeCompra TEXT (dias ou 'contrato') -> INTEGER + LeadTimeCompraContrato, e índices de acesso
+    cursor.execute(f"""
+        CREATE TABLE solicitacoes_migracao (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {', '.join(f'{col} {col_type}' for col, col_type in _MIGRATION_1_COLUMNS)}
+        )
+    """)
+    copied_cols = [col for col, _ in _MIGRATION_1_COLUMNS if col not in ('LeadTimeCompra', 'LeadTimeCompraContrato')]
+    cursor.execute(f"""
+        INSERT INTO solicitacoes_migracao (id, {', '.join(copied_cols)}, LeadTimeCompra, LeadTimeCompraContrato)
+        SELECT id, {', '.join(copied_cols)},
+               CASE WHEN LeadTimeCompra = 'contrato' THEN NULL ELSE CAST(LeadTimeCompra AS INTEGER) END,
+               CASE WHEN LeadTimeCompra = 'contrato' THEN 1 ELSE 0 END
+        FROM solicitacoes
+    """)
+    cursor.execute("DROP TABLE solicitacoes")
+    cursor.execute("ALTER TABLE solicitacoes_migracao RENAME TO solicitacoes")
+    for index_name, index_cols in _MIGRATION_1_INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON solicitacoes ({index_cols})")
+
+def _migration_2(cursor):
+    # Resumo do dashboard materializado por versão do conjunto de dados
+    create_metadata_tables(cursor)
+    cursor.execute("SELECT COUNT(*) FROM dataset_versoes")
+    if cursor.fetchone()[0] == 0:
+        store_dashboard_data(cursor, compute_dashboard_data(cursor))
+
+def _migration_3(cursor):
+    # Índice de DiasAtrSol para a paginação por cursor das listas de atraso
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_solicitacoes_dias_atr_sol ON solicitacoes (DiasAtrSol)")
+
+def _migration_4(cursor):
+    # Chave natural e hash de conteúdo por linha, calculados a partir dos dados já carregados
+    # Colunas da versão 3 (as da versão 1); só o cálculo das chaves é o atual, para a próxima carga
+    # incremental comparar com chaves no mesmo formato
+    existing_cols = {row[1] for row in cursor.execute("PRAGMA table_info(solicitacoes)")}
+    for col in ('ChaveNatural', 'HashLinha'):
+        if col not in existing_cols:
+            cursor.execute(f"ALTER TABLE solicitacoes ADD COLUMN {col} TEXT")
+    rows = cursor.execute(f"SELECT id, {', '.join(col for col, _ in _MIGRATION_1_COLUMNS)} FROM solicitacoes ORDER BY id").fetchall()
+    keyed_rows = add_row_keys([tuple(row[1:]) for row in rows], columns=_MIGRATION_1_COLUMNS)
+    cursor.executemany("UPDATE solicitacoes SET ChaveNatural = ?, HashLinha = ? WHERE id = ?",
+                       [(*keyed[-2:], row[0]) for row, keyed in zip(rows, keyed_rows)])
+
+def _migration_5(cursor):
+    # Hash do conteúdo do arquivo de cada versão, para não reprocessar o mesmo upload
+    existing_cols = {row[1] for row in cursor.execute("PRAGMA table_info(dataset_versoes)")}
+    if 'hash_conteudo' not in existing_cols:
+        cursor.execute("ALTER TABLE dataset_versoes ADD COLUMN hash_conteudo TEXT")
+
+def _migration_6(cursor):
+    # Índice FTS5 das buscas por produto, fornecedor, solicitação e pedido
+    cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}")
+    create_search_index(cursor)
+    cursor.execute(f"INSERT INTO {SEARCH_INDEX_TABLE} ({SEARCH_INDEX_TABLE}) VALUES ('rebuild')")
+
+def _migration_7(cursor):
+    # Relatório por planilha (JSON) das cargas com várias planilhas/pastas de trabalho
+    existing_cols = {row[1] for row in cursor.execute("PRAGMA table_info(ingestao_jobs)")}
+    if 'relatorio' not in existing_cols:
+        cursor.execute("ALTER TABLE ingestao_jobs ADD COLUMN relatorio TEXT")
+
+def _migration_8(cursor):
+    # Agregados de tendência por versão; a versão publicada é calculada a partir de 'solicitacoes'
+    # (as anteriores não têm mais as linhas no banco e ficam fora da série)
+    create_metadata_tables(cursor)
+    version = cursor.execute("SELECT MAX(versao) FROM dataset_versoes").fetchone()[0]
+    if version is not None:
+        store_trend_rollups(cursor, version, compute_trend_rollups(cursor))
+
+MIGRATIONS = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+    (7, _migration_7),
+    (8, _migration_8),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate_db(conn):
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    for target_version, migration in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Relido dentro do lock: outro worker pode ter migrado enquanto esperávamos
+            current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current_version >= target_version:
+                conn.rollback()
+                continue
+            logger.info(f"Aplicando migração de esquema {current_version} -> {target_version}...")
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {target_version}")
             conn.commit()
-            logger.info("Tabela 'solicitacoes' criada.")
-        # else:
-            # logger.info("Tabela 'solicitacoes' já existe.") # Log excessivo
+            logger.info(f"Migração de esquema {target_version} aplicada.")
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+def create_metadata_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingestao_jobs (
+            job_id TEXT PRIMARY KEY,
+            arquivo TEXT,
+            estagio TEXT,
+            linhas_processadas INTEGER DEFAULT 0,
+            linhas_descartadas INTEGER DEFAULT 0,
+            mensagem TEXT,
+            erro TEXT,
+            relatorio TEXT,
+            criado_em TEXT,
+            atualizado_em TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dataset_versoes (
+            versao INTEGER PRIMARY KEY AUTOINCREMENT,
+            arquivo TEXT,
+            linhas INTEGER,
+            carregado_em TEXT,
+            hash_conteudo TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dashboard_resumo (
+            versao INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL
+        )
+    """)
+    # Chave começando pela dimensão/valor: a série de um comprador ou etapa é um trecho contíguo do índice
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS tendencia_rollup (
+            versao INTEGER NOT NULL,
+            dimensao TEXT NOT NULL,
+            valor TEXT NOT NULL,
+            {', '.join(f'{col} INTEGER NOT NULL' for col in TREND_COLUMNS)},
+            PRIMARY KEY (dimensao, valor, versao)
+        ) WITHOUT ROWID
+    """)
+
+def init_db(force_create=False):
+    try:
+        with db_writer() as conn:
+            cursor = conn.cursor()
+            if force_create:
+                cursor.execute("DROP TABLE IF EXISTS solicitacoes")
+                cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}")
+                logger.info("Tabela 'solicitacoes' existente removida (force_create=True).")
+
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='solicitacoes'")
+            table_exists = cursor.fetchone()
+            if not table_exists:
+                logger.info("Criando tabela 'solicitacoes'...")
+                create_solicitacoes_table(cursor)
+                create_solicitacoes_indexes(cursor)
+                create_search_index(cursor)
+                create_metadata_tables(cursor)
+                store_dashboard_data(cursor, dict(EMPTY_DASHBOARD))
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                conn.commit()
+                logger.info("Tabela 'solicitacoes' criada.")
+            else:
+                migrate_db(conn)
+        return True
     except sqlite3.Error as e:
         logger.error(f"Erro durante init_db: {e}")
+        return False
+
+_db_init = {'pronto': False}
+_db_init_lock = threading.Lock()
+
+def ensure_db():
+    # init_db (criação do esquema e migrações) uma vez por processo, na primeira requisição ou carga.
+    # Retorna True só para a chamada que de fato inicializou; se falhar, a próxima tenta de novo.
+    if _db_init['pronto']:
+        return False
+    with _db_init_lock:
+        if _db_init['pronto']:
+            return False
+        _db_init['pronto'] = init_db()
+        return _db_init['pronto']
+
+# --- Ingestão Vetorizada ---
+DATE_COLUMNS = ['DtAbertura', 'DtAprovSol', 'DtAprovPedido', 'DtPedido', 'DtEntregaOrig', 'DtEntregaAtual', 'DtReceb']
+PRICE_COLUMNS = ['PrecoUnitario', 'VlrTotal']
+ESSENTIAL_INTERNAL_COLS = [
+    'Solicitacao', 'DtAprovSol', 'Comprador', 'Fornecedor', 'Produto',
+    'Qtde', 'PrecoUnitario', 'VlrTotal', 'DtAprovPedido', 'DtPedido',
+    'Pedido', 'DtEntregaOrig', 'DtReceb', 'Status', 'Etapa', 'DiasAtrSol'
+]
+COMPRADORES = ['Miriam', 'Irineu']
+
+def map_excel_columns(original_columns):
+    # Retorna ({coluna_interna: coluna_original}, [colunas_internas_ausentes]).
+    # Variações de nome (ex.: 'Pre‡o Unit	ário') vêm todas do COLUMN_MAPPING.
+    present_original_cols = {}
+    missing_original_cols = []
+    for internal_col in ESSENTIAL_INTERNAL_COLS:
+        # A última variação declarada tem prioridade (ex.: 'Preço Unitário' antes da versão corrompida)
+        candidates = [orig for orig, internal in COLUMN_MAPPING.items() if internal == internal_col]
+        found = next((orig for orig in reversed(candidates) if orig in original_columns), None)
+        if found is None:
+            missing_original_cols.append(internal_col)
+        else:
+            present_original_cols[internal_col] = found
+    return present_original_cols, missing_original_cols
+
+def _scalar_dias_atr_sol(value):
+    return int(value) if isinstance(value, (int, float)) else 0
+
+# Datas e preços se repetem muito, nas linhas de um bloco e entre os blocos de uma carga. ColumnParsers guarda,
+# por coluna e durante uma carga, o formato de data inferido uma única vez e o resultado de cada texto já
+# convertido: cada bloco converte só os valores distintos ainda não vistos, de uma vez, e espalha o resultado
+# pelas linhas. Textos que o formato inferido não aceita caem no parse_date (dateutil, dayfirst), então o
+# resultado é o mesmo da conversão valor a valor. Conta também, por coluna, os valores inválidos (preenchidos
+# na planilha, mas gravados vazios, ou datas NaT que descartam a linha).
+# Só formatos dia/mês, que leem o texto como parse_date (dayfirst=True). Texto ISO fica fora: parse_date troca dia e
+# mês quando o dia é <= 12 ('2024-01-07' -> 2024-07-01), e o formato inferido varia com o bloco da planilha
+DATE_FORMATS = ['%d/%m/%Y', '%d/%m/%Y %H:%M:%S', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y']
+DATE_FORMAT_SAMPLE = 50
+PARSE_MEMO_MAX_ENTRIES = 200000
+
+def _clean_price_text(text):
+    # Mesma limpeza de clean_price sobre o texto da célula ('R$ 1.234,56' -> 1234.56; 'nan' -> nan)
+    cleaned = re.sub(r'[R$\s.]', '', text).replace(',', '.')
+    try:
+        return float(cleaned) if cleaned else None
+    except ValueError:
+        return None
+
+class ColumnParsers:
+    def __init__(self):
+        self.date_formats = {}
+        self.invalid = {}
+        self._memo = {}
+
+    def _memo_for(self, col):
+        memo = self._memo.setdefault(col, {})
+        if len(memo) > PARSE_MEMO_MAX_ENTRIES: # Coluna com valores demais para guardar: recomeça
+            memo.clear()
+        return memo
+
+    def _count_invalid(self, col, count):
+        if count:
+            self.invalid[col] = self.invalid.get(col, 0) + int(count)
+
+    def take_invalid(self):
+        # Devolve os inválidos contados desde a última chamada
+        invalid, self.invalid = self.invalid, {}
+        return invalid
+
+    def _infer_date_format(self, texts):
+        # Formato de DATE_FORMATS que aceita mais textos de uma amostra (None se nenhum aceita)
+        sample = pd.Series(texts[:DATE_FORMAT_SAMPLE], dtype=object)
+        best, best_hits = None, 0
+        for date_format in DATE_FORMATS:
+            hits = int(pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum())
+            if hits > best_hits:
+                best, best_hits = date_format, hits
+            if hits == len(sample):
+                break
+        return best
+
+    def _parse_date_texts(self, col, texts, memo):
+        date_format = self.date_formats.get(col)
+        if date_format is None:
+            date_format = self._infer_date_format(texts)
+            if date_format is None:
+                return [parse_date(t) for t in texts] # Nada reconhecido ainda; o próximo bloco tenta inferir de novo
+            self.date_formats[col] = date_format
+            logger.debug(f"Formato de data inferido para {col}: {date_format}")
+        parsed = pd.to_datetime(pd.Series(texts, dtype=object), format=date_format, errors='coerce')
+        iso = parsed.dt.strftime('%Y-%m-%d').where(parsed.notna(), None)
+        return [value if value is not None else parse_date(text) for text, value in zip(texts, iso)]
+
+    def dates(self, col, series):
+        # Retorna (datas 'YYYY-MM-DD' ou None, datetime64 normalizado, máscara de linhas rejeitadas).
+        # Como no caminho linha a linha, NaT faz parse_date falhar e a linha é descartada.
+        if pd.api.types.is_datetime64_any_dtype(series):
+            rejected = series.isna().to_numpy()
+            normalized = series.dt.normalize()
+            text = normalized.dt.strftime('%Y-%m-%d').astype(object)
+            text = text.where(series.notna(), None)
+            return text.to_numpy(dtype=object), normalized, rejected
+
+        values = series.astype(object)
+        na_mask = values.isna().to_numpy()
+        rejected = np.zeros(len(values), dtype=bool)
+        if na_mask.any():
+            rejected[na_mask] = [v is pd.NaT for v in values.to_numpy()[na_mask]]
+        text = np.full(len(values), None, dtype=object)
+        if (~na_mask).any():
+            codes, uniques = pd.factorize(values[~na_mask])
+            memo = self._memo_for(col)
+            pending = [u for u in uniques if isinstance(u, str) and u not in memo]
+            if pending:
+                memo.update(zip(pending, self._parse_date_texts(col, pending, memo)))
+            # Só textos vão para o memo; datetime do Excel e outros tipos são convertidos direto
+            parsed = np.array([memo[u] if isinstance(u, str) else parse_date(u) for u in uniques], dtype=object)
+            text[~na_mask] = parsed[codes]
+            self._count_invalid(col, np.bincount(codes, minlength=len(uniques))[pd.isna(parsed)].sum())
+        self._count_invalid(col, rejected.sum())
+        normalized = pd.to_datetime(pd.Series(text, index=series.index), format='%Y-%m-%d', errors='coerce')
+        return text, normalized, rejected
+
+    def prices(self, col, series):
+        values = series.astype(object)
+        missing = np.equal(values.to_numpy(), None)
+        # O resultado depende só do texto da célula: os distintos são convertidos uma vez por carga
+        codes, uniques = pd.factorize(values.astype(str))
+        memo = self._memo_for(col)
+        for u in uniques:
+            if u not in memo:
+                memo[u] = _clean_price_text(u)
+        converted = np.array([memo[u] for u in uniques], dtype=object)
+        result = converted[codes]
+        result[missing] = None
+        # Inválido: célula preenchida (não vazia, não NaN) que não virou número
+        blank = np.array([u.strip() in ('', 'nan', 'None', '<NA>', 'NaT') for u in uniques], dtype=bool)
+        self._count_invalid(col, np.bincount(codes, minlength=len(uniques))[pd.isna(converted) & ~blank].sum())
+        return result
+
+def _vectorized_dias_atr_sol(series):
+    # Retorna (valores inteiros, máscara de linhas rejeitadas por valores infinitos).
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return series.astype(int).astype(object).to_numpy(), np.zeros(len(series), dtype=bool)
+    if pd.api.types.is_float_dtype(series):
+        arr = series.to_numpy(dtype=float)
+        rejected = np.isinf(arr)
+        ints = np.where(np.isfinite(arr), np.trunc(arr), 0).astype(np.int64)
+        return ints.astype(object), rejected
+
+    values = series.astype(object)
+    na_mask = values.isna().to_numpy()
+    result = np.zeros(len(values), dtype=np.int64).astype(object)
+    rejected = np.zeros(len(values), dtype=bool)
+    if (~na_mask).any():
+        codes, uniques = pd.factorize(values[~na_mask])
+        converted = []
+        bad = []
+        for u in uniques:
+            try:
+                converted.append(_scalar_dias_atr_sol(u))
+                bad.append(False)
+            except (OverflowError, ValueError):
+                converted.append(0)
+                bad.append(True)
+        result[~na_mask] = np.array(converted, dtype=object)[codes]
+        rejected[~na_mask] = np.array(bad, dtype=bool)[codes]
+    return result, rejected
+
+def _days_or_none(delta, valid):
+    days = delta.dt.days.to_numpy()
+    out = np.full(len(days), None, dtype=object)
+    out[valid] = days[valid].astype(np.int64).tolist()
+    return out
+
+def transform_dataframe(df, present_original_cols, parsers=None):
+    # Converte o DataFrame do Excel, coluna a coluna, nas linhas prontas para o INSERT
+    # (na ordem de INTERNAL_COLUMNS). Produz os mesmos valores do antigo laço com iterrows,
+    # exceto LeadTimeCompra, agora inteiro com o caso 'contrato' em LeadTimeCompraContrato.
+    # parsers: o ColumnParsers da carga, compartilhado entre os blocos (sem ele, cada bloco começa do zero).
+    # Retorna (lista de tuplas, índices das linhas rejeitadas).
+    parsers = parsers or ColumnParsers()
+    n = len(df)
+    columns = {}
+    normalized_dates = {}
+    rejected = np.zeros(n, dtype=bool)
+    empty = pd.Series([None] * n, index=df.index, dtype=object)
+
+    def source(internal_col):
+        original_col = present_original_cols.get(internal_col)
+        return df[original_col] if original_col else empty
+
+    for col in DATE_COLUMNS:
+        text, normalized, bad = parsers.dates(col, source(col))
+        columns[col] = text
+        normalized_dates[col] = normalized
+        rejected |= bad
+
+    for col in PRICE_COLUMNS:
+        columns[col] = parsers.prices(col, source(col))
+    # O laço antigo sobrescrevia PrecoUnitarioOrig com None (coluna ausente no Excel); mantido igual
+    columns['PrecoUnitarioOrig'] = empty.to_numpy()
+
+    comprador = source('Comprador').astype(object).astype(str).str.strip().str.title()
+    columns['Comprador'] = np.where(comprador.isin(COMPRADORES), comprador, 'Outro').astype(object)
+
+    status_values = source('Status').astype(object)
+    status = status_values.astype(str).str.strip().str.lower()
+    status = status.where(status != 'nao aprovado', 'não aprovado').to_numpy(dtype=object)
+    status[~status_values.to_numpy().astype(bool)] = ''
+    columns['Status'] = status
+
+    columns['DiasAtrSol'], bad = _vectorized_dias_atr_sol(source('DiasAtrSol'))
+    rejected |= bad
+    columns['Moeda'] = empty.to_numpy() # Não presente no Excel do usuário
+
+    for col in ['Solicitacao', 'Fornecedor', 'Produto', 'Qtde', 'Pedido', 'Etapa']:
+        values = source(col).astype(object)
+        columns[col] = values.where(values.notna(), None).to_numpy(dtype=object)
+
+    # Indicadores derivados calculados sobre as datas já normalizadas
+    dt_pedido = normalized_dates['DtPedido']
+    dt_aprov_sol = normalized_dates['DtAprovSol']
+    dt_aprov_pedido = normalized_dates['DtAprovPedido']
+    dt_entrega_orig = normalized_dates['DtEntregaOrig']
+    dt_receb = normalized_dates['DtReceb']
+
+    valid = (dt_pedido.notna() & dt_aprov_sol.notna()).to_numpy()
+    lead_compra = _days_or_none(dt_pedido - dt_aprov_sol, valid)
+    contrato = valid & (dt_pedido < dt_aprov_sol).to_numpy()
+    lead_compra[contrato] = None
+    columns['LeadTimeCompra'] = lead_compra
+    columns['LeadTimeCompraContrato'] = contrato.astype(np.int64).astype(object)
+
+    valid = (dt_receb.notna() & dt_aprov_pedido.notna() & (dt_receb >= dt_aprov_pedido)).to_numpy()
+    columns['LeadTimeEntrega'] = _days_or_none(dt_receb - dt_aprov_pedido, valid)
+
+    valid = (dt_receb.notna() & dt_entrega_orig.notna()).to_numpy()
+    atraso = _days_or_none(dt_receb - dt_entrega_orig, valid)
+    atraso[valid] = np.maximum(atraso[valid].astype(np.int64), 0).tolist()
+    columns['AtrasoEntrega'] = atraso
+
+    cols_for_insert = [col for col in INTERNAL_COLUMNS if col != 'id']
+    keep = ~rejected
+    rows = list(zip(*[columns[col][keep] for col in cols_for_insert]))
+    return rows, df.index[rejected].tolist()
+
+def _dedupe_header(header):
+    # Mesmo tratamento do pandas: colunas sem nome viram 'Unnamed: i' e repetidas ganham sufixo '.1', '.2'...
+    seen = {}
+    result = []
+    for i, name in enumerate(header):
+        name = f'Unnamed: {i}' if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        result.append(name)
+    return result
+
+class _DateColumnKinds:
+    # O pd.read_excel lê uma coluna como datetime64 só se todo valor preenchido dela é data do Excel; aí a célula
+    # vazia vira NaT e descarta a linha. Com algum texto ou número na coluna, ela fica object, a célula vazia vira
+    # NaN (linha mantida) e cada valor segue para o parse_date. No streaming a coluna inteira não é conhecida:
+    # as primeiras STREAM_DATE_SCAN_ROWS linhas são lidas antes (só as colunas de data) e cada bloco acrescenta o
+    # que traz. A decisão é exata quando a planilha cabe nessa janela ou o primeiro valor que não é data aparece nela.
+    def __init__(self, header):
+        present_original_cols, _ = map_excel_columns(header)
+        self.indexes = {header.index(present_original_cols[col]): present_original_cols[col]
+                        for col in DATE_COLUMNS if col in present_original_cols}
+        self.datetime = set()
+        self.mixed = set()
+        self._converted = set()
+
+    def scan(self, rows):
+        pending = {index: col for index, col in self.indexes.items() if col not in self.mixed}
+        for row in rows:
+            if not pending:
+                return
+            for index in list(pending):
+                value = row[index] if index < len(row) else None
+                if value is None:
+                    continue
+                col = pending[index]
+                if isinstance(value, datetime):
+                    self.datetime.add(col)
+                    continue
+                self.mixed.add(col)
+                del pending[index]
+                if col in self._converted:
+                    logger.warning(f"Coluna '{col}' tem valores que não são data depois de {STREAM_DATE_SCAN_ROWS} linhas; "
+                                   f"as linhas anteriores com a célula vazia já foram descartadas.")
+
+    def datetime_columns(self):
+        # Colunas só com datas até aqui: convertidas para datetime64 no bloco, como no read_excel
+        columns = self.datetime - self.mixed
+        self._converted |= columns
+        return columns
+
+def _chunk_frame(chunk, header, offset, datetime_cols=()):
+    # Células vazias viram NaN/NaT, como no pd.read_excel, para o transform tratar os dois modos igual.
+    # datetime_cols só tem datas e vazios: a conversão não altera valor nenhum, só troca None por NaT
+    frame = pd.DataFrame(chunk, columns=header, index=range(offset, offset + len(chunk)))
+    frame = frame.where(frame.notna(), np.nan)
+    for col in datetime_cols:
+        frame[col] = pd.to_datetime(frame[col])
+    return frame
+
+def iter_excel_chunks(file_path, chunk_size=STREAM_CHUNK_SIZE, sheet_name=None, date_scan_rows=STREAM_DATE_SCAN_ROWS):
+    # Lê a planilha sheet_name (ou a primeira) com o openpyxl em modo read-only e devolve DataFrames de até
+    # chunk_size linhas, sem carregar a pasta de trabalho inteira. Sempre devolve ao menos um DataFrame (com o cabeçalho).
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = wb[sheet_name] if sheet_name is not None else wb.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = _dedupe_header(next(rows, ()))
+        kinds = _DateColumnKinds(header)
+        if kinds.indexes and date_scan_rows:
+            kinds.scan(sheet.iter_rows(min_row=2, max_row=1 + date_scan_rows, values_only=True))
+        width = len(header)
+        chunk = []
+        offset = 0
+        yielded = False
+
+        def frame():
+            kinds.scan(chunk)
+            return _chunk_frame(chunk, header, offset, kinds.datetime_columns())
+
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            if len(row) != width:
+                row = tuple(row[:width]) + (None,) * (width - len(row))
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield frame()
+                offset += len(chunk)
+                chunk = []
+                yielded = True
+        if chunk or not yielded:
+            yield frame()
     finally:
-        if conn:
-            conn.close()
-            # logger.info("init_db: Conexão com o banco de dados fechada.") # Log excessivo
+        wb.close()
 
-def process_and_load_excel(file_path):
-    conn = None
+def _iter_frame_slices(df, chunk_size=STREAM_CHUNK_SIZE):
+    # Fatia um DataFrame já carregado em blocos, para inserir e reportar progresso como no streaming
+    yield df.iloc[:chunk_size]
+    for start in range(chunk_size, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+def _swap_in_table(conn, shadow_table, search_shadow, dashboard_data, rollups, file_name=None, content_hash=None):
+    # Troca atômica: leitores passam direto do conjunto antigo (e seu resumo e índice de busca) para o novo
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        df = pd.read_excel(file_path, engine='openpyxl')
-        original_columns = df.columns.tolist()
-        logger.info(f"Colunas originais encontradas no Excel: {original_columns}")
-
-        reverse_mapping = {v: k for k, v in COLUMN_MAPPING.items()}
-        essential_internal_cols = [
-            'Solicitacao', 'DtAprovSol', 'Comprador', 'Fornecedor', 'Produto',
-            'Qtde', 'PrecoUnitario', 'VlrTotal', 'DtAprovPedido', 'DtPedido',
-            'Pedido', 'DtEntregaOrig', 'DtReceb', 'Status', 'Etapa', 'DiasAtrSol'
-        ]
-        missing_original_cols = []
-        present_original_cols = {}
-        for internal_col in essential_internal_cols:
-            original_col_name = reverse_mapping.get(internal_col)
-            if original_col_name and original_col_name in original_columns:
-                present_original_cols[internal_col] = original_col_name
+        conn.execute("DROP TABLE IF EXISTS solicitacoes")
+        conn.execute(f"ALTER TABLE {shadow_table} RENAME TO solicitacoes")
+        conn.execute(f"DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}")
+        conn.execute(f"ALTER TABLE {search_shadow} RENAME TO {SEARCH_INDEX_TABLE}")
+        cursor = conn.cursor()
+        create_solicitacoes_indexes(cursor)
+        version = store_dashboard_data(cursor, dashboard_data, file_name, content_hash)
+        store_trend_rollups(cursor, version, rollups)
+        conn.commit()
+        return version
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def _drop_shadow_tables(*shadow_tables):
+    for shadow_table in shadow_tables:
+        try:
+            with db_writer() as conn:
+                conn.execute(f"DROP TABLE IF EXISTS {shadow_table}")
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao remover tabela temporária {shadow_table}: {e}")
+
+# --- Carga Incremental ---
+_NUMERIC_TEXT_RE = re.compile(r'^\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\s*$')
+_COLUMN_TYPES = [column_type(col) for col in INTERNAL_COLUMNS]
+_NUMERIC_COLUMNS = [col_type != 'TEXT' for col_type in _COLUMN_TYPES]
+
+def _canonical_value(value, numeric):
+    # Texto do valor como ele volta do SQLite (afinidade da coluna aplicada): o hash calculado na ingestão
+    # e o recalculado a partir do banco (migração 4) precisam bater
+    if value is None:
+        return ''
+    if isinstance(value, str) and not (numeric and _NUMERIC_TEXT_RE.match(value)):
+        return value
+    if numeric:
+        value = float(value)
+        if value != value:
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+class NaturalKeyCounter:
+    # Número da ocorrência de cada chave natural ao longo de uma carga (0 na primeira vez, 1 na segunda...).
+    # Para a memória não voltar a crescer com o texto de cada chave, guarda só um digest de 8 bytes por chave
+    # já vista, em arrays NumPy ordenados (um por bloco, compactados de tempos em tempos), e um dicionário
+    # apenas para as chaves repetidas, que são poucas. Colisão de digests de 64 bits: ~N²/2^65 (3e-8 com 1M de linhas).
+    MAX_ARRAYS = 8
+
+    def __init__(self):
+        self._seen = []
+        self._repeated = {} # digest -> próxima ocorrência, só para chaves vistas duas vezes ou mais
+
+    def _seen_before(self, digests):
+        found = np.zeros(len(digests), dtype=bool)
+        for seen in self._seen:
+            positions = np.minimum(np.searchsorted(seen, digests), len(seen) - 1)
+            found |= seen[positions] == digests
+        return found
+
+    def occurrences(self, keys):
+        digests = np.array([int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') for key in keys],
+                           dtype=np.uint64)
+        before = self._seen_before(digests)
+        in_chunk = set()
+        result = []
+        for digest, seen in zip(digests.tolist(), before.tolist()):
+            occurrence = self._repeated.get(digest)
+            if occurrence is None:
+                occurrence = 1 if seen or digest in in_chunk else 0
+            if occurrence:
+                self._repeated[digest] = occurrence + 1
+            in_chunk.add(digest)
+            result.append(occurrence)
+        if len(digests):
+            self._seen.append(np.sort(digests))
+        if len(self._seen) > self.MAX_ARRAYS:
+            self._seen = [np.sort(np.concatenate(self._seen))]
+        return result
+
+def add_row_keys(rows, occurrences=None, columns=None):
+    # Acrescenta (ChaveNatural, HashLinha) a cada tupla em ordem de INTERNAL_COLUMNS. occurrences é o
+    # NaturalKeyCounter que numera as repetições de cada chave e deve ser o mesmo para todos os blocos de uma carga.
+    # columns: [(coluna, tipo SQL)] na ordem das tuplas, para as migrações que leem um esquema antigo
+    if occurrences is None:
+        occurrences = NaturalKeyCounter()
+    if columns is None:
+        names, numeric_columns = INTERNAL_COLUMNS, _NUMERIC_COLUMNS
+    else:
+        names, numeric_columns = [col for col, _ in columns], [col_type != 'TEXT' for _, col_type in columns]
+    key_positions = [names.index(col) for col in NATURAL_KEY_COLUMNS]
+    keyed = []
+    for row in rows:
+        canonical = [_canonical_value(value, numeric) for value, numeric in zip(row, numeric_columns)]
+        base_key = '\x1f'.join([canonical[pos] for pos in key_positions])
+        row_hash = hashlib.blake2b('\x1f'.join(canonical).encode(), digest_size=16).hexdigest()
+        keyed.append((row, base_key, row_hash))
+    counts = occurrences.occurrences([base_key for _, base_key, _ in keyed])
+    return [(*row, f'{base_key}\x1f{occurrence}', row_hash) for (row, base_key, row_hash), occurrence in zip(keyed, counts)]
+
+class RowDelta:
+    # Compara as linhas da nova planilha com o que está no banco (chave -> (id, hash)) e guarda só o que
+    # muda; o restante da planilha não passa pelo escritor.
+    def __init__(self, existing):
+        self.existing = existing
+        self.inserts = []
+        self.updates = []
+        self.unchanged = 0
+        self._seen_ids = set()
+
+    def add(self, keyed_rows):
+        for row in keyed_rows:
+            current = self.existing.get(row[-2])
+            if current is None:
+                self.inserts.append(row)
+                continue
+            row_id, row_hash = current
+            self._seen_ids.add(row_id)
+            if row_hash == row[-1]:
+                self.unchanged += 1
             else:
-                # Tentativa flexível de encontrar colunas comuns
-                found_flexible = False
-                if internal_col == 'PrecoUnitario':
-                    if 'Preço Unitário' in original_columns:
-                        present_original_cols[internal_col] = 'Preço Unitário'
-                        found_flexible = True
-                    elif 'Pre‡o Unit	ário' in original_columns:
-                        present_original_cols[internal_col] = 'Pre‡o Unit	ário'
-                        found_flexible = True
-                elif internal_col == 'VlrTotal' and 'Vlr Total' in original_columns:
-                    present_original_cols[internal_col] = 'Vlr Total'
-                    found_flexible = True
-                elif internal_col == 'DiasAtrSol' and 'Dias Atr Sol' in original_columns:
-                    present_original_cols[internal_col] = 'Dias Atr Sol'
-                    found_flexible = True
-                elif internal_col == 'Produto' and 'Descrição' in original_columns:
-                    present_original_cols[internal_col] = 'Descrição'
-                    found_flexible = True
-                elif internal_col == 'Qtde' and 'Qt.Solicitada' in original_columns:
-                    present_original_cols[internal_col] = 'Qt.Solicitada'
-                    found_flexible = True
-                elif internal_col == 'Status' and 'Estado' in original_columns:
-                    present_original_cols[internal_col] = 'Estado'
-                    found_flexible = True
-                elif internal_col == 'Fornecedor' and 'Fornec' in original_columns:
-                    present_original_cols[internal_col] = 'Fornec'
-                    found_flexible = True
-                elif internal_col == 'DtPedido' and 'Dt.Pedido' in original_columns:
-                    present_original_cols[internal_col] = 'Dt.Pedido'
-                    found_flexible = True
-                elif internal_col == 'DtEntregaOrig' and 'Dt.EntregaOrig' in original_columns:
-                    present_original_cols[internal_col] = 'Dt.EntregaOrig'
-                    found_flexible = True
-                elif internal_col == 'DtReceb' and 'Dt.Receb' in original_columns:
-                    present_original_cols[internal_col] = 'Dt.Receb'
-                    found_flexible = True
-
-                if not found_flexible:
-                    missing_original_cols.append(internal_col)
+                self.updates.append((*row, row_id))
+
+    def deleted_ids(self):
+        return [(row_id,) for row_id, _ in self.existing.values() if row_id not in self._seen_ids]
+
+def _load_row_keys(conn):
+    # Versão publicada e mapa chave -> (id, hash) da tabela 'solicitacoes'
+    base_version = conn.execute("SELECT MAX(versao) FROM dataset_versoes").fetchone()[0]
+    existing = {row[0]: (row[1], row[2]) for row in
+                conn.execute("SELECT ChaveNatural, id, HashLinha FROM solicitacoes WHERE ChaveNatural IS NOT NULL")}
+    return base_version, existing
+
+def _apply_row_delta(conn, delta, base_version, file_name=None, content_hash=None):
+    # Aplica inserções, atualizações e remoções e publica a nova versão numa única transação.
+    # Retorna (versão, contagens); versão None quando outra carga publicou no meio do caminho.
+    cols = INTERNAL_COLUMNS + ROW_KEY_COLUMNS
+    deleted = delta.deleted_ids()
+    counts = {'inseridos': len(delta.inserts), 'atualizados': len(delta.updates),
+              'removidos': len(deleted), 'inalterados': delta.unchanged}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current_version = conn.execute("SELECT MAX(versao) FROM dataset_versoes").fetchone()[0]
+        if current_version != base_version:
+            conn.rollback()
+            return None, counts
+        if not (delta.inserts or delta.updates or deleted):
+            conn.rollback()
+            return current_version, counts
+        cursor = conn.cursor()
+        updated = [(row[-1],) for row in delta.updates]
+        unindex_search_rows(cursor, deleted + updated)
+        max_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM solicitacoes").fetchone()[0]
+        cursor.executemany("DELETE FROM solicitacoes WHERE id = ?", deleted)
+        cursor.executemany(f"UPDATE solicitacoes SET {', '.join(f'{col} = ?' for col in cols)} WHERE id = ?", delta.updates)
+        cursor.executemany(f"INSERT INTO solicitacoes ({', '.join(cols)}) VALUES ({', '.join(['?'] * len(cols))})", delta.inserts)
+        index_search_rows(cursor, ids=updated)
+        index_search_rows(cursor, min_id=max_id)
+        version = store_dashboard_data(cursor, compute_dashboard_data(cursor), file_name, content_hash)
+        store_trend_rollups(cursor, version, compute_trend_rollups(cursor))
+        conn.commit()
+        return version, counts
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def _transformed_chunks(frames, present_original_cols, timer):
+    # (linhas, quantidade descartada) de cada bloco lido do Excel
+    parsers = ColumnParsers()
+    for chunk in frames:
+        with timer.stage('transformacao'):
+            rows, rejected_rows = transform_dataframe(chunk, present_original_cols, parsers)
+        timer.count_invalid(parsers.take_invalid())
+        if rejected_rows:
+            logger.error(f"{len(rejected_rows)} linhas descartadas por valores inválidos (ex.: datas vazias). Primeiras: {rejected_rows[:10]}")
+        yield rows, len(rejected_rows)
+
+def _published_content_result(content_hash, file_name):
+    # (True, mensagem) se este conteúdo já é o conjunto publicado; None se precisa ser carregado
+    state = get_dataset_state()
+    if state is not None and state['hash_conteudo'] == content_hash:
+        logger.info(f"Conteúdo de {file_name} idêntico ao da versão {state['versao']}; nada a reprocessar.")
+        return True, "Este conteúdo já está carregado; nenhum registro foi reprocessado."
+    return None
+
+def process_and_load_excel(file_path, streaming=None, progress=None, incremental=False, file_name=None, content_hash=None):
+    # streaming=None escolhe o modo pelo tamanho do arquivo (STREAMING_MIN_FILE_SIZE).
+    # progress(estagio, linhas_processadas, linhas_descartadas) é chamado a cada etapa/bloco.
+    # Os dados são carregados numa tabela sombra e só então trocados por 'solicitacoes'. Com incremental=True,
+    # as linhas são casadas pela chave natural e só as inseridas/alteradas/removidas são gravadas.
+    # O conteúdo é identificado pelo sha256 do arquivo: se já é o conjunto publicado, nada é refeito; se já
+    # existe snapshot dele, as linhas vêm do snapshot em vez do Excel.
+    frames = None
+    snapshot = None
+    report = progress or (lambda *args: None)
+    file_name = file_name or os.path.basename(file_path)
+    timer = StageTimer()
+    try:
+        ensure_db() # Garante que a tabela exista
+
+        content_hash = content_hash or file_content_hash(file_path)
+        published = _published_content_result(content_hash, file_name)
+        if published:
+            return published
+
+        report('lendo', 0, 0)
+        snapshot_chunks = iter_snapshot_chunks(content_hash)
+        if snapshot_chunks is not None:
+            logger.info(f"Snapshot de {file_name} encontrado; a planilha não será relida.")
+            return _load_parsed_chunks(timer.iterate('snapshot_leitura', snapshot_chunks), file_name, content_hash, incremental, report, timer)
+
+        if streaming is None:
+            streaming = os.path.getsize(file_path) >= STREAMING_MIN_FILE_SIZE
+        if streaming:
+            logger.info(f"Lendo {file_name} em modo streaming (blocos de {STREAM_CHUNK_SIZE} linhas).")
+            frames = timer.iterate('leitura', iter_excel_chunks(file_path))
+        else:
+            with timer.stage('leitura'):
+                df = pd.read_excel(file_path, engine='openpyxl')
+            frames = _iter_frame_slices(df)
+        df = next(frames)
+        original_columns = df.columns.tolist()
+        logger.debug(f"Colunas originais encontradas no Excel: {original_columns}")
 
+        with timer.stage('mapeamento'):
+            present_original_cols, missing_original_cols = map_excel_columns(original_columns)
         if missing_original_cols:
             logger.error(f"Erro: Colunas essenciais não encontradas ou mapeadas no arquivo Excel: {missing_original_cols}")
             return False, f"Colunas essenciais não encontradas/mapeadas: {', '.join(missing_original_cols)}"
-        logger.info(f"Colunas essenciais mapeadas com sucesso: {present_original_cols}")
-
-        conn = get_db()
-        if not conn:
-             return False, "Falha ao conectar ao banco de dados."
+        logger.info(f"{len(present_original_cols)} colunas essenciais mapeadas.")
+        logger.debug(f"Colunas essenciais mapeadas: {present_original_cols}")
 
-        init_db() # Garante que a tabela exista
-
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM solicitacoes")
-        logger.info("Dados antigos da tabela 'solicitacoes' removidos.")
-
-        rows_processed = 0
-        for index, row in df.iterrows():
-            try:
-                insert_data = {}
-                for internal_col in INTERNAL_COLUMNS:
-                    if internal_col == 'id': continue
-
-                    original_col = present_original_cols.get(internal_col)
-                    value = row.get(original_col) if original_col else None
-
-                    # Tratamentos específicos
-                    if internal_col in ['DtAbertura', 'DtAprovSol', 'DtAprovPedido', 'DtPedido', 'DtEntregaOrig', 'DtEntregaAtual', 'DtReceb']:
-                        insert_data[internal_col] = parse_date(value)
-                    elif internal_col == 'PrecoUnitario':
-                        insert_data[internal_col] = clean_price(value)
-                        insert_data['PrecoUnitarioOrig'] = str(value) if value is not None else None
-                    elif internal_col == 'VlrTotal':
-                        insert_data[internal_col] = clean_price(value)
-                    elif internal_col == 'Comprador':
-                        comprador_raw = str(value).strip().title() if value else ''
-                        insert_data[internal_col] = comprador_raw if comprador_raw in ['Miriam', 'Irineu'] else 'Outro'
-                    elif internal_col == 'Status':
-                        status_raw = str(value).strip().lower() if value else ''
-                        insert_data[internal_col] = 'não aprovado' if status_raw == 'nao aprovado' else status_raw
-                    elif internal_col == 'DiasAtrSol':
-                         dias_atr_sol_raw = value
-                         insert_data[internal_col] = int(dias_atr_sol_raw) if pd.notna(dias_atr_sol_raw) and isinstance(dias_atr_sol_raw, (int, float)) else 0
-                    elif internal_col == 'Moeda':
-                        insert_data[internal_col] = None # Não presente no Excel do usuário
-                    elif internal_col == 'DtAbertura':
-                         insert_data[internal_col] = None # Não presente no Excel do usuário
-                    elif internal_col == 'DtEntregaAtual':
-                         insert_data[internal_col] = None # Não presente no Excel do usuário
-                    else:
-                        # Para colunas como Solicitacao, Fornecedor, Produto, Qtde, Pedido, Etapa
-                        insert_data[internal_col] = value if pd.notna(value) else None
-
-                # Calcular indicadores derivados
-                insert_data['LeadTimeCompra'] = calculate_lead_time_compra(insert_data.get('DtPedido'), insert_data.get('DtAprovSol'))
-                insert_data['LeadTimeEntrega'] = calculate_lead_time_entrega(insert_data.get('DtReceb'), insert_data.get('DtAprovPedido'))
-                insert_data['AtrasoEntrega'] = calculate_atraso_entrega(insert_data.get('DtReceb'), insert_data.get('DtEntregaOrig'))
-
-                # Garantir a ordem correta para inserção
-                cols_for_insert = [col for col in INTERNAL_COLUMNS if col != 'id']
-                placeholders = ', '.join(['?'] * len(cols_for_insert))
-                sql = f"INSERT INTO solicitacoes ({', '.join(cols_for_insert)}) VALUES ({placeholders})"
-                values_tuple = tuple(insert_data.get(col) for col in cols_for_insert)
-
-                cursor.execute(sql, values_tuple)
-                rows_processed += 1
-
-            except Exception as row_error:
-                 logger.error(f"Erro ao processar linha {index}: {row_error} - Dados da linha: {row.to_dict()}")
-                 continue
-
-        conn.commit()
-        logger.info(f"Dados do arquivo {os.path.basename(file_path)} carregados com sucesso. {rows_processed} linhas processadas.")
-        return True, f"{rows_processed} registros carregados com sucesso."
+        snapshot = SnapshotWriter(content_hash, file_name, timer)
+        chunks = snapshot.record(_transformed_chunks(itertools.chain([df], frames), present_original_cols, timer))
+        return _load_parsed_chunks(chunks, file_name, content_hash, incremental, report, timer, log_chunks=streaming)
 
     except FileNotFoundError:
         logger.error(f"Erro: Arquivo não encontrado em {file_path}")
@@ -319,88 +1287,1294 @@ def process_and_load_excel(file_path):
         return False, "Dependência 'openpyxl' ausente."
     except Exception as e:
         logger.exception(f"Erro geral ao processar o arquivo Excel: {e}")
-        if conn:
-            try:
-                conn.rollback()
-            except sqlite3.Error as rb_err:
-                 logger.error(f"Erro ao fazer rollback: {rb_err}")
         return False, f"Erro inesperado ao processar Excel: {e}"
     finally:
-        if conn:
-            conn.close()
+        if frames is not None:
+            frames.close()
+        if snapshot is not None:
+            snapshot.close() # Grava o snapshot se a planilha foi lida até o fim, mesmo que a carga falhe depois
+
+def _load_parsed_chunks(chunks, file_name, content_hash, incremental, report, timer=None, log_chunks=False):
+    # Carrega os blocos (linhas, descartadas) já normalizados, vindos do Excel ou de um snapshot
+    timer = timer or StageTimer()
+    shadow_table = None
+    search_shadow = None
+    try:
+        delta = None
+        if incremental:
+            read_conn = get_read_db()
+            if not read_conn:
+                return False, "Falha ao conectar ao banco de dados."
+            with timer.stage('chaves'):
+                base_version, existing = _load_row_keys(read_conn)
+            delta = RowDelta(existing)
+        else:
+            shadow_table = f"solicitacoes_carga_{uuid.uuid4().hex[:8]}"
+            search_shadow = f"{SEARCH_INDEX_TABLE}_carga_{uuid.uuid4().hex[:8]}"
+            with db_writer() as conn:
+                create_solicitacoes_table(conn.cursor(), shadow_table)
+                create_search_index(conn.cursor(), search_shadow)
+            cols_for_insert = [col for col in INTERNAL_COLUMNS + ROW_KEY_COLUMNS if col != 'id']
+            placeholders = ', '.join(['?'] * len(cols_for_insert))
+            sql = f"INSERT INTO {shadow_table} ({', '.join(cols_for_insert)}) VALUES ({placeholders})"
+
+        occurrences = NaturalKeyCounter()
+
+        # Um commit por bloco na tabela sombra: a tabela 'solicitacoes' segue intacta para leitura,
+        # e o lock do escritor só é segurado durante o INSERT de cada bloco
+        rows_processed = 0
+        rows_rejected = 0
+        for chunk_number, (rows, rejected_count) in enumerate(chunks, start=1):
+            with timer.stage('chaves'):
+                rows = add_row_keys(rows, occurrences)
+            if delta is not None:
+                with timer.stage('insercao'):
+                    delta.add(rows)
+            else:
+                with db_writer() as conn:
+                    with timer.stage('insercao'):
+                        conn.executemany(sql, rows)
+                    # Tabela sombra nova: os ids são 1..N na ordem de inserção, então o bloco são os ids > rows_processed
+                    with timer.stage('indice_busca'):
+                        index_search_rows(conn.cursor(), shadow_table, search_shadow, min_id=rows_processed)
+                    # Commit explícito para medir o fsync do WAL à parte; o db_writer não tem mais o que confirmar
+                    with timer.stage('commit'):
+                        conn.commit()
+            rows_processed += len(rows)
+            rows_rejected += rejected_count
+            report('carregando', rows_processed, rows_rejected)
+            if log_chunks:
+                logger.info(f"Bloco {chunk_number}: {rows_processed} linhas inseridas, {rows_rejected} descartadas até agora.")
+
+        if delta is not None:
+            with timer.stage('publicacao'):
+                result = _publish_row_delta(delta, base_version, file_name, content_hash, rows_processed, rows_rejected, report)
+            if result[0]:
+                timer.finish(file_name, rows_processed, rows_rejected)
+            return result
+
+        report('resumindo', rows_processed, rows_rejected)
+        read_conn = get_read_db()
+        if not read_conn:
+            return False, "Falha ao conectar ao banco de dados."
+        with timer.stage('resumo'):
+            dashboard_data = compute_dashboard_data(read_conn.cursor(), shadow_table)
+            rollups = compute_trend_rollups(read_conn.cursor(), shadow_table)
+
+        report('trocando', rows_processed, rows_rejected)
+        with timer.stage('publicacao'), db_writer() as conn:
+            version = _swap_in_table(conn, shadow_table, search_shadow, dashboard_data, rollups, file_name, content_hash)
+            row = conn.execute(f"SELECT {DATASET_STATE_COLUMNS} FROM dataset_versoes WHERE versao = ?", (version,)).fetchone()
+        publish_dataset_state(_dataset_state_from_row(row))
+        logger.info(f"Versão {version} do conjunto de dados publicada.")
+        shadow_table = search_shadow = None
+        logger.info(f"Dados do arquivo {file_name} carregados com sucesso. {rows_processed} linhas processadas.")
+        timer.finish(file_name, rows_processed, rows_rejected)
+        return True, f"{rows_processed} registros carregados com sucesso."
+    finally:
+        if shadow_table:
+            _drop_shadow_tables(shadow_table, search_shadow)
+
+def _publish_row_delta(delta, base_version, file_name, content_hash, rows_processed, rows_rejected, report):
+    report('aplicando', rows_processed, rows_rejected)
+    with db_writer() as conn:
+        version, counts = _apply_row_delta(conn, delta, base_version, file_name, content_hash)
+        if version is not None:
+            row = conn.execute(f"SELECT {DATASET_STATE_COLUMNS} FROM dataset_versoes WHERE versao = ?", (version,)).fetchone()
+    if version is None:
+        logger.warning(f"Carga incremental de {file_name} abortada: outra carga foi publicada durante o processamento.")
+        return False, "Outra carga foi publicada durante o processamento. Envie o arquivo novamente."
+    if version != base_version:
+        publish_dataset_state(_dataset_state_from_row(row))
+        logger.info(f"Versão {version} do conjunto de dados publicada (carga incremental).")
+    summary = (f"{counts['inseridos']} inseridos, {counts['atualizados']} atualizados, "
+               f"{counts['removidos']} removidos, {counts['inalterados']} inalterados")
+    logger.info(f"Carga incremental de {file_name}: {summary}.")
+    return True, f"Carga incremental concluída: {summary}."
+
+def restore_from_snapshot(content_hash=None):
+    # Reconstrói 'solicitacoes' a partir de um snapshot (o mais recente, se content_hash=None), sem o Excel
+    content_hash = content_hash or latest_snapshot_hash()
+    chunks = iter_snapshot_chunks(content_hash) if content_hash else None
+    if chunks is None:
+        return False, "Nenhum snapshot disponível."
+    try:
+        file_name = read_snapshot_meta(content_hash)['arquivo']
+        timer = StageTimer()
+        return _load_parsed_chunks(timer.iterate('snapshot_leitura', chunks), file_name, content_hash, False, lambda *args: None, timer)
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        logger.exception(f"Erro ao restaurar o snapshot {content_hash}: {e}")
+        return False, f"Erro ao restaurar snapshot: {e}"
+
+# Vários workers sobem juntos com o mesmo banco vazio e todos chamam warm_from_snapshot. Só restaura quem
+# registra o job de restauração numa transação BEGIN IMMEDIATE, depois de confirmar ali dentro que a base
+# continua vazia; os demais veem o job em andamento (ou a base já carregada) e não fazem nada. Um job
+# parado há mais de SNAPSHOT_RESTORE_STALE_SECONDS (worker morto no meio) pode ser assumido por outro.
+SNAPSHOT_RESTORE_JOB_ID = 'restauracao-snapshot'
+SNAPSHOT_RESTORE_STALE_SECONDS = 3600
+
+def _claim_snapshot_restore():
+    now = datetime.now()
+    with db_writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(f"SELECT {DATASET_STATE_COLUMNS} FROM dataset_versoes ORDER BY versao DESC LIMIT 1").fetchone()
+        if row is None or row['linhas'] or row['hash_conteudo']:
+            return False
+        job = conn.execute("SELECT estagio, atualizado_em FROM ingestao_jobs WHERE job_id = ?", (SNAPSHOT_RESTORE_JOB_ID,)).fetchone()
+        if job and job['estagio'] not in JOB_FINAL_STAGES and \
+                (now - datetime.fromisoformat(job['atualizado_em'])).total_seconds() < SNAPSHOT_RESTORE_STALE_SECONDS:
+            return False
+        timestamp = now.isoformat(timespec='seconds')
+        conn.execute(
+            "INSERT OR REPLACE INTO ingestao_jobs (job_id, arquivo, estagio, criado_em, atualizado_em) VALUES (?, 'snapshot', 'restaurando', ?, ?)",
+            (SNAPSHOT_RESTORE_JOB_ID, timestamp, timestamp)
+        )
+        return True
+
+def warm_from_snapshot():
+    # Worker com banco recém-criado (vazio, sem arquivo de origem) e snapshot disponível: recarrega dele
+    state = get_dataset_state()
+    if state is None or state['estado'] != 'vazio' or state['hash_conteudo'] or not latest_snapshot_hash():
+        return
+    try:
+        if not _claim_snapshot_restore():
+            logger.info("Restauração do snapshot já feita ou em andamento em outro processo.")
+            return
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao registrar a restauração do snapshot: {e}")
+        return
+    success, message = restore_from_snapshot()
+    logger.info(f"Base restaurada a partir do snapshot mais recente: {message}" if success else f"Snapshot não restaurado: {message}")
+    if success:
+        _update_job(SNAPSHOT_RESTORE_JOB_ID, estagio='concluido', mensagem=message)
+    else:
+        _update_job(SNAPSHOT_RESTORE_JOB_ID, estagio='erro', mensagem=message, erro=message)
+
+# --- Cargas com Várias Planilhas (pool de processos) ---
+# Uma pasta por unidade, uma planilha por mês: todas as planilhas de todos os arquivos enviados formam uma
+# única carga. Ler o .xlsx (openpyxl) e transformar as linhas é o que pesa e depende só da CPU, então cada
+# planilha vai para um processo do pool; o processo principal junta os blocos na ordem (arquivo, planilha)
+# e grava tudo por _load_parsed_chunks: uma tabela sombra publicada numa única troca (ou um único delta
+# incremental). O pool usa 'spawn': o processo principal tem threads e conexões SQLite abertas.
+
+def list_worksheets(file_path):
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        return [sheet.title for sheet in wb.worksheets]
+    finally:
+        wb.close()
+
+def parse_sheet(file_path, sheet_name):
+    # Executada nos processos do pool: lê e transforma uma planilha inteira.
+    # Retorna {'blocos': [(linhas, descartadas)], 'ausentes': [colunas essenciais ausentes], 'tempos': {etapa: s},
+    #          'invalidos': {coluna: valores inválidos}}
+    timer = StageTimer()
+    frames = timer.iterate('leitura', iter_excel_chunks(file_path, sheet_name=sheet_name))
+    try:
+        df = next(frames)
+        with timer.stage('mapeamento'):
+            present_original_cols, missing_original_cols = map_excel_columns(df.columns.tolist())
+        if missing_original_cols:
+            return {'blocos': [], 'ausentes': missing_original_cols, 'tempos': timer.totals, 'invalidos': {}}
+        blocks = list(_transformed_chunks(itertools.chain([df], frames), present_original_cols, timer))
+    finally:
+        frames.close()
+    return {'blocos': blocks, 'ausentes': [], 'tempos': timer.totals, 'invalidos': timer.invalid}
+
+def _sheet_report_entry(file_name, sheet_name, result):
+    entry = {
+        'arquivo': file_name,
+        'planilha': sheet_name,
+        'linhas': sum(len(rows) for rows, _ in result['blocos']),
+        'descartadas': sum(rejected_count for _, rejected_count in result['blocos']),
+        'erro': None,
+    }
+    if result['ausentes']:
+        entry['erro'] = f"Colunas essenciais não encontradas/mapeadas: {', '.join(result['ausentes'])}"
+    return entry
+
+def _parsed_in_order(pool, sheets, workers):
+    # parse_sheet de cada planilha no pool, entregue na ordem de envio. No máximo 'workers' planilhas ficam
+    # em leitura ou aguardando consumo: um resultado só sai da memória do processo principal depois de carregado,
+    # então a próxima planilha é enviada quando a anterior é entregue
+    queue = iter(sheets)
+    pending = [pool.submit(parse_sheet, path, sheet_name) for path, _, sheet_name in itertools.islice(queue, workers)]
+    while pending:
+        result = pending.pop(0).result()
+        for path, _, sheet_name in itertools.islice(queue, 1):
+            pending.append(pool.submit(parse_sheet, path, sheet_name))
+        yield result
+        result = None
+
+def process_and_load_workbooks(files, streaming=None, progress=None, incremental=False):
+    # files: [(caminho, nome exibido, sha256 ou None)]. Retorna (sucesso, mensagem, relatório por planilha:
+    # [{arquivo, planilha, linhas, descartadas, erro}]). Planilhas sem as colunas essenciais (ex.: uma aba de
+    # resumo) ficam de fora e aparecem no relatório com o erro; a carga falha se nenhuma servir.
+    # Um único arquivo com uma única planilha segue por process_and_load_excel (streaming, sem pool).
+    report = progress or (lambda *args: None)
+    file_name = ', '.join(name for _, name, _ in files)
+    sheet_report = []
+    timer = StageTimer()
+    pool = None
+    snapshot = None
+    try:
+        hashes = [file_hash or file_content_hash(path) for path, _, file_hash in files]
+        sheets = [(path, name, sheet_name) for path, name, _ in files for sheet_name in list_worksheets(path)]
+        if len(sheets) <= 1:
+            path, name, sheet_name = sheets[0] if sheets else (files[0][0], files[0][1], None)
+            counts = {}
+            def track(stage, rows_processed, rows_rejected):
+                counts.update(linhas=rows_processed, descartadas=rows_rejected)
+                report(stage, rows_processed, rows_rejected)
+            success, message = process_and_load_excel(path, streaming=streaming, progress=track, incremental=incremental,
+                                                      file_name=name, content_hash=hashes[0])
+            if counts:
+                sheet_report.append({'arquivo': name, 'planilha': sheet_name, 'erro': None if success else message, **counts})
+            return success, message, sheet_report
+
+        ensure_db()
+        # Várias pastas: o conteúdo da carga é a sequência dos arquivos, na ordem enviada
+        content_hash = hashes[0] if len(files) == 1 else hashlib.sha256('\n'.join(hashes).encode()).hexdigest()
+        published = _published_content_result(content_hash, file_name)
+        if published:
+            return (*published, sheet_report)
+
+        report('lendo', 0, 0)
+        snapshot_chunks = iter_snapshot_chunks(content_hash)
+        if snapshot_chunks is not None:
+            logger.info(f"Snapshot de {file_name} encontrado; as planilhas não serão relidas.")
+            sheet_report = read_snapshot_meta(content_hash).get('relatorio', [])
+            success, message = _load_parsed_chunks(timer.iterate('snapshot_leitura', snapshot_chunks), file_name,
+                                                   content_hash, incremental, report, timer)
+            return success, message, sheet_report
+
+        workers = min(INGESTION_PROCESSES, len(sheets))
+        logger.info(f"Lendo {len(sheets)} planilhas de {len(files)} arquivo(s) em {workers} processo(s).")
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            outcomes = _parsed_in_order(pool, sheets, workers)
+        else: # Um núcleo só: subir processos e serializar as linhas de volta só custaria tempo
+            outcomes = (parse_sheet(path, sheet_name) for path, _, sheet_name in sheets)
+
+        def valid_sheets():
+            # Cada planilha entra no relatório ao chegar; só as que têm as colunas essenciais seguem para a carga
+            for (_, name, sheet_name), result in zip(sheets, outcomes):
+                timer.add(result['tempos'])
+                timer.count_invalid(result['invalidos'])
+                entry = _sheet_report_entry(name, sheet_name, result)
+                sheet_report.append(entry)
+                if entry['erro']:
+                    logger.warning(f"Planilha '{sheet_name}' de {name} ignorada. {entry['erro']}")
+                    continue
+                yield result
+
+        # 'leitura' e 'transformacao' somam o tempo de todos os processos; 'pool_processos' é só a espera
+        # pelos resultados, intercalada com a carga dos blocos já recebidos
+        results = timer.iterate('pool_processos', valid_sheets())
+        # A tabela sombra só é criada depois que uma planilha válida chega
+        first = next(results, None)
+        if first is None:
+            return False, "Nenhuma planilha com as colunas essenciais foi encontrada.", sheet_report
+
+        def chunks():
+            # Blocos de uma planilha por vez, na ordem de envio: cada bloco sai do resultado ao ser
+            # consumido, sem esperar pelas demais planilhas
+            for result in itertools.chain([first], results):
+                blocks = result.pop('blocos')
+                blocks.reverse()
+                while blocks:
+                    yield blocks.pop()
+
+        snapshot = SnapshotWriter(content_hash, file_name, timer)
+        # Mesma lista, completa quando o snapshot fecha com todas as planilhas consumidas
+        snapshot.report = sheet_report
+        success, message = _load_parsed_chunks(snapshot.record(chunks()), file_name, content_hash, incremental, report, timer,
+                                               log_chunks=True)
+        if success:
+            for entry in sheet_report:
+                logger.info(f"Planilha '{entry['planilha']}' de {entry['arquivo']}: {entry['linhas']} linhas carregadas, "
+                            f"{entry['descartadas']} descartadas{' (ignorada)' if entry['erro'] else ''}.")
+        return success, message, sheet_report
+
+    except FileNotFoundError:
+        logger.error(f"Erro: Arquivo não encontrado entre {file_name}")
+        return False, "Arquivo Excel não encontrado.", sheet_report
+    except Exception as e:
+        logger.exception(f"Erro geral ao processar as planilhas de {file_name}: {e}")
+        return False, f"Erro inesperado ao processar Excel: {e}", sheet_report
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if snapshot is not None:
+            snapshot.close()
+
+# --- Snapshots das Planilhas Processadas ---
+# Depois de cada leitura completa do Excel, as linhas normalizadas (as tuplas de transform_dataframe) vão
+# para SNAPSHOT_FOLDER/<sha256 do arquivo>.npz, um .npy por coluna e bloco. Colunas numéricas viram float64
+# (NaN = NULL); as demais são fatoradas em códigos int32 + valores distintos separados por tipo (texto,
+# inteiro, real). Nada usa pickle: o arquivo é lido com allow_pickle=False.
+SNAPSHOT_FORMAT = 1
+_SNAPSHOT_NUMERIC_DTYPES = ('integer', 'floating', 'mixed-integer-float', 'empty')
+
+def file_content_hash(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def snapshot_path(content_hash):
+    return os.path.join(SNAPSHOT_FOLDER, f'{content_hash}.npz')
+
+def latest_snapshot_hash():
+    try:
+        snapshots = [entry for entry in os.scandir(SNAPSHOT_FOLDER) if entry.name.endswith('.npz')]
+    except OSError:
+        return None
+    if not snapshots:
+        return None
+    return max(snapshots, key=lambda entry: entry.stat().st_mtime).name[:-len('.npz')]
+
+def _encode_snapshot_column(values, numeric):
+    if numeric and pd.api.types.infer_dtype(values, skipna=True) in _SNAPSHOT_NUMERIC_DTYPES:
+        return {'f': pd.Series(values, dtype=object).astype('float64').to_numpy()}
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    kinds = np.array([1 if isinstance(u, (int, np.integer)) else 2 if isinstance(u, (float, np.floating)) else 0
+                      for u in uniques], dtype=np.int8)
+    return {
+        'c': codes.astype(np.int32),
+        'k': kinds,
+        's': np.array([str(u) if kind == 0 else '' for u, kind in zip(uniques, kinds)], dtype=str),
+        'i': np.array([int(u) if kind == 1 else 0 for u, kind in zip(uniques, kinds)], dtype=np.int64),
+        'r': np.array([float(u) if kind == 2 else 0.0 for u, kind in zip(uniques, kinds)], dtype=np.float64),
+    }
+
+def _decode_snapshot_column(arrays, col_type):
+    if 'f' in arrays:
+        floats = arrays['f']
+        nulls = np.isnan(floats)
+        if col_type == 'INTEGER':
+            values = np.where(nulls, 0, floats).astype(np.int64).astype(object)
+        else:
+            values = floats.astype(object)
+        values[nulls] = None
+        return values
+    kinds = arrays['k']
+    uniques = np.empty(len(kinds) + 1, dtype=object) # Última posição: código -1 (nulo)
+    uniques[:-1] = arrays['s'].astype(object)
+    uniques[:-1][kinds == 1] = arrays['i'][kinds == 1].astype(object)
+    uniques[:-1][kinds == 2] = arrays['r'][kinds == 2].astype(object)
+    return uniques[arrays['c']]
+
+class SnapshotWriter:
+    # Grava os blocos conforme passam por record(); close() publica o snapshot só se o gerador foi até o fim
+    def __init__(self, content_hash, file_name, timer=None):
+        self.content_hash = content_hash
+        self.file_name = file_name
+        self.timer = timer or StageTimer()
+        self.blocks = []
+        self.complete = False
+        self.report = None # Relatório por planilha das cargas com várias planilhas, guardado nos metadados
+        self._tmp_path = f"{snapshot_path(content_hash)}.{uuid.uuid4().hex[:8]}.tmp"
+        self._zip = None
+
+    def record(self, chunks):
+        for rows, rejected_count in chunks:
+            with self.timer.stage('snapshot_gravacao'):
+                self._write_block(rows, rejected_count)
+            yield rows, rejected_count
+        self.complete = True
+
+    def _write_block(self, rows, rejected_count):
+        if self._zip is None:
+            os.makedirs(SNAPSHOT_FOLDER, exist_ok=True)
+            self._zip = zipfile.ZipFile(self._tmp_path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        block = len(self.blocks)
+        columns = list(zip(*rows)) if rows else [()] * len(INTERNAL_COLUMNS)
+        for col, numeric, values in zip(INTERNAL_COLUMNS, _NUMERIC_COLUMNS, columns):
+            for suffix, array in _encode_snapshot_column(np.array(values, dtype=object), numeric).items():
+                self._write_array(f'b{block:05d}.{col}.{suffix}', array)
+        self.blocks.append(rejected_count)
+
+    def _write_array(self, name, array):
+        with self._zip.open(f'{name}.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+
+    def close(self):
+        if self._zip is None and not self.complete:
+            return
+        try:
+            if self._zip is None: # Planilha sem linhas: o snapshot só registra os metadados
+                os.makedirs(SNAPSHOT_FOLDER, exist_ok=True)
+                self._zip = zipfile.ZipFile(self._tmp_path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+            if self.complete:
+                meta = {'formato': SNAPSHOT_FORMAT, 'arquivo': self.file_name, 'colunas': INTERNAL_COLUMNS, 'blocos': self.blocks}
+                if self.report is not None:
+                    meta['relatorio'] = self.report
+                self._write_array('meta', np.array(json.dumps(meta, ensure_ascii=False)))
+            self._zip.close()
+            if self.complete:
+                os.replace(self._tmp_path, snapshot_path(self.content_hash))
+                logger.info(f"Snapshot de {self.file_name} gravado ({len(self.blocks)} blocos).")
+                _prune_snapshots()
+        except OSError as e:
+            logger.error(f"Erro ao gravar snapshot de {self.file_name}: {e}")
+        finally:
+            self._zip = None
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+def _prune_snapshots():
+    state = get_dataset_state()
+    published = f"{state['hash_conteudo']}.npz" if state and state['hash_conteudo'] else None
+    snapshots = sorted((entry for entry in os.scandir(SNAPSHOT_FOLDER) if entry.name.endswith('.npz')),
+                       key=lambda entry: entry.stat().st_mtime, reverse=True)
+    oldest = time.time() - SNAPSHOT_MAX_AGE_DAYS * 86400 if SNAPSHOT_MAX_AGE_DAYS else None
+    for position, entry in enumerate(snapshots):
+        if entry.name == published:
+            continue
+        if position >= SNAPSHOT_KEEP or (oldest is not None and entry.stat().st_mtime < oldest):
+            os.remove(entry.path)
+            logger.info(f"Snapshot {entry.name} descartado pela retenção; os agregados de tendência da versão continuam no banco.")
+
+def read_snapshot_meta(content_hash):
+    with np.load(snapshot_path(content_hash), allow_pickle=False) as npz:
+        return json.loads(str(npz['meta']))
+
+def iter_snapshot_chunks(content_hash):
+    # Gerador de blocos (linhas, descartadas) do snapshot, ou None se não existe ou é de outro formato
+    path = snapshot_path(content_hash)
+    if not os.path.exists(path):
+        return None
+    try:
+        meta = read_snapshot_meta(content_hash)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        logger.warning(f"Snapshot {path} ilegível, será ignorado: {e}")
+        return None
+    if meta.get('formato') != SNAPSHOT_FORMAT or meta.get('colunas') != INTERNAL_COLUMNS:
+        logger.info(f"Snapshot {path} é de outro formato/esquema, será ignorado.")
+        return None
+    os.utime(path) # Mantém o snapshot em uso entre os SNAPSHOT_KEEP mais recentes (e dentro de SNAPSHOT_MAX_AGE_DAYS)
+
+    def chunks():
+        with np.load(path, allow_pickle=False) as npz:
+            names = {}
+            for name in npz.files:
+                prefix, _, suffix = name.rpartition('.')
+                names.setdefault(prefix, []).append((suffix, name))
+            for block, rejected_count in enumerate(meta['blocos']):
+                columns = []
+                for col, col_type in zip(INTERNAL_COLUMNS, _COLUMN_TYPES):
+                    arrays = {suffix: npz[name] for suffix, name in names[f'b{block:05d}.{col}']}
+                    columns.append(_decode_snapshot_column(arrays, col_type))
+                yield list(zip(*columns)), rejected_count
+    return chunks()
+
+# --- Jobs de Ingestão em Segundo Plano ---
+# Um único worker por processo: uploads simultâneos entram na fila em vez de competir pela escrita.
+# O estado do job fica no SQLite para que qualquer worker do gunicorn consiga consultá-lo.
+INGESTION_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingestao')
+JOB_FINAL_STAGES = ('concluido', 'erro')
+
+def _update_job(job_id, **fields):
+    fields['atualizado_em'] = datetime.now().isoformat(timespec='seconds')
+    assignments = ', '.join(f'{col} = ?' for col in fields)
+    try:
+        with db_writer() as conn:
+            conn.execute(f"UPDATE ingestao_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao atualizar job de ingestão {job_id}: {e}")
+
+def _run_ingestion_job(job_id, files, streaming, incremental=False):
+    def progress(stage, rows_processed, rows_rejected):
+        _update_job(job_id, estagio=stage, linhas_processadas=rows_processed, linhas_descartadas=rows_rejected)
+
+    sheet_report = []
+    try:
+        success, message, sheet_report = process_and_load_workbooks(files, streaming=streaming, progress=progress,
+                                                                    incremental=incremental)
+    except Exception as e:
+        logger.exception(f"Erro inesperado no job de ingestão {job_id}: {e}")
+        success, message = False, f"Erro inesperado ao processar Excel: {e}"
+    if success and COLUMNAR_ENGINE:
+        get_columnar_dataset() # Aquece o motor colunar aqui, não na primeira requisição
+    relatorio = json.dumps(sheet_report, ensure_ascii=False)
+    if success:
+        _update_job(job_id, estagio='concluido', mensagem=message, relatorio=relatorio)
+    else:
+        _update_job(job_id, estagio='erro', mensagem=message, erro=message, relatorio=relatorio)
+
+def save_upload(file_storage):
+    # Grava o upload em UPLOAD_FOLDER/<sha256>.xlsx, calculando o hash durante a cópia: reenviar o mesmo
+    # conteúdo reaproveita o arquivo. Retorna (caminho, hash).
+    hasher = hashlib.sha256()
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f'.upload-{uuid.uuid4().hex[:8]}.tmp')
+    with open(tmp_path, 'wb') as f:
+        for block in iter(lambda: file_storage.stream.read(1024 * 1024), b''):
+            hasher.update(block)
+            f.write(block)
+    content_hash = hasher.hexdigest()
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f'{content_hash}.xlsx')
+    os.replace(tmp_path, file_path)
+    return file_path, content_hash
+
+def start_ingestion_job(files, streaming=None, incremental=False):
+    # files: [(caminho, nome exibido, sha256 ou None)], carregados juntos como um único conjunto de dados
+    ensure_db() # Garante que a tabela de jobs exista
+    job_id = uuid.uuid4().hex
+    now = datetime.now().isoformat(timespec='seconds')
+    file_name = ', '.join(name for _, name, _ in files)
+    try:
+        with db_writer() as conn:
+            conn.execute(
+                "INSERT INTO ingestao_jobs (job_id, arquivo, estagio, criado_em, atualizado_em) VALUES (?, ?, 'na_fila', ?, ?)",
+                (job_id, file_name, now, now)
+            )
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao registrar job de ingestão: {e}")
+        return None
+    INGESTION_EXECUTOR.submit(_run_ingestion_job, job_id, files, streaming, incremental)
+    logger.info(f"Job de ingestão {job_id} enfileirado para {file_name}.")
+    return job_id
+
+def get_ingestion_job(job_id):
+    conn = get_read_db()
+    if not conn:
+        return None
+    try:
+        row = timed_query(conn, 'job_ingestao', "SELECT * FROM ingestao_jobs WHERE job_id = ?", (job_id,), fetch='one')
+        if not row:
+            return None
+        job = dict(row)
+        job['relatorio'] = json.loads(job['relatorio']) if job['relatorio'] else []
+        return job
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao consultar job de ingestão {job_id}: {e}")
+        return None
+
+# --- Cache de Respostas do Chatbot ---
+class AnswerCache:
+    # LRU limitado com TTL opcional. As chaves levam a versão do conjunto de dados, então uma resposta
+    # nunca sobrevive a uma nova carga; publish_dataset_state ainda limpa tudo para liberar memória.
+    def __init__(self, max_entries=CHAT_CACHE_MAX_ENTRIES, ttl=CHAT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl or None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entradas': len(self._entries), 'acertos': self.hits, 'falhas': self.misses}
+
+chat_answer_cache = AnswerCache()
+
+def chat_cache_key(state, intent, params):
+    # Chave pela intenção resolvida e seus parâmetros, não pelo texto digitado; None (resposta fora do cache)
+    # quando algum parâmetro não pode entrar na chave
+    try:
+        key = (state['versao'], intent.name, tuple(sorted(params.items())))
+        hash(key)
+    except TypeError:
+        logger.warning(f"Parâmetros da intenção '{intent.name}' fora do cache de respostas: {params!r}")
+        return None
+    return key
+
+# --- Estado do Conjunto de Dados ---
+# Registro de carregado/vazio, linhas, versão e data da carga. A fonte persistente é dataset_versoes
+# (gravada na mesma transação da troca de tabela); cada processo guarda a última versão em memória e só a
+# relê quando PRAGMA data_version indica um commit de outra conexão (outro worker, o job de ingestão).
+DATASET_STATE_COLUMNS = 'versao, arquivo, linhas, carregado_em, hash_conteudo'
+_dataset_state = {'state': None}
+_dataset_state_lock = threading.Lock()
+
+def _dataset_state_from_row(row):
+    return {
+        'estado': 'carregado' if row['linhas'] else 'vazio',
+        'linhas': row['linhas'] or 0,
+        'versao': row['versao'],
+        'arquivo': row['arquivo'],
+        'carregado_em': row['carregado_em'],
+        'hash_conteudo': row['hash_conteudo'],
+    }
+
+def publish_dataset_state(state):
+    # Chamado pela ingestão logo após publicar uma versão; leituras neste processo a veem na hora
+    with _dataset_state_lock:
+        current = _dataset_state['state']
+        if current is None or state['versao'] >= current['versao']:
+            _dataset_state['state'] = state
+            if current is not None and state['versao'] != current['versao']:
+                chat_answer_cache.clear()
+                _columnar['dataset'] = None # Libera a versão antiga; a nova é carregada no próximo uso
+                _dashboard_cache['entry'] = None
+
+def get_dataset_state():
+    # Retorna o estado atual, ou None se o banco ainda não tem esquema/versão publicada
+    conn = get_read_db()
+    if not conn:
+        return None
+    try:
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if getattr(_db_local, 'data_version', None) == data_version and _dataset_state['state'] is not None:
+            return _dataset_state['state']
+        row = timed_query(conn, 'estado_dataset', f"SELECT {DATASET_STATE_COLUMNS} FROM dataset_versoes ORDER BY versao DESC LIMIT 1", fetch='one')
+    except sqlite3.Error as e:
+        logger.warning(f"Estado do conjunto de dados indisponível: {e}")
+        return None
+    if not row:
+        return None
+    _db_local.data_version = data_version
+    publish_dataset_state(_dataset_state_from_row(row))
+    return _dataset_state['state']
+
+# --- Motor Colunar em Memória ---
+# Entre uploads a base é somente leitura e cabe na memória: com ZAR_COLUMNAR_ENGINE=1 cada processo mantém
+# as colunas usadas pelo chat e pelo dashboard em arrays NumPy da versão publicada, e o SQLite fica só
+# como persistência. Comprador/Etapa/Status são codificados em dicionário (códigos int32 + categorias) e
+# Solicitacao tem um índice hash para a primeira linha de cada número. Uma nova versão descarta os arrays.
+COLUMNAR_COLUMNS = ['id', 'Solicitacao', 'Comprador', 'Etapa', 'Status', 'DiasAtrSol', 'VlrTotal',
+                    'LeadTimeCompra', 'LeadTimeEntrega', 'AtrasoEntrega']
+
+class ColumnarDataset:
+    def __init__(self, version, rows):
+        columns = dict(zip(COLUMNAR_COLUMNS, zip(*rows))) if rows else dict.fromkeys(COLUMNAR_COLUMNS, ())
+        self.version = version
+        self.size = len(rows)
+        self.ids = np.array(columns['id'], dtype=np.int64)
+        self.solicitacao = np.array(columns['Solicitacao'], dtype=object)
+        self.comprador_codes, self.comprador_values = self._encode(columns['Comprador'])
+        self.etapa_codes, self.etapa_values = self._encode(columns['Etapa'])
+        self.status_codes, self.status_values = self._encode(columns['Status'])
+        self.vlr_total = np.array(columns['VlrTotal'], dtype=np.float64) # None -> NaN
+        self.dias, self.dias_valid = self._integers(columns['DiasAtrSol'])
+        self.lead_time_compra = self._integers(columns['LeadTimeCompra'])
+        self.lead_time_entrega = self._integers(columns['LeadTimeEntrega'])
+        self.atraso_entrega = self._integers(columns['AtrasoEntrega'])
+
+        self.solicitacao_index = {}
+        for row_index, value in enumerate(columns['Solicitacao']):
+            if value is not None:
+                self.solicitacao_index.setdefault(value, row_index)
+
+        # Linhas com DiasAtrSol na ordem das listas de atraso (DiasAtrSol DESC, id DESC), com as chaves
+        # negadas para busca binária crescente
+        valid_rows = np.flatnonzero(self.dias_valid)
+        self.atraso_order = valid_rows[np.lexsort((-self.ids[valid_rows], -self.dias[valid_rows]))]
+        self.atraso_neg_dias = -self.dias[self.atraso_order]
+        self.atraso_neg_ids = -self.ids[self.atraso_order]
+        self.status_counts = self._category_counts(self.status_codes, self.status_values)
+        self._dashboard = None
+        self._cotacao_order = None
+
+    @staticmethod
+    def _encode(values):
+        codes, categories = pd.factorize(np.array(values, dtype=object), use_na_sentinel=False)
+        categories = [None if value is None or value != value else value for value in categories]
+        return codes.astype(np.int32), categories
+
+    @staticmethod
+    def _integers(values):
+        floats = np.array(values, dtype=np.float64)
+        valid = ~np.isnan(floats)
+        return np.where(valid, floats, 0).astype(np.int64), valid
+
+    def _category_counts(self, codes, categories):
+        return dict(zip(categories, np.bincount(codes, minlength=len(categories)).tolist()))
+
+    def _code(self, categories, value):
+        return categories.index(value) if value in categories else -1
+
+    def row(self, row_index):
+        return {
+            'id': int(self.ids[row_index]),
+            'Solicitacao': self.solicitacao[row_index],
+            'Comprador': self.comprador_values[self.comprador_codes[row_index]],
+            'Etapa': self.etapa_values[self.etapa_codes[row_index]],
+            'Status': self.status_values[self.status_codes[row_index]],
+            'DiasAtrSol': int(self.dias[row_index]) if self.dias_valid[row_index] else None,
+        }
+
+    def find_solicitacao(self, solicitacao_id):
+        row_index = self.solicitacao_index.get(solicitacao_id)
+        return None if row_index is None else self.row(row_index)
+
+    def count_pending(self):
+        # Mesma semântica do SQL: Status NULL não entra no NOT IN
+        return sum(count for status, count in self.status_counts.items() if status is not None and status not in CLOSED_STATUSES)
+
+    def atraso_range(self, dias_atraso, apos=None):
+        # (início, fim) em atraso_order das linhas com DiasAtrSol > dias_atraso, após a chave apos
+        end = int(np.searchsorted(self.atraso_neg_dias, -dias_atraso, side='left'))
+        start = 0
+        if apos is not None:
+            lo = int(np.searchsorted(self.atraso_neg_dias, -apos[0], side='left'))
+            hi = int(np.searchsorted(self.atraso_neg_dias, -apos[0], side='right'))
+            start = lo + int(np.searchsorted(self.atraso_neg_ids[lo:hi], -apos[1], side='right'))
+        return start, max(start, end)
+
+    def atraso_rows(self, start, stop):
+        return [self.row(row_index) for row_index in self.atraso_order[start:stop]]
+
+    def cotacao_order(self):
+        # Linhas em etapa de cotação na ordem da lista paginada do dashboard: DiasAtrSol DESC com NULL por
+        # último e empate por id DESC, como a varredura de idx_solicitacoes_etapa_dias em LATE_QUOTATION_SQL
+        if self._cotacao_order is None:
+            cotacao_codes = [self._code(self.etapa_values, etapa) for etapa in COTACAO_ETAPAS]
+            rows = np.flatnonzero(np.isin(self.etapa_codes, cotacao_codes))
+            self._cotacao_order = rows[np.lexsort((-self.ids[rows], -self.dias[rows], ~self.dias_valid[rows]))]
+        return self._cotacao_order
+
+    def cotacao_rows(self, start, stop):
+        return [{key: row[key] for key in LATE_QUOTATION_COLUMNS}
+                for row in (self.row(row_index) for row_index in self.cotacao_order()[start:stop])]
+
+    def _integer_mean(self, column):
+        values, valid = column
+        count = int(valid.sum())
+        # Soma inteira exata, como o AVG do SQLite sobre colunas INTEGER
+        return round(int(values[valid].sum()) / count, 2) if count else 'N/A'
+
+    def dashboard_data(self):
+        # Mesmo payload de compute_dashboard_data, calculado uma vez por versão sobre os arrays
+        if self._dashboard is not None:
+            return self._dashboard
+        if self.size == 0:
+            self._dashboard = dict(EMPTY_DASHBOARD)
+            return self._dashboard
+        data = {'total_solicitacoes': self.size, 'tabela_vazia': False}
+
+        aprovado = self.status_codes == self._code(self.status_values, 'aprovado')
+        data['total_compras'] = float(np.nansum(self.vlr_total[aprovado])) or 0
+
+        comprador_counts = self._category_counts(self.comprador_codes, self.comprador_values)
+        por_comprador = [(nome, comprador_counts[nome]) for nome in COMPRADORES if comprador_counts.get(nome)]
+        data['por_comprador'] = dict(sorted(por_comprador, key=lambda item: -item[1]))
+
+        por_etapa = {}
+        for etapa, count in self._category_counts(self.etapa_codes, self.etapa_values).items():
+            if count:
+                key = 'Sem etapa' if etapa is None else etapa
+                por_etapa[key] = por_etapa.get(key, 0) + count
+        data['por_etapa'] = dict(sorted(por_etapa.items()))
+
+        data['atrasadas_cotacao_total'] = len(self.cotacao_order())
+
+        data['lead_time_compra_medio'] = self._integer_mean(self.lead_time_compra)
+        data['lead_time_entrega_medio'] = self._integer_mean(self.lead_time_entrega)
+        data['atraso_entrega_medio'] = self._integer_mean(self.atraso_entrega)
+
+        desempenho = []
+        for nome in COMPRADORES:
+            selected = aprovado & (self.comprador_codes == self._code(self.comprador_values, nome))
+            if selected.any():
+                total = float(np.nansum(self.vlr_total[selected]))
+                desempenho.append((nome, total or 0))
+        data['desempenho_comprador'] = dict(sorted(desempenho, key=lambda item: -item[1]))
+        self._dashboard = data
+        return data
+
+_columnar = {'dataset': None}
+_columnar_lock = threading.Lock()
+
+def load_columnar_dataset():
+    # Lê a versão publicada e suas linhas numa única transação de leitura
+    conn = get_read_db()
+    if not conn:
+        return None
+    try:
+        conn.execute("BEGIN")
+        try:
+            version = conn.execute("SELECT MAX(versao) FROM dataset_versoes").fetchone()[0]
+            rows = timed_query(conn, 'motor_colunar_carga', f"SELECT {', '.join(COLUMNAR_COLUMNS)} FROM solicitacoes ORDER BY id")
+        finally:
+            conn.rollback()
+        dataset = ColumnarDataset(version, rows)
+    except (sqlite3.Error, ValueError, TypeError) as e:
+        logger.error(f"Motor colunar indisponível, consultas seguem pelo SQLite: {e}")
+        return None
+    logger.info(f"Motor colunar carregado: versão {version}, {dataset.size} linhas.")
+    return dataset
+
+def get_columnar_dataset(state=None):
+    # Arrays da versão publicada, ou None (o chamador usa o SQLite) se não foi possível carregá-los
+    state = state or get_dataset_state()
+    if state is None:
+        return None
+    dataset = _columnar['dataset']
+    if dataset is None or dataset.version != state['versao']:
+        with _columnar_lock:
+            dataset = _columnar['dataset']
+            if dataset is None or dataset.version != state['versao']:
+                dataset = load_columnar_dataset()
+                _columnar['dataset'] = dataset
+    return dataset if dataset is not None and dataset.version == state['versao'] else None
 
 # --- Funções para buscar dados do Dashboard ---
-def get_dashboard_data():
-    conn = get_db()
+# Etapas da lista "atrasadas em cotação". O resumo materializado guarda só a contagem; as páginas vêm do SQL:
+# uma subconsulta por etapa percorre idx_solicitacoes_etapa_dias (Etapa, DiasAtrSol, rowid) de trás para
+# frente, parando em offset + tamanho linhas, e o MERGE das duas entrega a página sem ordenar a lista inteira.
+COTACAO_ETAPAS = ('02_COTAR', '05_COTADA')
+LATE_QUOTATION_COLUMNS = ['id', 'Solicitacao', 'Etapa', 'Comprador', 'DiasAtrSol']
+LATE_QUOTATION_SQL = (
+    "SELECT * FROM ("
+    + " UNION ALL ".join(f"SELECT * FROM (SELECT {', '.join(LATE_QUOTATION_COLUMNS)} FROM solicitacoes WHERE Etapa = ? "
+                         "ORDER BY DiasAtrSol DESC, id DESC LIMIT ?)" for _ in COTACAO_ETAPAS)
+    + ") ORDER BY DiasAtrSol DESC, id DESC LIMIT ? OFFSET ?")
+
+def get_late_quotation_page(state, page, page_size):
+    # Uma página da lista de atrasadas em cotação da versão publicada, ou None se o banco falhar
+    start = (page - 1) * page_size
+    dataset = get_columnar_dataset(state) if COLUMNAR_ENGINE else None
+    if dataset is not None:
+        return dataset.cotacao_rows(start, start + page_size)
+    conn = get_read_db()
     if not conn:
-        return {'error': 'Falha ao conectar ao banco de dados.'}
-    cursor = conn.cursor()
-    data = {}
+        return None
+    args = []
+    for etapa in COTACAO_ETAPAS:
+        args.extend((etapa, start + page_size))
     try:
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='solicitacoes'")
-        if not cursor.fetchone():
-            logger.warning("Tabela 'solicitacoes' não encontrada ao buscar dados do dashboard.")
-            # Retorna um dicionário indicando que a tabela está vazia/não existe
-            return {'tabela_vazia': True}
+        return [dict(row) for row in timed_query(conn, 'dashboard_atrasadas_pagina', LATE_QUOTATION_SQL, args + [page_size, start])]
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao buscar a lista de atrasadas em cotação: {e}")
+        return None
 
-        cursor.execute("SELECT COUNT(*) FROM solicitacoes")
-        total_solicitacoes = cursor.fetchone()[0]
-        data['total_solicitacoes'] = total_solicitacoes
-
-        # Se não houver solicitações, retornar dados vazios/padrão
-        if total_solicitacoes == 0:
-            logger.info("Tabela 'solicitacoes' está vazia.")
-            data.update({
-                'total_compras': 0,
-                'por_comprador': {},
-                'por_etapa': {},
-                'atrasadas_cotacao': [],
-                'lead_time_compra_medio': 'N/A',
-                'lead_time_entrega_medio': 'N/A',
-                'atraso_entrega_medio': 'N/A',
-                'desempenho_comprador': {},
-                'tabela_vazia': True # Indica que a tabela está vazia
-            })
-            return data
-        else:
-             data['tabela_vazia'] = False # Indica que há dados
+EMPTY_DASHBOARD = {
+    'total_solicitacoes': 0,
+    'total_compras': 0,
+    'por_comprador': {},
+    'por_etapa': {},
+    'atrasadas_cotacao_total': 0,
+    'lead_time_compra_medio': 'N/A',
+    'lead_time_entrega_medio': 'N/A',
+    'atraso_entrega_medio': 'N/A',
+    'desempenho_comprador': {},
+    'tabela_vazia': True # Indica que a tabela está vazia
+}
 
-        # Continuar buscando outros dados se a tabela não estiver vazia
-        cursor.execute("SELECT SUM(VlrTotal) FROM solicitacoes WHERE Status = 'aprovado'")
-        total_compras = cursor.fetchone()[0]
-        data['total_compras'] = total_compras if total_compras else 0
+def compute_dashboard_data(cursor, table_name='solicitacoes'):
+    # Calcula o payload completo do dashboard. Roda uma vez por carga (na tabela sombra, antes da troca);
+    # as requisições do /admin só leem o resultado materializado em dashboard_resumo.
+    total_solicitacoes = timed_query(cursor, 'dashboard_total', f"SELECT COUNT(*) FROM {table_name}", fetch='one')[0]
+    if total_solicitacoes == 0:
+        return dict(EMPTY_DASHBOARD)
+    data = {'total_solicitacoes': total_solicitacoes, 'tabela_vazia': False}
 
-        cursor.execute("SELECT Comprador, COUNT(*) as count FROM solicitacoes WHERE Comprador IN ('Miriam', 'Irineu') GROUP BY Comprador ORDER BY count DESC")
-        data['por_comprador'] = {row['Comprador']: row['count'] for row in cursor.fetchall()}
+    total_compras = timed_query(cursor, 'dashboard_total_compras', f"SELECT SUM(VlrTotal) FROM {table_name} WHERE Status = 'aprovado'", fetch='one')[0]
+    data['total_compras'] = total_compras if total_compras else 0
 
-        cursor.execute("SELECT Etapa, COUNT(*) as count FROM solicitacoes GROUP BY Etapa ORDER BY Etapa")
-        data['por_etapa'] = {row['Etapa']: row['count'] for row in cursor.fetchall()}
+    rows = timed_query(cursor, 'dashboard_por_comprador', f"SELECT Comprador, COUNT(*) as count FROM {table_name} WHERE Comprador IN ('Miriam', 'Irineu') GROUP BY Comprador ORDER BY count DESC")
+    data['por_comprador'] = {row['Comprador']: row['count'] for row in rows}
 
-        cursor.execute("SELECT Solicitacao, Etapa, Comprador, DiasAtrSol FROM solicitacoes WHERE Etapa IN ('02_COTAR', '05_COTADA') ORDER BY DiasAtrSol DESC")
-        data['atrasadas_cotacao'] = [dict(row) for row in cursor.fetchall()]
+    # Etapa vazia vira 'Sem etapa': chaves None não sobrevivem à serialização JSON do payload
+    rows = timed_query(cursor, 'dashboard_por_etapa', f"SELECT COALESCE(Etapa, 'Sem etapa') as Etapa, COUNT(*) as count FROM {table_name} GROUP BY Etapa ORDER BY Etapa")
+    data['por_etapa'] = {row['Etapa']: row['count'] for row in rows}
 
-        cursor.execute("SELECT LeadTimeCompra, LeadTimeEntrega, AtrasoEntrega FROM solicitacoes")
-        all_indicators = cursor.fetchall()
+    # Só a contagem: a lista em si é paginada direto do SQL por get_late_quotation_page
+    data['atrasadas_cotacao_total'] = timed_query(
+        cursor, 'dashboard_atrasadas_cotacao_total',
+        f"SELECT COUNT(*) FROM {table_name} WHERE Etapa IN ({', '.join('?' * len(COTACAO_ETAPAS))})", COTACAO_ETAPAS, fetch='one')[0]
 
-        lt_compra_days = [int(i['LeadTimeCompra']) for i in all_indicators if i['LeadTimeCompra'] and i['LeadTimeCompra'].isdigit()]
-        lt_entrega_days = [i['LeadTimeEntrega'] for i in all_indicators if i['LeadTimeEntrega'] is not None]
-        atraso_entrega_days = [i['AtrasoEntrega'] for i in all_indicators if i['AtrasoEntrega'] is not None]
+    # AVG ignora NULL: contratos (LeadTimeCompra NULL) e datas ausentes ficam fora da média
+    lt_compra_avg, lt_entrega_avg, atraso_entrega_avg = timed_query(
+        cursor, 'dashboard_medias', f"SELECT AVG(LeadTimeCompra), AVG(LeadTimeEntrega), AVG(AtrasoEntrega) FROM {table_name}", fetch='one')
 
-        data['lead_time_compra_medio'] = round(np.mean(lt_compra_days), 2) if lt_compra_days else 'N/A'
-        data['lead_time_entrega_medio'] = round(np.mean(lt_entrega_days), 2) if lt_entrega_days else 'N/A'
-        data['atraso_entrega_medio'] = round(np.mean(atraso_entrega_days), 2) if atraso_entrega_days else 'N/A'
+    data['lead_time_compra_medio'] = round(lt_compra_avg, 2) if lt_compra_avg is not None else 'N/A'
+    data['lead_time_entrega_medio'] = round(lt_entrega_avg, 2) if lt_entrega_avg is not None else 'N/A'
+    data['atraso_entrega_medio'] = round(atraso_entrega_avg, 2) if atraso_entrega_avg is not None else 'N/A'
 
-        cursor.execute("SELECT Comprador, SUM(VlrTotal) as total FROM solicitacoes WHERE Status = 'aprovado' AND Comprador IN ('Miriam', 'Irineu') GROUP BY Comprador ORDER BY total DESC")
-        data['desempenho_comprador'] = {row['Comprador']: row['total'] if row['total'] else 0 for row in cursor.fetchall()}
+    rows = timed_query(cursor, 'dashboard_desempenho_comprador', f"SELECT Comprador, SUM(VlrTotal) as total FROM {table_name} WHERE Status = 'aprovado' AND Comprador IN ('Miriam', 'Irineu') GROUP BY Comprador ORDER BY total DESC")
+    data['desempenho_comprador'] = {row['Comprador']: row['total'] if row['total'] else 0 for row in rows}
+    return data
 
+def store_dashboard_data(cursor, data, file_name=None, content_hash=None):
+    # Registra uma nova versão do conjunto de dados com o resumo do dashboard e descarta os resumos antigos.
+    # Deve rodar na mesma transação que publica os dados, para versão e resumo nunca divergirem.
+    cursor.execute(
+        "INSERT INTO dataset_versoes (arquivo, linhas, carregado_em, hash_conteudo) VALUES (?, ?, ?, ?)",
+        (file_name, data['total_solicitacoes'], datetime.now().isoformat(timespec='seconds'), content_hash)
+    )
+    version = cursor.lastrowid
+    cursor.execute("INSERT INTO dashboard_resumo (versao, payload) VALUES (?, ?)", (version, json.dumps(data, ensure_ascii=False)))
+    cursor.execute("DELETE FROM dashboard_resumo WHERE versao < ?", (version,))
+    return version
+
+def get_dashboard_data(state=None):
+    state = state or get_dataset_state()
+    if not state:
+        return {'tabela_vazia': True}
+    dataset = get_columnar_dataset(state) if COLUMNAR_ENGINE else None
+    if dataset is not None:
+        return dataset.dashboard_data()
+    conn = get_read_db()
+    if not conn:
+        return {'error': 'Falha ao conectar ao banco de dados.'}
+    try:
+        # Busca pela chave primária da versão publicada
+        row = timed_query(conn, 'dashboard_resumo', "SELECT payload FROM dashboard_resumo WHERE versao = ?", (state['versao'],), fetch='one')
+        if not row:
+            logger.warning("Nenhum resumo de dashboard encontrado (base ainda não carregada).")
+            # Retorna um dicionário indicando que a tabela está vazia/não existe
+            return {'tabela_vazia': True}
+        data = json.loads(row['payload'])
+        # Resumos gravados antes da paginação traziam a lista inteira; ela é substituída pela contagem
+        if 'atrasadas_cotacao' in data:
+            data['atrasadas_cotacao_total'] = len(data.pop('atrasadas_cotacao'))
+        return data
     except sqlite3.Error as e:
         logger.error(f"Erro ao buscar dados do dashboard: {e}")
         return {'error': f'Erro ao buscar dados: {e}'}
-    finally:
-        if conn:
-            conn.close()
+
+# --- Tendências entre Versões ---
+# Cada carga publica uma versão em dataset_versoes (que nunca é apagada) e, na mesma transação, os agregados
+# dela em tendencia_rollup: geral, por Comprador e por Etapa, com quantidade e soma de LeadTimeCompra,
+# LeadTimeEntrega e AtrasoEntrega (média = soma / quantidade). As consultas de tendência leem só essas poucas
+# linhas por versão, nunca 'solicitacoes' nem os snapshots.
+TREND_METRICS = {'lead_time_compra': 'LeadTimeCompra', 'lead_time_entrega': 'LeadTimeEntrega', 'atraso_entrega': 'AtrasoEntrega'}
+TREND_COLUMNS = (['solicitacoes'] + [f'{metric}_{part}' for metric in TREND_METRICS for part in ('qtd', 'soma')]
+                 + ['entregas_atrasadas'])
+TREND_DIMENSIONS = ('geral', 'comprador', 'etapa')
+TREND_DEFAULT_VERSIONS = 12
+TREND_MAX_VERSIONS = 120
+
+def compute_trend_rollups(cursor, table_name='solicitacoes'):
+    # Uma passada só (GROUP BY Comprador, Etapa), somada em Python nas três dimensões: contagens e somas são aditivas.
+    # Retorna [(dimensao, valor, *TREND_COLUMNS)]; vazio se a tabela não tem linhas.
+    aggregates = ', '.join(f"COUNT({col}), COALESCE(SUM({col}), 0)" for col in TREND_METRICS.values())
+    rows = timed_query(cursor, 'tendencia_agregados', f"""
+        SELECT COALESCE(Comprador, ''), COALESCE(Etapa, 'Sem etapa'), COUNT(*), {aggregates}, COALESCE(SUM(AtrasoEntrega > 0), 0)
+        FROM {table_name} GROUP BY Comprador, Etapa""")
+    totals = {}
+    for comprador, etapa, *values in rows:
+        for key in (('geral', ''), ('comprador', comprador), ('etapa', etapa)):
+            current = totals.get(key)
+            totals[key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+    return [(dimension, value, *values) for (dimension, value), values in sorted(totals.items())]
+
+def store_trend_rollups(cursor, version, rollups):
+    # Na transação que publica a versão, logo após store_dashboard_data
+    columns = ['versao', 'dimensao', 'valor'] + TREND_COLUMNS
+    cursor.executemany(f"INSERT OR REPLACE INTO tendencia_rollup ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                       [(version, *rollup) for rollup in rollups])
+
+def _trend_point(row):
+    point = {'versao': row['versao'], 'carregado_em': row['carregado_em'], 'arquivo': row['arquivo'], 'valor': row['valor'],
+             'solicitacoes': row['solicitacoes'], 'snapshot_disponivel': bool(row['hash_conteudo']) and os.path.exists(snapshot_path(row['hash_conteudo']))}
+    for metric in TREND_METRICS:
+        count = row[f'{metric}_qtd']
+        point[f'{metric}_medio'] = round(row[f'{metric}_soma'] / count, 2) if count else None
+        point[f'{metric}_qtd'] = count
+    point['entregas_atrasadas'] = row['entregas_atrasadas']
+    count = row['atraso_entrega_qtd']
+    point['percentual_entregas_atrasadas'] = round(100 * row['entregas_atrasadas'] / count, 1) if count else None
+    return point
+
+def get_trend(cursor, dimension='geral', value=None, versions=TREND_DEFAULT_VERSIONS):
+    # Pontos das últimas 'versions' cargas, da mais antiga para a mais recente; value=None traz todos os
+    # valores da dimensão (ex.: todos os compradores) em cada versão
+    sql = f"""
+        SELECT r.versao, v.carregado_em, v.arquivo, v.hash_conteudo, r.valor, {', '.join(f'r.{col}' for col in TREND_COLUMNS)}
+        FROM tendencia_rollup r JOIN dataset_versoes v ON v.versao = r.versao
+        WHERE r.dimensao = ? AND r.versao IN (
+            SELECT versao FROM tendencia_rollup WHERE dimensao = 'geral' AND valor = '' ORDER BY versao DESC LIMIT ?)"""
+    args = [dimension, versions]
+    if value is not None:
+        sql += " AND r.valor = ?"
+        args.append(value)
+    sql += " ORDER BY r.versao, r.valor"
+    return [_trend_point(row) for row in timed_query(cursor, 'tendencia_serie', sql, args)]
+
+# --- API JSON do Dashboard ---
+# O /admin entrega só a página; os indicadores vêm de /admin/api/dashboard e a lista de atrasadas em cotação,
+# uma página por vez, de /admin/api/dashboard/atrasadas. As respostas dependem apenas da versão publicada (e da
+# página pedida), então o ETag sai do estado em memória: uma revalidação sem mudança (304) não lê o resumo nem
+# serializa nada. O resumo decodificado fica guardado por versão em cada processo.
+_dashboard_cache = {'entry': None}
+
+def get_cached_dashboard_data(state):
+    entry = _dashboard_cache['entry']
+    if entry is not None and entry[0] == state['versao']:
+        return entry[1]
+    data = get_dashboard_data(state)
+    if 'error' not in data:
+        _dashboard_cache['entry'] = (state['versao'], data)
     return data
 
+def dashboard_etag(state, *parts):
+    # carregado_em entra junto com a versão: um banco recriado recomeça a numeração das versões
+    key = ':'.join(str(part) for part in (state['versao'], state['carregado_em'], *parts))
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+def late_quotation_page(items, total, page, page_size):
+    return {
+        'itens': items,
+        'pagina': page,
+        'tamanho': page_size,
+        'total': total,
+        'paginas': max(1, -(-total // page_size)),
+    }
+
+def _dashboard_response(etag, build):
+    # build() devolve (payload, status); só é chamado quando o ETag do cliente não vale mais
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        payload, status = build()
+        response = jsonify(payload)
+        if status != 200:
+            response.status_code = status
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+    response.set_etag(etag)
+    # O navegador pode guardar a resposta, mas sempre revalida: sem mudança de versão a volta é um 304 vazio
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _empty_dashboard_response():
+    response = jsonify({'tabela_vazia': True})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/admin/api/dashboard')
+def dashboard_api():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autenticado.'}), 401
+    state = get_dataset_state()
+    if state is None:
+        return _empty_dashboard_response()
+
+    def build():
+        data = get_cached_dashboard_data(state)
+        if 'error' in data:
+            return data, 500
+        return dict(data, versao=state['versao'], carregado_em=state['carregado_em']), 200
+    return _dashboard_response(dashboard_etag(state), build)
+
+@app.route('/admin/api/dashboard/atrasadas')
+def late_quotations_api():
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autenticado.'}), 401
+    page = max(request.args.get('pagina', 1, type=int), 1)
+    page_size = min(max(request.args.get('tamanho', DASHBOARD_PAGE_SIZE, type=int), 1), DASHBOARD_MAX_PAGE_SIZE)
+    state = get_dataset_state()
+    if state is None:
+        return _empty_dashboard_response()
+
+    def build():
+        data = get_cached_dashboard_data(state)
+        if 'error' in data:
+            return data, 500
+        items = get_late_quotation_page(state, page, page_size)
+        if items is None:
+            return {'error': 'Falha ao buscar a lista de atrasadas em cotação.'}, 500
+        return late_quotation_page(items, data.get('atrasadas_cotacao_total', 0), page, page_size), 200
+    return _dashboard_response(dashboard_etag(state, 'atrasadas', page, page_size), build)
+
+@app.route('/admin/api/tendencias')
+def trend_api():
+    # ?dimensao=geral|comprador|etapa&valor=Miriam&versoes=12
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autenticado.'}), 401
+    dimension = request.args.get('dimensao', 'geral')
+    if dimension not in TREND_DIMENSIONS:
+        return jsonify({'error': f"Dimensão inválida. Use: {', '.join(TREND_DIMENSIONS)}."}), 400
+    value = request.args.get('valor') or ('' if dimension == 'geral' else None)
+    versions = min(max(request.args.get('versoes', TREND_DEFAULT_VERSIONS, type=int), 1), TREND_MAX_VERSIONS)
+    conn = get_read_db()
+    if not conn:
+        return jsonify({'error': 'Falha ao conectar ao banco de dados.'}), 500
+    try:
+        points = get_trend(conn.cursor(), dimension, value, versions)
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao consultar tendências: {e}")
+        return jsonify({'error': f'Erro ao buscar dados: {e}'}), 500
+    return jsonify({'dimensao': dimension, 'valor': value, 'pontos': points})
+
+# --- Exportação de Solicitações ---
+# Extratos filtrados da base publicada em CSV ou XLSX. As linhas saem de um cursor do SQLite em blocos de
+# EXPORT_BATCH_SIZE direto para a resposta, sem ORDER BY (ordenar obrigaria o SQLite a montar o resultado
+# inteiro antes da primeira linha): a memória do worker não cresce com o tamanho do extrato. O SELECT é uma
+# única leitura, então o arquivo inteiro vem da mesma versão mesmo que uma carga seja publicada no meio.
+# Colunas que a planilha do usuário não traz (sempre vazias) ficam de fora.
+EXPORT_COLUMNS = [col for col in INTERNAL_COLUMNS if col not in ('DtAbertura', 'PrecoUnitarioOrig', 'Moeda', 'DtEntregaAtual')]
+EXPORT_DATE_COLUMNS = ['DtAprovSol', 'DtAprovPedido', 'DtPedido', 'DtEntregaOrig', 'DtReceb']
+
+def _export_date_arg(args, name):
+    value = (args.get(name) or '').strip()
+    if not value:
+        return None
+    for date_format in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(value, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"Data inválida em '{name}': {value}. Use aaaa-mm-dd ou dd/mm/aaaa.")
+
+def _export_int_arg(args, name):
+    value = (args.get(name) or '').strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Valor inválido em '{name}': {value}. Use um número inteiro de dias.")
+
+def parse_export_filters(args):
+    # Parâmetros aceitos (todos opcionais, combinados com AND):
+    #   comprador, etapa, status (repetíveis: ?etapa=02_COTAR&etapa=05_COTADA), dias_min e dias_max (DiasAtrSol),
+    #   <coluna>_de e <coluna>_ate para as datas de EXPORT_DATE_COLUMNS (ex.: dtpedido_de=2024-01-01).
+    # Retorna (cláusula WHERE, parâmetros, mensagem de erro ou None).
+    clauses, params = [], []
+    # Os valores seguem a mesma normalização da ingestão (Comprador em Title Case, Status em minúsculas)
+    for arg, col, normalize in (('comprador', 'Comprador', str.title), ('etapa', 'Etapa', str),
+                                ('status', 'Status', str.lower)):
+        values = [normalize(v.strip()) for v in args.getlist(arg) if v.strip()]
+        if values:
+            clauses.append(f"{col} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    try:
+        for arg, operator in (('dias_min', '>='), ('dias_max', '<=')):
+            value = _export_int_arg(args, arg)
+            if value is not None:
+                clauses.append(f"DiasAtrSol {operator} ?")
+                params.append(value)
+        for col in EXPORT_DATE_COLUMNS:
+            for suffix, operator in (('_de', '>='), ('_ate', '<=')):
+                value = _export_date_arg(args, col.lower() + suffix)
+                if value is not None:
+                    clauses.append(f"{col} {operator} ?")
+                    params.append(value)
+    except ValueError as e:
+        return None, None, str(e)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params, None
+
+def _export_batches(cursor, sql, params, stats):
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            return
+        stats['linhas'] += len(rows)
+        yield rows
+
+def _write_export_csv(batches):
+    # Separador ';' e BOM: é o que o Excel em português abre direto, com acentos corretos
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def _write_export_xlsx(batches):
+    # O .xlsx é um zip e só fica pronto no save: o openpyxl em modo write-only grava as linhas num arquivo
+    # temporário (memória constante) e o arquivo final é enviado em pedaços e apagado em seguida.
+    # Gerar o .xlsx é bem mais lento que o CSV (alguns milhares de linhas/s sem o lxml): para extratos grandes, CSV.
+    from openpyxl import Workbook
+    date_indexes = [EXPORT_COLUMNS.index(col) for col in EXPORT_DATE_COLUMNS]
+    fd, path = tempfile.mkstemp(prefix='zar_exportacao_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Solicitacoes')
+        sheet.append(EXPORT_COLUMNS)
+        for rows in batches:
+            for row in rows:
+                values = list(row)
+                for index in date_indexes: # Datas como data do Excel, não como texto
+                    if values[index]:
+                        values[index] = date.fromisoformat(values[index])
+                sheet.append(values)
+        workbook.save(path)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(EXPORT_FILE_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+    finally:
+        os.remove(path)
+
+EXPORT_FORMATS = {
+    'csv': (_write_export_csv, 'text/csv'),
+    'xlsx': (_write_export_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+def _stream_export(cursor, export_format, sql, params):
+    writer = EXPORT_FORMATS[export_format][0]
+    stats = {'linhas': 0}
+    start = time.perf_counter()
+    try:
+        yield from writer(_export_batches(cursor, sql, params, stats))
+    except (sqlite3.Error, OSError) as e:
+        # Os cabeçalhos já foram enviados: resta interromper a resposta, e o download chega incompleto
+        logger.error(f"Erro durante a exportação ({export_format}) após {stats['linhas']} linhas: {e}")
+        raise
+    finally:
+        cursor.close()
+        elapsed = time.perf_counter() - start
+        record_query(f'exportacao_{export_format}', sql, elapsed, stats['linhas'])
+        logger.info(f"Exportação {export_format}: {stats['linhas']} linhas em {elapsed:.1f} s.")
+
+@app.route('/admin/exportar')
+def export_solicitations():
+    # ?formato=csv|xlsx mais os filtros de parse_export_filters
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autenticado.'}), 401
+    export_format = request.args.get('formato', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Formato inválido. Use: {', '.join(EXPORT_FORMATS)}."}), 400
+    where, params, error = parse_export_filters(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    state = get_dataset_state()
+    if state is None:
+        return jsonify({'error': 'Nenhuma base publicada para exportar.'}), 404
+    conn = get_read_db()
+    if not conn:
+        return jsonify({'error': 'Falha ao conectar ao banco de dados.'}), 500
+
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM solicitacoes{where}"
+    logger.info(f"Exportação {export_format} iniciada: {dict(request.args.lists())}")
+    response = Response(stream_with_context(_stream_export(conn.cursor(), export_format, sql, params)),
+                        mimetype=EXPORT_FORMATS[export_format][1])
+    file_name = f"solicitacoes_v{state['versao']}_{datetime.now().strftime('%Y%m%d_%H%M')}.{export_format}"
+    response.headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # --- Rota Principal (Chatbot) ---
 @app.route('/')
 def index():
@@ -438,22 +2612,25 @@ def admin_dashboard():
         if 'file' not in request.files:
             flash('Nenhum arquivo selecionado', 'warning')
             return redirect(request.url)
-        file = request.files['file']
-        if file.filename == '':
+        # Várias pastas de trabalho (e todas as planilhas de cada uma) formam uma única carga
+        files = [file for file in request.files.getlist('file') if file.filename != '']
+        if not files:
             flash('Nenhum arquivo selecionado', 'warning')
             return redirect(request.url)
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if all(allowed_file(file.filename) for file in files):
+            filename = ', '.join(secure_filename(file.filename) for file in files)
             try:
-                file.save(filepath)
-                flash(f'Arquivo {filename} enviado com sucesso!', 'info')
-                # init_db() # Chamado no início da função process_and_load_excel
-                success, message = process_and_load_excel(filepath)
-                if success:
-                    flash(f'Arquivo processado: {message}', 'success')
-                else:
-                    flash(f'Erro ao processar arquivo: {message}', 'danger')
+                uploads = [(*save_upload(file), secure_filename(file.filename)) for file in files]
+                # O processamento roda em segundo plano; a resposta volta na hora com o id do job
+                job_id = start_ingestion_job([(path, name, content_hash) for path, content_hash, name in uploads],
+                                             incremental=request.form.get('incremental') == '1')
+                if not job_id:
+                    flash('Erro ao registrar o processamento do arquivo.', 'danger')
+                    return redirect(url_for('admin_dashboard'))
+                if request.accept_mimetypes.best == 'application/json':
+                    return jsonify({'job_id': job_id, 'status_url': url_for('ingestion_job_status', job_id=job_id)}), 202
+                session['ultimo_job_id'] = job_id
+                flash(f'Arquivo {filename} enviado com sucesso! Processamento em andamento (job {job_id}).', 'info')
             except Exception as e:
                 logger.exception(f"Erro ao salvar/processar upload: {e}")
                 flash(f'Erro crítico ao salvar ou processar o arquivo: {e}', 'danger')
@@ -462,98 +2639,619 @@ def admin_dashboard():
             flash('Tipo de arquivo não permitido. Use .xlsx', 'danger')
             return redirect(request.url)
 
-    # Método GET
-    init_db() # Garante que a tabela exista ao carregar o dashboard
-    dashboard_data = get_dashboard_data()
+    # Método GET (o esquema já foi garantido pelo _prepare_process da primeira requisição)
+    job_id = session.get('ultimo_job_id')
+    relatorio = None
+    if job_id:
+        job = get_ingestion_job(job_id)
+        if not job or job['estagio'] in JOB_FINAL_STAGES:
+            session.pop('ultimo_job_id', None)
+            job_id = None
+            if job and job['estagio'] == 'concluido':
+                flash(f'Arquivo processado: {job["mensagem"]}', 'success')
+            elif job:
+                flash(f'Erro ao processar arquivo: {job["mensagem"]}', 'danger')
+            if job:
+                relatorio = job['relatorio']
+    # Os indicadores são buscados pela página em /admin/api/dashboard
     admin_template = 'admin_chart_enhanced.html' if os.path.exists(os.path.join(app.template_folder, 'admin_chart_enhanced.html')) else 'admin.html'
-    logger.info(f"Renderizando template: {admin_template} com dados: {dashboard_data.keys()}")
-    return render_template(admin_template, data=dashboard_data)
+    logger.debug(f"Renderizando template: {admin_template}")
+    return render_template(admin_template, job_id=job_id, relatorio=relatorio,
+                           compradores=COMPRADORES + ['Outro'])
+
+@app.route('/admin/jobs/<job_id>')
+def ingestion_job_status(job_id):
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Não autenticado.'}), 401
+    job = get_ingestion_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado.'}), 404
+    return jsonify(job)
+
+# --- Roteamento de Intenções do Chatbot ---
+# Tabela que tira acentos e troca caractere por caractere (mesmo comprimento): os trechos capturados na
+# mensagem normalizada valem na mensagem original, e os parâmetros saem com a grafia que o usuário digitou.
+_ACCENT_TABLE = {}
+for _code in range(0x80, 0x250):
+    _stripped = ''.join(ch for ch in unicodedata.normalize('NFKD', chr(_code)) if not unicodedata.combining(ch))
+    if len(_stripped) == 1 and _stripped != chr(_code):
+        _ACCENT_TABLE[_code] = _stripped
+
+def normalize_message(text):
+    return text.lower().translate(_ACCENT_TABLE)
+
+Intent = namedtuple('Intent', 'name pattern extract handler')
+
+class IntentRouter:
+    # Cada intenção declara um padrão (escrito para o texto normalizado: minúsculo, sem acentos), uma função
+    # que converte os grupos capturados em parâmetros e o handler. Todos os padrões são compilados numa única
+    # alternância com grupos nomeados, então a mensagem é percorrida uma vez só. Entre intenções que casam na
+    # mesma posição vale a ordem de registro.
+    def __init__(self):
+        self.intents = []
+        self.stream_handlers = {}
+        self.columnar_handlers = {}
+        self._compiled = None
+        self._group_slices = {}
+
+    def intent(self, name, pattern, extract=None):
+        def decorator(handler):
+            self.intents.append(Intent(name, pattern, extract or (lambda groups: {}), handler))
+            self._compiled = None
+            return handler
+        return decorator
+
+    def streaming(self, name):
+        # Variante em blocos de uma intenção já registrada, usada por /api/chat/stream
+        def decorator(handler):
+            self.stream_handlers[name] = handler
+            return handler
+        return decorator
+
+    def columnar(self, name):
+        # Variante de uma intenção respondida pelo motor colunar em memória (recebe o ColumnarDataset)
+        def decorator(handler):
+            self.columnar_handlers[name] = handler
+            return handler
+        return decorator
+
+    def get(self, name):
+        return next((intent for intent in self.intents if intent.name == name), None)
+
+    def compile(self):
+        parts = []
+        group_slices = {}
+        next_group = 1
+        for index, intent in enumerate(self.intents):
+            inner_groups = re.compile(intent.pattern).groups
+            group_slices[f'i{index}'] = (intent, next_group + 1, next_group + 1 + inner_groups)
+            parts.append(f'(?P<i{index}>{intent.pattern})')
+            next_group += 1 + inner_groups
+        self._compiled = re.compile('|'.join(parts))
+        self._group_slices = group_slices
+        return self._compiled
+
+    def route(self, message):
+        # Retorna (intent, parâmetros) ou (None, {}) quando nada casa
+        compiled = self._compiled or self.compile()
+        normalized = normalize_message(message)
+        match = compiled.search(normalized)
+        if not match:
+            return None, {}
+        intent, first, last = self._group_slices[match.lastgroup]
+        source = message if len(message) == len(normalized) else normalized
+        groups = [source[match.start(g):match.end(g)] if match.start(g) >= 0 else None for g in range(first, last)]
+        return intent, intent.extract(groups)
+
+chat_router = IntentRouter()
+
+CHAT_HELP_REPLY = ("Olá! 😊 Não entendi bem sua pergunta. Que tal tentar algo como:\n"
+                   "- `status da solicitação 12345`\n"
+                   "- `quantas solicitações estão pendentes?`\n"
+                   "- `listar pedidos com mais de 7 dias de atraso`\n"
+                   "- `pedidos do fornecedor Acme` ou `buscar parafuso sextavado`\n"
+                   "- `evolução do lead time` ou `evolução do comprador Miriam`\n\n"
+                   "Se precisar de algo diferente, por favor, fale com os super compradores Miriam ou Irineu! Eles podem ajudar.")
+
+# 1. Verificar status da solicitação X
+@chat_router.intent('status_solicitacao',
+                    r'(?:status|estado)\s+(?:da\s+)?(?:solicitacao|pedido)\s+(\w+)',
+                    lambda groups: {'solicitacao_id': groups[0]})
+def intent_status_solicitacao(cursor, solicitacao_id):
+    logger.info(f"Buscando status da solicitação: {solicitacao_id}")
+    result = timed_query(cursor, 'chat_status_solicitacao', "SELECT Status, Etapa, Comprador FROM solicitacoes WHERE Solicitacao = ?", (solicitacao_id,), fetch='one')
+    return _status_reply(solicitacao_id, result)
+
+def _status_reply(solicitacao_id, result):
+    if result:
+        return f"Olá! A solicitação {solicitacao_id} está no status '{result['Status']}' e na etapa '{result['Etapa']}'. O comprador responsável é {result['Comprador']}."
+    return f"Olá! Não encontrei a solicitação {solicitacao_id}. Poderia verificar o número? Se precisar de ajuda, fale com Miriam ou Irineu."
+
+# 2. Quantas solicitações estão pendentes?
+CLOSED_STATUSES = ('aprovado', 'finalizado', 'cancelado', 'não aprovado')
+
+@chat_router.intent('pendentes', r'(?:quantas|numero de)\s+(?:solicitacoes|pedidos)\s+estao\s+pendentes')
+def intent_pendentes(cursor):
+    logger.info("Buscando número de solicitações pendentes")
+    sql = f"SELECT COUNT(*) FROM solicitacoes WHERE Status NOT IN ({', '.join('?' * len(CLOSED_STATUSES))})"
+    return _pendentes_reply(timed_query(cursor, 'chat_pendentes', sql, CLOSED_STATUSES, fetch='one')[0])
+
+def _pendentes_reply(count):
+    return f"Atualmente, há {count} solicitações consideradas pendentes (que não estão aprovadas, finalizadas ou canceladas)."
+
+# 3. Quais solicitações estão com mais de X dias de atraso?
+# Paginação por cursor (DiasAtrSol, id), servida pelo índice idx_solicitacoes_dias_atr_sol: cada página
+# continua depois da última linha mostrada, sem OFFSET.
+def _atraso_query(dias_atraso, apos=None, limit=None):
+    sql = "SELECT id, Solicitacao, Comprador, DiasAtrSol FROM solicitacoes WHERE DiasAtrSol > ?"
+    args = [dias_atraso]
+    if apos is not None:
+        sql += " AND (DiasAtrSol, id) < (?, ?)"
+        args.extend(apos)
+    sql += " ORDER BY DiasAtrSol DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        args.append(limit)
+    return sql, args
+
+def _atraso_line(row):
+    return f"- Solicitação {row['Solicitacao']} ({row['Comprador']}): {row['DiasAtrSol']} dias"
+
+def _atraso_header(cursor, dias_atraso, apos):
+    # Cabeçalho da lista, ou None quando não há nada acima de dias_atraso
+    if apos is not None:
+        return _atraso_header_text(dias_atraso, None)
+    total = timed_query(cursor, 'chat_atraso_total', "SELECT COUNT(*) FROM solicitacoes WHERE DiasAtrSol > ?", (dias_atraso,), fetch='one')[0]
+    return _atraso_header_text(dias_atraso, total)
+
+def _atraso_header_text(dias_atraso, total):
+    # total None: continuação de uma lista já iniciada
+    if total is None:
+        return f"Continuando a lista de solicitações com mais de {dias_atraso} dias de atraso:\n"
+    if not total:
+        return None
+    return f"Encontrei {total} solicitações com mais de {dias_atraso} dias de atraso (na coluna 'Dias Atr Sol'):\n"
+
+def _atraso_empty_reply(dias_atraso):
+    return f"Ótimo! Não há solicitações com mais de {dias_atraso} dias de atraso (na coluna 'Dias Atr Sol') no momento."
+
+@chat_router.intent('atraso',
+                    r'(?:quais|listar)\s+(?:solicitacoes|pedidos)\s+(?:com|com mais de|acima de)\s+(\d+)\s+dias\s+(?:de\s+)?(?:atraso|atrasadas)',
+                    lambda groups: {'dias_atraso': int(groups[0])})
+def intent_atraso(cursor, dias_atraso, apos=None):
+    logger.info(f"Buscando solicitações com mais de {dias_atraso} dias de atraso (DiasAtrSol)")
+    header = _atraso_header(cursor, dias_atraso, apos)
+    if header is None:
+        return {'reply': _atraso_empty_reply(dias_atraso), 'apos': None}
+    return _atraso_page_reply(header, timed_query(cursor, 'chat_atraso_pagina', *_atraso_query(dias_atraso, apos, CHAT_PAGE_SIZE + 1)))
+
+def _atraso_page_reply(header, results):
+    # results: até CHAT_PAGE_SIZE + 1 linhas; a excedente só indica que há próxima página
+    page = results[:CHAT_PAGE_SIZE]
+    if not page:
+        return {'reply': "Não há mais solicitações nessa lista.", 'apos': None}
+    reply = header + "\n".join(_atraso_line(r) for r in page)
+    if len(results) > CHAT_PAGE_SIZE:
+        reply += "\n\nDigite 'mostrar mais' para ver as próximas."
+        return {'reply': reply, 'apos': (page[-1]['DiasAtrSol'], page[-1]['id'])}
+    return {'reply': reply, 'apos': None}
+
+@chat_router.streaming('atraso')
+def stream_atraso(cursor, dias_atraso, apos=None):
+    header = _atraso_header(cursor, dias_atraso, apos)
+    if header is None:
+        yield {'tipo': 'resposta', 'reply': _atraso_empty_reply(dias_atraso)}
+        return
+    yield {'tipo': 'inicio', 'reply': header}
+    sql, args = _atraso_query(dias_atraso, apos)
+    # Mede só o tempo no SQLite, não a espera pelo cliente entre um bloco e outro
+    start = time.perf_counter()
+    cursor.execute(sql, args)
+    elapsed = 0.0
+    sent = 0
+    while True:
+        rows = cursor.fetchmany(CHAT_STREAM_BATCH_SIZE)
+        elapsed += time.perf_counter() - start
+        if not rows:
+            break
+        sent += len(rows)
+        yield {'tipo': 'linhas', 'linhas': [_atraso_line(r) for r in rows]}
+        start = time.perf_counter()
+    record_query('chat_atraso_stream', sql, elapsed, sent)
+    yield {'tipo': 'fim', 'total': sent}
+
+# 4. Continuar a última lista paginada
+@chat_router.intent('mostrar_mais', r'\b(?:(?:mostrar|mostre|ver|veja)\s+mais|mais\s+resultados)\b')
+def intent_mostrar_mais(cursor):
+    # Só responde quando não há lista em andamento; com cursor, chat_api retoma a intenção original
+    return "Não há uma lista em andamento para continuar. Pergunte, por exemplo: `listar pedidos com mais de 7 dias de atraso`."
+
+# 5-7. Buscas por produto, fornecedor, solicitação ou pedido no índice FTS5
+# O bm25 do FTS5 percorre a lista inteira de ocorrências de cada termo (mais de 100 ms para termos comuns com
+# 1M de linhas). A busca então pega as CHAT_SEARCH_CANDIDATES ocorrências mais recentes, que o índice entrega
+# em ordem de rowid sem ordenar nada, e só essas são ordenadas por relevância aqui.
+SEARCH_STOPWORDS = {'a', 'o', 'as', 'os', 'de', 'da', 'do', 'das', 'dos', 'e', 'em', 'no', 'na', 'nos', 'nas', 'para', 'por', 'com'}
+SEARCH_COLUMN_WEIGHTS = {'Solicitacao': 4, 'Pedido': 4, 'Produto': 2, 'Fornecedor': 1}
+
+def _search_words(text):
+    return re.findall(r'\w+', normalize_message(text))
+
+def _term_variants(term):
+    # O unicode61 não faz stemming: singular e plural simples entram como alternativas ('parafusos' acha 'parafuso')
+    if term.isdigit() or len(term) < 4:
+        return (term,)
+    for plural, singular in (('oes', 'ao'), ('ais', 'al')):
+        if term.endswith(plural):
+            return (term, term[:-len(plural)] + singular)
+        if term.endswith(singular):
+            return (term, term[:-len(singular)] + plural)
+    return (term, term[:-1]) if term.endswith('s') else (term, term + 's')
+
+def _search_match_expression(terms, columns):
+    expression = ' AND '.join('(' + ' OR '.join(f'"{variant}"' for variant in variants) + ')' for variants in terms)
+    return expression if columns == SEARCH_COLUMNS else f"{{{' '.join(columns)}}} : ({expression})"
+
+@lru_cache(maxsize=65536)
+def _field_words(value):
+    # Produtos e fornecedores se repetem muito entre as linhas: cada texto é quebrado em palavras uma vez só
+    return frozenset(_search_words(str(value or '')))
+
+def _search_score(row, terms, columns):
+    # Termos encontrados como palavra inteira, pesados pela coluna; campos curtos (mais específicos) valem mais
+    score = 0.0
+    for col in columns:
+        words = _field_words(row[col])
+        hits = sum(1 for variants in terms if not words.isdisjoint(variants))
+        score += SEARCH_COLUMN_WEIGHTS[col] * hits / len(words) ** 0.5 if hits else 0
+    return score
+
+def _search_line(row):
+    pedido = f" / Pedido {row['Pedido']}" if row['Pedido'] else ''
+    return f"- Solicitação {row['Solicitacao']}{pedido}: {row['Produto']} — {row['Fornecedor']} (status '{row['Status']}', etapa '{row['Etapa']}')"
+
+def search_solicitacoes(cursor, termo, columns=SEARCH_COLUMNS):
+    # Resposta da busca de 'termo' nas colunas indicadas, com até CHAT_SEARCH_LIMIT linhas mais relevantes
+    logger.info(f"Buscando '{termo}' em {', '.join(columns)}")
+    terms = [_term_variants(word) for word in _search_words(termo) if word not in SEARCH_STOPWORDS][:8]
+    if not terms:
+        return "Diga o que procurar, por exemplo: `buscar parafuso sextavado` ou `pedidos do fornecedor Acme`."
+    candidates = timed_query(cursor, 'chat_busca', f"""
+        SELECT s.id, s.Solicitacao, s.Pedido, s.Produto, s.Fornecedor, s.Status, s.Etapa
+        FROM {SEARCH_INDEX_TABLE} b JOIN solicitacoes s ON s.id = b.rowid
+        WHERE {SEARCH_INDEX_TABLE} MATCH ? ORDER BY b.rowid DESC LIMIT ?
+    """, (_search_match_expression(terms, columns), CHAT_SEARCH_CANDIDATES))
+    if not candidates:
+        return f"Não encontrei nada para '{termo}'. Confira a grafia ou tente outras palavras."
+    ranked = sorted(candidates, key=lambda row: _search_score(row, terms, columns), reverse=True)[:CHAT_SEARCH_LIMIT]
+    reply = f"Encontrei estes resultados para '{termo}':\n" + "\n".join(_search_line(row) for row in ranked)
+    if len(candidates) == CHAT_SEARCH_CANDIDATES:
+        reply += f"\n\nHá muitas ocorrências: mostrei as mais relevantes entre as {CHAT_SEARCH_CANDIDATES} mais recentes. Use mais palavras para refinar."
+    elif len(candidates) > CHAT_SEARCH_LIMIT:
+        reply += f"\n\nMostrando {CHAT_SEARCH_LIMIT} de {len(candidates)} resultados. Use mais palavras para refinar."
+    return reply
+
+def _search_extract(groups):
+    return {'termo': groups[0].strip(' ?!.')}
+
+@chat_router.intent('busca_fornecedor', r'(?:pedidos|solicitacoes|compras)\s+(?:do|da|de)\s+fornecedor\s+(.+)', _search_extract)
+def intent_busca_fornecedor(cursor, termo):
+    return search_solicitacoes(cursor, termo, ['Fornecedor'])
+
+@chat_router.intent('busca_produto',
+                    r'onde\s+(?:esta|estao)\s+(?:(?:a|as|o|os|minha|minhas|meu|meus)\s+)?(?:compras?|solicitac(?:ao|oes)|pedidos?)\s+(?:de|do|da|dos|das)\s+(.+)',
+                    _search_extract)
+def intent_busca_produto(cursor, termo):
+    return search_solicitacoes(cursor, termo, ['Produto'])
+
+@chat_router.intent('busca', r'\b(?:buscar|procurar|pesquisar)\s+(?:por\s+)?(.+)', _search_extract)
+def intent_busca(cursor, termo):
+    return search_solicitacoes(cursor, termo)
+
+# 8. Como o lead time e os atrasos evoluíram entre as cargas? (só lê tendencia_rollup)
+CHAT_TREND_VERSIONS = 6
+
+def _trend_extract(groups):
+    dimension = groups[0].lower() if groups[0] else 'geral'
+    if dimension == 'geral':
+        return {'dimensao': 'geral', 'valor': ''}
+    value = groups[1].strip(' ?!.')
+    return {'dimensao': dimension, 'valor': value.title() if dimension == 'comprador' else value.upper()}
+
+def _trend_number(value, unit=' dias'):
+    return 'n/d' if value is None else f"{value:.1f}{unit}"
+
+def _trend_line(point):
+    loaded = datetime.fromisoformat(point['carregado_em']).strftime('%d/%m/%Y %H:%M') if point['carregado_em'] else 'data desconhecida'
+    return (f"- {loaded} (versão {point['versao']}, {point['solicitacoes']} solicitações): "
+            f"lead time de compra {_trend_number(point['lead_time_compra_medio'])}, "
+            f"de entrega {_trend_number(point['lead_time_entrega_medio'])}, "
+            f"atraso médio na entrega {_trend_number(point['atraso_entrega_medio'])}, "
+            f"{point['entregas_atrasadas']} entregas atrasadas ({_trend_number(point['percentual_entregas_atrasadas'], '%')})")
+
+def _trend_change(label, previous, current, unit=' dias'):
+    if previous is None or current is None:
+        return None
+    return f"{label} {current - previous:+.1f}{unit}"
+
+@chat_router.intent('tendencia',
+                    r'\b(?:evolucao|tendencia|historico)\b(?:.*?\b(comprador|etapa)\s+(\S+))?',
+                    _trend_extract)
+def intent_tendencia(cursor, dimensao, valor):
+    points = get_trend(cursor, dimensao, valor, CHAT_TREND_VERSIONS)
+    subject = 'geral' if dimensao == 'geral' else f"{dimensao} {valor}"
+    if not points:
+        if dimensao == 'geral':
+            return "Ainda não há histórico de cargas para comparar. A evolução aparece a partir do próximo upload."
+        return f"Não encontrei histórico para {subject}. Confira o nome (ex.: `evolução do comprador Miriam` ou `evolução da etapa 02_COTAR`)."
+    reply = f"Evolução nas últimas {len(points)} cargas ({subject}):\n" + "\n".join(_trend_line(point) for point in points)
+    if len(points) > 1:
+        previous, current = points[-2], points[-1]
+        changes = [change for change in (
+            _trend_change('lead time de compra', previous['lead_time_compra_medio'], current['lead_time_compra_medio']),
+            _trend_change('lead time de entrega', previous['lead_time_entrega_medio'], current['lead_time_entrega_medio']),
+            _trend_change('atraso médio na entrega', previous['atraso_entrega_medio'], current['atraso_entrega_medio']),
+            _trend_change('entregas atrasadas', previous['percentual_entregas_atrasadas'], current['percentual_entregas_atrasadas'], ' pontos percentuais'),
+        ) if change]
+        if changes:
+            reply += "\n\nEm relação à carga anterior: " + "; ".join(changes) + "."
+    return reply
+
+# 1-3. Intenções do chat respondidas pelos arrays (mesmas respostas dos handlers SQL)
+@chat_router.columnar('status_solicitacao')
+def columnar_status_solicitacao(dataset, solicitacao_id):
+    return _status_reply(solicitacao_id, dataset.find_solicitacao(solicitacao_id))
+
+@chat_router.columnar('pendentes')
+def columnar_pendentes(dataset):
+    return _pendentes_reply(dataset.count_pending())
+
+@chat_router.columnar('atraso')
+def columnar_atraso(dataset, dias_atraso, apos=None):
+    start, end = dataset.atraso_range(dias_atraso, apos)
+    header = _atraso_header_text(dias_atraso, None if apos is not None else end)
+    if header is None:
+        return {'reply': _atraso_empty_reply(dias_atraso), 'apos': None}
+    return _atraso_page_reply(header, dataset.atraso_rows(start, min(end, start + CHAT_PAGE_SIZE + 1)))
+
+# --- Cursor de Paginação do Chatbot ---
+# Token opaco com a intenção, seus parâmetros, a última chave mostrada e a versão do conjunto de dados.
+# Vai na resposta JSON (campo 'cursor') e na sessão, para o "mostrar mais" digitado no chat.
+def encode_chat_cursor(state, intent, params, apos):
+    data = {'i': intent.name, 'p': params, 'a': list(apos), 'v': state['versao']}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+
+CHAT_CURSOR_SCALARS = (str, int, float, bool, type(None))
+
+def decode_chat_cursor(token):
+    # Retorna (intent, parâmetros, apos, versão) ou None. O token vem do cliente: só vale com intenção
+    # registrada, parâmetros texto -> escalar aceitos pelo handler e apos com as duas chaves numéricas
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+        name, params, apos, versao = data['i'], data['p'], data['a'], data['v']
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    intent = chat_router.get(name) if isinstance(name, str) else None
+    if intent is None or not isinstance(params, dict) or not isinstance(apos, list) or len(apos) != 2:
+        return None
+    if not all(isinstance(key, str) and isinstance(value, CHAT_CURSOR_SCALARS) for key, value in params.items()):
+        return None
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in apos):
+        return None
+    try:
+        inspect.signature(intent.handler).bind(None, **dict(params, apos=None))
+    except TypeError:
+        return None
+    return intent, params, tuple(apos), versao
+
+def resume_chat_cursor(token, state):
+    # Retorna (intent, parâmetros, erro); erro é a resposta a enviar quando o cursor não serve mais.
+    # Cursor inválido conta como ausente
+    decoded = decode_chat_cursor(token) if token else None
+    if decoded is None:
+        return None, {}, None
+    intent, params, apos, versao = decoded
+    if versao != state['versao']:
+        return None, {}, "A base de dados foi atualizada desde a última lista. Por favor, faça a pergunta novamente."
+    params = dict(params, apos=apos)
+    return intent, params, None
 
 # --- API para Chatbot ---
-@app.route('/api/chat', methods=['POST'])
-def chat_api():
-    user_message = request.json.get('message')
-    if not user_message:
-        return jsonify({'reply': 'Por favor, envie uma mensagem.'})
+CHAT_NDJSON_MIMETYPE = 'application/x-ndjson'
 
-    logger.info(f"Mensagem recebida do chatbot: {user_message}")
-    reply = "Desculpe, não consegui processar sua pergunta. Por favor, tente reformular ou entre em contato com os compradores Miriam ou Irineu."
-    conn = get_db()
+def _chat_context():
+    # Retorna (conn, state, erro); erro é ({'reply': ...}, status) quando o chat não pode consultar a base
+    conn = get_read_db()
     if not conn:
-         return jsonify({'reply': 'Erro interno ao conectar ao banco de dados. Tente novamente mais tarde.'}), 500
-
+        return None, None, ({'reply': 'Erro interno ao conectar ao banco de dados. Tente novamente mais tarde.'}, 500)
+
+    # Estado vem do registro do conjunto de dados, sem consultar sqlite_master nem contar a tabela
+    state = get_dataset_state()
+    if state is None:
+        logger.warning("Chatbot: Nenhum conjunto de dados publicado.")
+        return conn, None, ({'reply': 'A base de dados ainda não foi carregada. Peça ao administrador para fazer o upload da planilha.'}, 200)
+    if state['estado'] == 'vazio':
+        logger.info("Chatbot: Tabela 'solicitacoes' está vazia.")
+        return conn, state, ({'reply': 'A base de dados foi carregada, mas está vazia no momento. Peça ao administrador para fazer o upload da planilha com dados.'}, 200)
+    return conn, state, None
+
+def _route_chat_message(user_message, state):
+    # Retorna (intent, parâmetros, resposta pronta ou None); "mostrar mais" retoma a lista do cursor
+    intent, params = chat_router.route(user_message)
+    CHAT_INTENTS.inc(intent.name if intent is not None else 'nenhuma')
+    if intent is None:
+        return None, {}, CHAT_HELP_REPLY
+    if intent.name == 'mostrar_mais':
+        token = request.json.get('cursor') or session.get('chat_cursor')
+        resumed, resumed_params, error = resume_chat_cursor(token, state)
+        if error:
+            session.pop('chat_cursor', None)
+            return None, {}, error
+        if resumed is not None:
+            return resumed, resumed_params, None
+    return intent, params, None
+
+def answer_chat(conn, state, intent, params):
+    # Resposta da intenção como (payload, status), passando pelo cache de respostas
+    cache_key = chat_cache_key(state, intent, params)
+    payload = chat_answer_cache.get(cache_key) if cache_key is not None else None
+    if payload is not None:
+        return payload, 200
+
+    dataset = get_columnar_dataset(state) if COLUMNAR_ENGINE else None
+    columnar_handler = chat_router.columnar_handlers.get(intent.name)
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='solicitacoes'")
-        if not cursor.fetchone():
-             logger.warning("Chatbot: Tabela 'solicitacoes' não encontrada.")
-             return jsonify({'reply': 'A base de dados ainda não foi carregada. Peça ao administrador para fazer o upload da planilha.'})
-
-        # Verificar se a tabela está vazia
-        cursor.execute("SELECT COUNT(*) FROM solicitacoes")
-        if cursor.fetchone()[0] == 0:
-            logger.info("Chatbot: Tabela 'solicitacoes' está vazia.")
-            return jsonify({'reply': 'A base de dados foi carregada, mas está vazia no momento. Peça ao administrador para fazer o upload da planilha com dados.'})
-
-        # 1. Verificar status da solicitação X
-        match_status = re.search(r'(?:status|estado)\s+(?:da\s+)?(?:solicitação|solicitacao|pedido)\s+(\w+)', user_message, re.IGNORECASE)
-        if match_status:
-            solicitacao_id = match_status.group(1)
-            logger.info(f"Buscando status da solicitação: {solicitacao_id}")
-            cursor.execute("SELECT Status, Etapa, Comprador FROM solicitacoes WHERE Solicitacao = ?", (solicitacao_id,))
-            result = cursor.fetchone()
-            if result:
-                reply = f"Olá! A solicitação {solicitacao_id} está no status '{result['Status']}' e na etapa '{result['Etapa']}'. O comprador responsável é {result['Comprador']}."
-            else:
-                reply = f"Olá! Não encontrei a solicitação {solicitacao_id}. Poderia verificar o número? Se precisar de ajuda, fale com Miriam ou Irineu."
-
-        # 2. Quantas solicitações estão pendentes?
-        elif re.search(r'(?:quantas|numero de)\s+(?:solicitações|solicitacoes|pedidos)\s+(?:estão|estao)\s+pendentes', user_message, re.IGNORECASE):
-            logger.info("Buscando número de solicitações pendentes")
-            cursor.execute("SELECT COUNT(*) FROM solicitacoes WHERE Status NOT IN ('aprovado', 'finalizado', 'cancelado', 'não aprovado')")
-            count = cursor.fetchone()[0]
-            reply = f"Atualmente, há {count} solicitações consideradas pendentes (que não estão aprovadas, finalizadas ou canceladas)."
-
-        # 3. Quais solicitações estão com mais de X dias de atraso?
-        match_atraso = re.search(r'(?:quais|listar)\s+(?:solicitações|solicitacoes|pedidos)\s+(?:com|com mais de|acima de)\s+(\d+)\s+dias\s+(?:de\s+)?(?:atraso|atrasadas)', user_message, re.IGNORECASE)
-        if match_atraso:
-            dias_atraso = int(match_atraso.group(1))
-            logger.info(f"Buscando solicitações com mais de {dias_atraso} dias de atraso (DiasAtrSol)")
-            cursor.execute("SELECT Solicitacao, Comprador, DiasAtrSol FROM solicitacoes WHERE DiasAtrSol > ? ORDER BY DiasAtrSol DESC", (dias_atraso,))
-            results = cursor.fetchall()
-            if results:
-                reply = f"Encontrei {len(results)} solicitações com mais de {dias_atraso} dias de atraso (na coluna 'Dias Atr Sol'):\n"
-                reply += "\n".join([f"- Solicitação {r['Solicitacao']} ({r['Comprador']}): {r['DiasAtrSol']} dias" for r in results])
-            else:
-                reply = f"Ótimo! Não há solicitações com mais de {dias_atraso} dias de atraso (na coluna 'Dias Atr Sol') no momento."
-
+        if dataset is not None and columnar_handler is not None:
+            result = columnar_handler(dataset, **params)
         else:
-            reply = ("Olá! 😊 Não entendi bem sua pergunta. Que tal tentar algo como:\n" 
-                     "- `status da solicitação 12345`\n" 
-                     "- `quantas solicitações estão pendentes?`\n" 
-                     "- `listar pedidos com mais de 7 dias de atraso`\n\n" 
-                     "Se precisar de algo diferente, por favor, fale com os super compradores Miriam ou Irineu! Eles podem ajudar.")
-
+            result = intent.handler(cursor, **params)
     except sqlite3.Error as e:
         logger.error(f"Erro ao consultar o banco de dados para o chatbot: {e}")
         reply = "Tive um problema ao buscar as informações no banco de dados. Por favor, tente novamente ou contate Miriam ou Irineu."
-        return jsonify({'reply': reply}), 500
+        return {'reply': reply}, 500
     except Exception as e:
         logger.exception(f"Erro inesperado na API do chatbot: {e}")
         reply = "Ocorreu um erro inesperado ao processar sua solicitação. Por favor, contate Miriam ou Irineu."
-        return jsonify({'reply': reply}), 500
+        return {'reply': reply}, 500
     finally:
-        if conn:
-            conn.close()
+        cursor.close()
+
+    payload = result if isinstance(result, dict) else {'reply': result}
+    if cache_key is not None:
+        chat_answer_cache.set(cache_key, payload)
+    return payload, 200
 
-    return jsonify({'reply': reply})
+@app.route('/api/chat', methods=['POST'])
+def chat_api():
+    user_message = request.json.get('message')
+    if not user_message:
+        return jsonify({'reply': 'Por favor, envie uma mensagem.'})
 
+    logger.info(f"Mensagem recebida do chatbot: {user_message}")
+    conn, state, error = _chat_context()
+    if error:
+        return jsonify(error[0]), error[1]
+
+    intent, params, reply = _route_chat_message(user_message, state)
+    if reply is not None:
+        return jsonify({'reply': reply})
+
+    payload, status = answer_chat(conn, state, intent, params)
+    if status != 200 or 'apos' not in payload:
+        return jsonify({'reply': payload['reply']}), status
+
+    # Lista paginada: o cursor da próxima página vai na resposta e fica na sessão para o "mostrar mais"
+    base_params = {key: value for key, value in params.items() if key != 'apos'}
+    next_cursor = encode_chat_cursor(state, intent, base_params, payload['apos']) if payload['apos'] else None
+    if next_cursor:
+        session['chat_cursor'] = next_cursor
+    else:
+        session.pop('chat_cursor', None)
+    return jsonify({'reply': payload['reply'], 'cursor': next_cursor})
+
+def _ndjson(events):
+    for event in events:
+        yield json.dumps(event, ensure_ascii=False) + '\n'
+
+def _stream_chat_events(conn, stream_handler, params):
+    cursor = conn.cursor()
+    try:
+        yield from stream_handler(cursor, **params)
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao consultar o banco de dados para o chatbot (stream): {e}")
+        yield {'tipo': 'erro', 'reply': "Tive um problema ao buscar as informações no banco de dados. Por favor, tente novamente ou contate Miriam ou Irineu."}
+    finally:
+        cursor.close()
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_api():
+    # Mesmas perguntas de /api/chat, em NDJSON: listas saem em blocos ('inicio', 'linhas'..., 'fim') para o
+    # widget renderizar aos poucos; as demais respostas vêm numa única linha do tipo 'resposta'.
+    user_message = request.json.get('message')
+    if not user_message:
+        return Response(_ndjson([{'tipo': 'resposta', 'reply': 'Por favor, envie uma mensagem.'}]), mimetype=CHAT_NDJSON_MIMETYPE)
+
+    logger.info(f"Mensagem recebida do chatbot (stream): {user_message}")
+    conn, state, error = _chat_context()
+    if error:
+        return Response(_ndjson([dict(error[0], tipo='resposta')]), status=error[1], mimetype=CHAT_NDJSON_MIMETYPE)
+
+    intent, params, reply = _route_chat_message(user_message, state)
+    if reply is not None:
+        return Response(_ndjson([{'tipo': 'resposta', 'reply': reply}]), mimetype=CHAT_NDJSON_MIMETYPE)
+
+    stream_handler = chat_router.stream_handlers.get(intent.name)
+    if stream_handler is None:
+        payload, status = answer_chat(conn, state, intent, params)
+        return Response(_ndjson([{'tipo': 'resposta', 'reply': payload['reply']}]), status=status, mimetype=CHAT_NDJSON_MIMETYPE)
+    return Response(stream_with_context(_ndjson(_stream_chat_events(conn, stream_handler, params))),
+                    mimetype=CHAT_NDJSON_MIMETYPE)
+
+
+# --- Instrumentação das Requisições e /metrics ---
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _observe_request(response):
+    # Respostas em streaming são medidas até os cabeçalhos; o corpo ainda não foi gerado aqui
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'desconhecida' # Padrão da rota, não a URL (poucas séries)
+    REQUEST_SECONDS.observe(elapsed, route, request.method, response.status_code)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        logger.warning(f"Requisição lenta: {request.method} {request.path} -> {response.status_code} em {elapsed * 1000:.1f} ms")
+    return response
+
+def resident_memory_bytes():
+    # RSS atual (Linux: /proc/self/statm); fora do Linux, o pico informado por getrusage
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def _gauge(name, help_text, value, metric_type='gauge'):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+
+def metrics_authorized():
+    if session.get('logged_in'):
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode())
+
+@app.route('/metrics')
+def metrics():
+    if not metrics_authorized():
+        return Response('Não autorizado.\n', status=401, mimetype='text/plain', headers={'WWW-Authenticate': 'Bearer'})
+    cache = chat_answer_cache.stats()
+    state = get_dataset_state()
+    lines = (_gauge('zar_chat_cache_entries', 'Respostas guardadas no cache do chatbot.', cache['entradas'])
+             + _gauge('zar_chat_cache_hits_total', 'Acertos no cache de respostas do chatbot.', cache['acertos'], 'counter')
+             + _gauge('zar_chat_cache_misses_total', 'Falhas no cache de respostas do chatbot.', cache['falhas'], 'counter')
+             + _gauge('zar_dataset_version', 'Versão publicada do conjunto de dados (0 = nenhuma).', state['versao'] if state else 0)
+             + _gauge('zar_dataset_rows', 'Linhas da versão publicada.', state['linhas'] if state else 0)
+             + _gauge('zar_import_seconds', 'Tempo de importação do módulo neste processo.', f'{IMPORT_SECONDS:.6f}')
+             + _gauge('zar_process_resident_memory_bytes', 'Memória residente deste processo.', resident_memory_bytes())
+             + _gauge('zar_data_libraries_loaded', 'pandas/numpy já importados neste processo (1 = sim).',
+                      int('pandas' in sys.modules or 'numpy' in sys.modules)))
+    return Response(render_metrics(lines), mimetype='text/plain; version=0.0.4')
 
 # --- Inicialização ---
-# Garante que o DB e a tabela existam na inicialização
-# Executa isso antes de qualquer request para evitar erros no primeiro acesso
-with app.app_context():
-    init_db()
+# Importar o módulo não toca no banco: os processos do pool de ingestão (spawn) e os workers do gunicorn
+# sobem sem custo de E/S. O esquema é garantido uma vez por processo, antes da primeira requisição; se o
+# banco está vazio e há snapshot, a base é restaurada em segundo plano, na fila do job de ingestão.
+@app.before_request
+def _prepare_process():
+    if ensure_db():
+        INGESTION_EXECUTOR.submit(warm_from_snapshot)
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 if __name__ == '__main__':
     logger.info(f"Servidor Flask pronto para iniciar em host 0.0.0.0 porta 5000")
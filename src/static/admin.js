@@ -0,0 +1,230 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Acompanha o job de ingestão em segundo plano e recarrega o dashboard ao terminar
+    const jobProgress = document.getElementById('job-progress');
+    if (jobProgress) {
+        const stageLabels = {
+            na_fila: 'Na fila',
+            lendo: 'Lendo planilha',
+            carregando: 'Carregando registros',
+            resumindo: 'Calculando indicadores',
+            trocando: 'Publicando nova base',
+            aplicando: 'Aplicando alterações'
+        };
+        const pollJob = async function() {
+            try {
+                const response = await fetch(jobProgress.dataset.statusUrl, { headers: { 'Accept': 'application/json' } });
+                if (!response.ok) throw new Error('status ' + response.status);
+                const job = await response.json();
+                if (job.estagio === 'concluido' || job.estagio === 'erro') {
+                    window.location.reload();
+                    return;
+                }
+                document.getElementById('job-progress-text').textContent =
+                    (stageLabels[job.estagio] || job.estagio) + ': ' + job.linhas_processadas + ' linhas processadas, ' +
+                    job.linhas_descartadas + ' descartadas.';
+            } catch (e) {
+                console.error('Erro ao consultar o job de ingestão:', e);
+            }
+            setTimeout(pollJob, 2000);
+        };
+        pollJob();
+    }
+
+    // Dashboard: indicadores e lista de atrasadas vêm de duas APIs JSON, cada uma revalidada periodicamente
+    // com If-None-Match. Enquanto a versão da base não muda, o servidor responde 304 sem corpo e nada é redesenhado.
+    // A lista é buscada uma página por vez; a lista inteira nunca trafega.
+    const dashboard = document.getElementById('dashboard');
+    if (!dashboard) return;
+    const apiUrl = dashboard.dataset.apiUrl;
+    const lateUrl = dashboard.dataset.atrasadasUrl;
+    const refreshInterval = parseInt(dashboard.dataset.intervalo, 10) || 30000;
+    const chartColors = ['--chart-blue', '--chart-grey', '--chart-green', '--chart-purple', '--chart-orange'];
+    let currentPage = 1;
+    let totalPages = 1;
+    let etag = null;
+    let lateEtag = null;
+    let tableEmpty = true;
+
+    function formatMoney(value) {
+        return 'R$ ' + Number(value || 0).toFixed(2).replace('.', ',');
+    }
+
+    function formatDays(value) {
+        return (value === null || value === undefined ? 'N/A' : value) + ' dias';
+    }
+
+    function show(section) {
+        for (const id of ['dashboard-loading', 'dashboard-error', 'dashboard-empty', 'dashboard-content']) {
+            document.getElementById(id).hidden = id !== section;
+        }
+    }
+
+    // Gráfico de barras horizontais em HTML (substitui o Chart.js, que vinha de CDN)
+    function renderBarChart(container, counts) {
+        container.replaceChildren();
+        const entries = Object.entries(counts || {});
+        if (entries.length === 0) {
+            const empty = document.createElement('p');
+            empty.className = 'text-center text-muted mt-2';
+            empty.textContent = 'Sem dados para exibir o gráfico.';
+            container.appendChild(empty);
+            return;
+        }
+        const max = Math.max(...entries.map(([, count]) => count));
+        entries.forEach(([label, count], index) => {
+            const row = document.createElement('div');
+            row.className = 'bar-row';
+            const name = document.createElement('span');
+            name.className = 'bar-label';
+            name.textContent = label;
+            name.title = label;
+            const track = document.createElement('div');
+            track.className = 'bar-track';
+            const fill = document.createElement('div');
+            fill.className = 'bar-fill';
+            fill.style.width = (max ? (count / max) * 100 : 0) + '%';
+            fill.style.backgroundColor = 'var(' + chartColors[index % chartColors.length] + ')';
+            track.appendChild(fill);
+            const value = document.createElement('span');
+            value.className = 'bar-value';
+            value.textContent = count.toLocaleString('pt-BR');
+            row.append(name, track, value);
+            container.appendChild(row);
+        });
+    }
+
+    function statusDot(days) {
+        const dot = document.createElement('span');
+        if (days >= 7) {
+            dot.className = 'status-dot status-red';
+            dot.title = 'Crítico (>= 7 dias)';
+        } else if (days >= 3) {
+            dot.className = 'status-dot status-yellow';
+            dot.title = 'Atenção (3-6 dias)';
+        } else {
+            dot.className = 'status-dot status-blue';
+            dot.title = 'Normal (< 3 dias)';
+        }
+        return dot;
+    }
+
+    function renderLateTable(page) {
+        const body = document.getElementById('atrasadas-body');
+        body.replaceChildren();
+        if (page.itens.length === 0) {
+            const row = body.insertRow();
+            const cell = row.insertCell();
+            cell.colSpan = 5;
+            cell.className = 'text-center';
+            cell.textContent = 'Nenhuma solicitação atrasada nessas etapas ou sem dados carregados.';
+        }
+        for (const item of page.itens) {
+            const row = body.insertRow();
+            row.insertCell().appendChild(statusDot(item.DiasAtrSol));
+            for (const key of ['Solicitacao', 'Etapa', 'Comprador', 'DiasAtrSol']) {
+                row.insertCell().textContent = item[key] === null ? '' : item[key];
+            }
+        }
+        totalPages = page.paginas;
+        document.getElementById('atrasadas-pagina').textContent =
+            'Página ' + page.pagina + ' de ' + page.paginas + ' (' + page.total.toLocaleString('pt-BR') + ' solicitações)';
+        document.getElementById('atrasadas-anterior').disabled = page.pagina <= 1;
+        document.getElementById('atrasadas-proxima').disabled = page.pagina >= page.paginas;
+    }
+
+    function renderDashboard(data) {
+        tableEmpty = Boolean(data.tabela_vazia);
+        if (tableEmpty) {
+            show('dashboard-empty');
+            return;
+        }
+        const fields = {
+            total_solicitacoes: Number(data.total_solicitacoes).toLocaleString('pt-BR'),
+            total_compras: formatMoney(data.total_compras),
+            lead_time_compra_medio: formatDays(data.lead_time_compra_medio),
+            atraso_entrega_medio: formatDays(data.atraso_entrega_medio),
+            lead_time_entrega_medio: formatDays(data.lead_time_entrega_medio)
+        };
+        for (const element of dashboard.querySelectorAll('[data-campo]')) {
+            element.textContent = fields[element.dataset.campo];
+        }
+        renderBarChart(document.getElementById('compradorChart'), data.por_comprador);
+        renderBarChart(document.getElementById('etapaChart'), data.por_etapa);
+
+        const performance = document.getElementById('desempenho-comprador');
+        performance.replaceChildren();
+        const buyers = Object.entries(data.desempenho_comprador || {});
+        for (const [buyer, total] of buyers) {
+            const item = document.createElement('li');
+            item.textContent = buyer + ': ' + formatMoney(total);
+            performance.appendChild(item);
+        }
+        document.getElementById('desempenho-vazio').hidden = buyers.length > 0;
+        show('dashboard-content');
+    }
+
+    // GET com revalidação pelo ETag guardado: devolve o JSON novo, ou null quando nada mudou (304)
+    async function fetchJson(url, cachedEtag) {
+        const headers = { 'Accept': 'application/json' };
+        if (cachedEtag) headers['If-None-Match'] = cachedEtag;
+        // cache: 'no-store' deixa a revalidação por nossa conta
+        const response = await fetch(url, { headers: headers, cache: 'no-store' });
+        if (response.status === 304) return null;
+        if (response.status === 401) {
+            window.location.reload(); // Sessão expirada: o /admin redireciona para o login
+            return null;
+        }
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || 'status ' + response.status);
+        return { data: data, etag: response.headers.get('ETag') };
+    }
+
+    async function loadLatePage() {
+        try {
+            const result = await fetchJson(lateUrl + '?pagina=' + currentPage, lateEtag);
+            if (!result || result.data.tabela_vazia) return;
+            if (result.data.pagina > result.data.paginas) { // A nova versão da base tem menos páginas
+                currentPage = result.data.paginas;
+                lateEtag = null;
+                return loadLatePage();
+            }
+            lateEtag = result.etag;
+            renderLateTable(result.data);
+        } catch (e) {
+            console.error('Erro ao carregar a lista de atrasadas:', e);
+        }
+    }
+
+    async function loadDashboard() {
+        try {
+            const result = await fetchJson(apiUrl, etag);
+            if (result) {
+                etag = result.etag;
+                renderDashboard(result.data);
+            }
+        } catch (e) {
+            console.error('Erro ao carregar o dashboard:', e);
+            if (!etag) { // Já há dados na tela: mantém os últimos e tenta de novo no próximo ciclo
+                document.getElementById('dashboard-error-text').textContent = e.message;
+                show('dashboard-error');
+            }
+            return;
+        }
+        if (!tableEmpty) await loadLatePage();
+    }
+
+    function goToPage(page) {
+        if (page < 1 || page > totalPages) return;
+        currentPage = page;
+        lateEtag = null; // O ETag vale para uma página; outra página sempre busca o corpo
+        loadLatePage();
+    }
+
+    document.getElementById('atrasadas-anterior').addEventListener('click', () => goToPage(currentPage - 1));
+    document.getElementById('atrasadas-proxima').addEventListener('click', () => goToPage(currentPage + 1));
+
+    loadDashboard();
+    // Revalida só com a aba visível; ao voltar para a aba, revalida na hora
+    setInterval(() => { if (!document.hidden) loadDashboard(); }, refreshInterval);
+    document.addEventListener('visibilitychange', () => { if (!document.hidden) loadDashboard(); });
+});
@@ -23,39 +23,61 @@ document.addEventListener('DOMContentLoaded', function() {
         return messageDiv; // Return the element if needed (e.g., for removal)
     }
 
-    // Função para enviar mensagem para o backend
-    async function sendMessage(message) {
+    // Botão "Mostrar mais" da lista paginada: pede a próxima página com o cursor recebido
+    function addShowMoreButton(cursor) {
+        const button = document.createElement('button');
+        button.type = 'button';
+        button.classList.add('show-more-button');
+        button.textContent = 'Mostrar mais';
+        button.addEventListener('click', function() {
+            if (!userInput.disabled) {
+                processUserMessage('mostrar mais', cursor);
+            }
+        });
+        chatBox.appendChild(button);
+        chatBox.scrollTop = chatBox.scrollHeight;
+    }
+
+    // Função para enviar mensagem para o backend (/api/chat).
+    // Listas longas vêm paginadas: quando há mais linhas, a resposta traz um 'cursor', que o botão
+    // "Mostrar mais" envia de volta para buscar só a próxima página.
+    async function sendMessage(message, typingIndicatorElement, cursor = null) {
+        let reply;
+        let nextCursor = null;
         try {
+            const body = { message: message };
+            if (cursor) {
+                body.cursor = cursor;
+            }
             const response = await fetch('/api/chat', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ message: message }),
+                body: JSON.stringify(body),
             });
 
-            if (!response.ok) {
-                // Try to get error message from response body if available
-                let errorMsg = 'Erro na comunicação com o servidor.';
-                try {
-                    const errorData = await response.json();
-                    errorMsg = errorData.reply || errorMsg;
-                } catch (e) { /* Ignore if response is not JSON */ }
-                throw new Error(errorMsg);
+            // Erros do servidor também vêm em JSON com 'reply'
+            const data = await response.json().catch(() => null);
+            if (!data || !data.reply) {
+                throw new Error('Erro na comunicação com o servidor.');
             }
-
-            const data = await response.json();
-            return data.reply;
+            reply = data.reply;
+            nextCursor = data.cursor || null;
         } catch (error) {
             console.error('Erro:', error);
-            // Return the specific error message or a generic one
-            return error.message || 'Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente mais tarde ou entre em contato com Miriam ou Irineu.';
+            reply = error.message || 'Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente mais tarde ou entre em contato com Miriam ou Irineu.';
+        }
+        chatBox.removeChild(typingIndicatorElement);
+        addMessage(reply);
+        if (nextCursor) {
+            addShowMoreButton(nextCursor);
         }
     }
 
-    // Função para processar o envio de mensagem
-    async function processUserMessage() {
-        const message = userInput.value.trim();
+    // Função para processar o envio de mensagem (digitada ou vinda do botão "Mostrar mais")
+    async function processUserMessage(text = null, cursor = null) {
+        const message = text || userInput.value.trim();
         if (message === '') return;
 
         // Disable input and button
@@ -63,21 +85,18 @@ document.addEventListener('DOMContentLoaded', function() {
         sendButton.disabled = true;
         sendButton.textContent = 'Enviando...'; // Indicate activity
 
+        // Um botão "Mostrar mais" anterior deixa de valer quando a conversa segue
+        chatBox.querySelectorAll('.show-more-button').forEach(button => button.remove());
+
         // Adicionar mensagem do usuário ao chat
         addMessage(message, true);
-        userInput.value = '';
+        if (!text) {
+            userInput.value = '';
+        }
 
-        // Mostrar indicador de digitação
+        // Mostrar indicador de digitação; a resposta do bot o substitui ao chegar
         const typingIndicatorElement = addMessage('', false, true);
-
-        // Enviar mensagem para o backend e receber resposta
-        const reply = await sendMessage(message);
-
-        // Remover indicador de digitação
-        chatBox.removeChild(typingIndicatorElement);
-
-        // Adicionar resposta do bot
-        addMessage(reply);
+        await sendMessage(message, typingIndicatorElement, cursor);
 
         // Re-enable input and button
         userInput.disabled = false;
@@ -87,7 +106,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Event listeners
-    sendButton.addEventListener('click', processUserMessage);
+    sendButton.addEventListener('click', () => processUserMessage());
     userInput.addEventListener('keypress', function(e) {
         if (e.key === 'Enter' && !userInput.disabled) { // Prevent sending while disabled
             processUserMessage();
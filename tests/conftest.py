@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+
+# O main lê o caminho do banco e dos snapshots na importação: cada execução dos testes usa um diretório novo
+TMP_DIR = tempfile.mkdtemp(prefix='zar_testes_')
+os.environ['ZAR_DATABASE'] = os.path.join(TMP_DIR, 'testes.db')
+os.environ['ZAR_SNAPSHOT_DIR'] = os.path.join(TMP_DIR, 'snapshots')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Cursor do "mostrar mais": o token vem do cliente e um cursor malformado conta como ausente."""
+import base64
+import json
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook
+
+import main
+
+from test_ingestao import CABECALHO
+
+PERGUNTA = 'listar pedidos com mais de 5 dias de atraso'
+SEM_LISTA = 'Não há uma lista em andamento'
+
+
+@pytest.fixture(scope='module')
+def estado(tmp_path_factory):
+    caminho = tmp_path_factory.mktemp('chat') / 'atraso.xlsx'
+    wb = Workbook()
+    ws = wb.active
+    ws.append(CABECALHO)
+    dia = datetime(2024, 1, 1)
+    for i in range(60):
+        ws.append([1000 + i, dia, 'Miriam', 'FORNECEDOR', f'ITEM {i}', 1, 'R$ 10,00', 'R$ 10,00', None, None, None,
+                   None, None, 'pendente', '02_COTAR', 6 + i % 40])
+    wb.save(caminho)
+    ok, message = main.process_and_load_excel(str(caminho), content_hash='chat-cursor')
+    assert ok, message
+    return main.get_dataset_state()
+
+
+def cursor(dados):
+    return base64.urlsafe_b64encode(json.dumps(dados).encode()).decode()
+
+
+def perguntar(mensagem, **extra):
+    return main.app.test_client().post('/api/chat', json=dict(extra, message=mensagem))
+
+
+def test_cursor_valido_continua_a_lista(estado):
+    primeira = perguntar(PERGUNTA).get_json()
+    assert primeira['reply'].startswith('Encontrei 60 solicitações')
+    assert primeira['cursor']
+    resposta = perguntar('mostrar mais', cursor=primeira['cursor'])
+    assert resposta.status_code == 200
+    assert resposta.get_json()['reply'].startswith('Continuando a lista')
+
+
+@pytest.mark.parametrize('token', [
+    'nao-e-base64!',
+    123,
+    ['lista'],
+    cursor(['lista']),
+    cursor({'i': 'atraso', 'p': ['dias_atraso', 5], 'a': [40, 1000]}),
+    cursor({'i': 'atraso', 'p': {'dias_atraso': [5]}, 'a': [40, 1000]}),
+    cursor({'i': 'atraso', 'p': {'dias_atraso': {'x': 5}}, 'a': [40, 1000]}),
+    cursor({'i': 'atraso', 'p': {'dias_atraso': 5, 'outro': 1}, 'a': [40, 1000]}),
+    cursor({'i': 'atraso', 'p': {'dias_atraso': 5}, 'a': [40]}),
+    cursor({'i': 'atraso', 'p': {'dias_atraso': 5}, 'a': ['40', [1000]]}),
+    cursor({'i': 'atraso', 'p': {'dias_atraso': 5}, 'a': 40}),
+    cursor({'i': 'inexistente', 'p': {}, 'a': [40, 1000]}),
+    cursor({'i': ['atraso'], 'p': {'dias_atraso': 5}, 'a': [40, 1000]}),
+])
+def test_cursor_malformado_conta_como_ausente(estado, token):
+    dados = None
+    if isinstance(token, str) and not token.endswith('!'):
+        dados = json.loads(base64.urlsafe_b64decode(token))
+    if isinstance(dados, dict): # Versão atual, para o cursor só ser recusado pela forma
+        token = cursor(dict(dados, v=estado['versao']))
+    resposta = perguntar('mostrar mais', cursor=token)
+    assert resposta.status_code == 200
+    assert resposta.get_json()['reply'].startswith(SEM_LISTA)
+
+
+def test_parametro_sem_hash_responde_fora_do_cache(estado):
+    intent = main.chat_router.get('atraso')
+    entradas = main.chat_answer_cache.stats()['entradas']
+    payload, status = main.answer_chat(main.get_read_db(), estado, intent, {'dias_atraso': 5, 'apos': [40, 1059]})
+    assert status == 200
+    assert payload['reply'].startswith('Continuando a lista')
+    assert main.chat_answer_cache.stats()['entradas'] == entradas
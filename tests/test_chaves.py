@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Numeração das ocorrências de cada chave natural ao longo dos blocos de uma carga."""
+import random
+
+import main
+
+
+def test_ocorrencias_iguais_as_de_um_dicionario_completo():
+    rnd = random.Random(7)
+    chaves = [f'{rnd.randint(1, 3000)}\x1fPEDIDO\x1fITEM' for _ in range(40000)]
+    esperado, vistos = [], {}
+    for chave in chaves:
+        esperado.append(vistos.get(chave, 0))
+        vistos[chave] = vistos.get(chave, 0) + 1
+
+    contador = main.NaturalKeyCounter()
+    obtido = []
+    for inicio in range(0, len(chaves), 1000): # 40 blocos: passa pela compactação dos arrays
+        obtido.extend(contador.occurrences(chaves[inicio:inicio + 1000]))
+    assert obtido == esperado
+    assert len(contador._seen) <= main.NaturalKeyCounter.MAX_ARRAYS
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Lista paginada de atrasadas em cotação: SQL e motor colunar devem entregar as mesmas páginas; respostas da API
+revalidadas por ETag."""
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook
+
+import main
+
+from test_ingestao import gravar_planilha
+
+CABECALHO = ['Solicitação', 'DtAprovSol', 'Comprador', 'Fornec', 'Descrição', 'Qt.Solicitada', 'Preço Unitário',
+             'Vlr Total', 'DtAprovPedido', 'Dt.Pedido', 'Pedido', 'Dt.EntregaOrig', 'Dt.Receb', 'Estado', 'Etapa',
+             'Dias Atr Sol']
+ETAPAS = ['01_SOLICITADA', '02_COTAR', '05_COTADA', '08_PEDIDO']
+
+
+@pytest.fixture(scope='module')
+def estado(tmp_path_factory):
+    # Etapas alternadas, DiasAtrSol com empates e vazios para exercitar o desempate por id e o NULL no fim
+    caminho = tmp_path_factory.mktemp('dashboard') / 'atrasadas.xlsx'
+    wb = Workbook()
+    ws = wb.active
+    ws.append(CABECALHO)
+    dia = datetime(2024, 1, 1)
+    for i in range(230):
+        ws.append([1000 + i, dia, 'Miriam', 'FORNECEDOR', f'ITEM {i}', 1, 'R$ 10,00', 'R$ 10,00', None, None, None,
+                   None, None, 'pendente', ETAPAS[i % len(ETAPAS)], None if i % 7 == 0 else i % 13])
+    wb.save(caminho)
+    ok, message = main.process_and_load_excel(str(caminho), content_hash='dashboard-atrasadas')
+    assert ok, message
+    return main.get_dataset_state()
+
+
+def esperadas():
+    rows = main.get_read_db().execute(
+        "SELECT id, Solicitacao, Etapa, Comprador, DiasAtrSol FROM solicitacoes WHERE Etapa IN ('02_COTAR', '05_COTADA')").fetchall()
+    rows = sorted((dict(row) for row in rows), key=lambda row: row['id'], reverse=True)
+    return sorted(rows, key=lambda row: (row['DiasAtrSol'] is None, -(row['DiasAtrSol'] or 0)))
+
+
+@pytest.mark.parametrize('colunar', [False, True])
+def test_paginas_na_ordem_da_lista(estado, monkeypatch, colunar):
+    monkeypatch.setattr(main, 'COLUMNAR_ENGINE', colunar)
+    lista = esperadas()
+    assert main.get_dashboard_data(estado)['atrasadas_cotacao_total'] == len(lista) == 115
+    paginas = [main.get_late_quotation_page(estado, pagina, 20) for pagina in range(1, 8)]
+    assert [len(p) for p in paginas] == [20, 20, 20, 20, 20, 15, 0]
+    assert [row for p in paginas for row in p] == lista
+
+
+def test_resumo_guarda_so_agregados(estado):
+    payload = main.get_read_db().execute("SELECT payload FROM dashboard_resumo WHERE versao = ?", (estado['versao'],)).fetchone()[0]
+    assert '"atrasadas_cotacao"' not in payload
+    assert len(payload) < 2000
+
+
+@pytest.fixture
+def cliente():
+    c = main.app.test_client()
+    with c.session_transaction() as sessao:
+        sessao['logged_in'] = True
+    return c
+
+
+@pytest.mark.parametrize('rota', ['/admin/api/dashboard', '/admin/api/dashboard/atrasadas?pagina=2&tamanho=20'])
+def test_if_none_match_responde_304(estado, cliente, rota):
+    resposta = cliente.get(rota)
+    assert resposta.status_code == 200
+    etag = resposta.headers['ETag']
+    revalidada = cliente.get(rota, headers={'If-None-Match': etag})
+    assert revalidada.status_code == 304
+    assert revalidada.get_data() == b''
+    assert revalidada.headers['ETag'] == etag
+    assert cliente.get(rota, headers={'If-None-Match': '"outro"'}).status_code == 200
+
+
+def test_paginas_tem_etags_diferentes(estado, cliente):
+    etags = {cliente.get(f'/admin/api/dashboard/atrasadas?pagina={pagina}&tamanho=20').headers['ETag'] for pagina in (1, 2)}
+    assert len(etags) == 2
+
+
+def test_nova_carga_troca_o_etag(estado, cliente, tmp_path):
+    # Último teste do módulo: publica outra versão por cima da base do fixture
+    etag = cliente.get('/admin/api/dashboard').headers['ETag']
+    ok, message = main.process_and_load_excel(str(gravar_planilha(tmp_path / 'nova.xlsx', 5, set())),
+                                              content_hash=f'{tmp_path.name}-nova')
+    assert ok, message
+    resposta = cliente.get('/admin/api/dashboard', headers={'If-None-Match': etag})
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] != etag
+    assert resposta.get_json()['versao'] == main.get_dataset_state()['versao'] != estado['versao']
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Exportação filtrada: filtros combinados, 400 para parâmetro inválido e conteúdo do CSV/XLSX em blocos."""
+import csv
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+import main
+
+from test_ingestao import CABECALHO
+
+COMPRADORES = ['Miriam', 'Irineu']
+ETAPAS = ['01_SOLICITADA', '02_COTAR', '05_COTADA', '08_PEDIDO']
+STATUS = ['pendente', 'aprovado', 'cancelado']
+
+
+@pytest.fixture(scope='module')
+def estado(tmp_path_factory):
+    caminho = tmp_path_factory.mktemp('exportacao') / 'exportacao.xlsx'
+    wb = Workbook()
+    ws = wb.active
+    ws.append(CABECALHO)
+    inicio = datetime(2024, 1, 1)
+    for i in range(40):
+        dia = inicio + timedelta(days=i)
+        ws.append([1000 + i, dia, COMPRADORES[i % 2], 'FORNECEDOR', f'ITEM {i}', 1, 'R$ 10,00', 'R$ 10,00', None,
+                   dia, 5000 + i, None, None, STATUS[i % 3], ETAPAS[i % 4], i])
+    wb.save(caminho)
+    ok, message = main.process_and_load_excel(str(caminho), content_hash='exportacao')
+    assert ok, message
+    return main.get_dataset_state()
+
+
+@pytest.fixture
+def cliente(estado, monkeypatch):
+    monkeypatch.setattr(main, 'EXPORT_BATCH_SIZE', 7) # Vários blocos mesmo com poucas linhas
+    c = main.app.test_client()
+    with c.session_transaction() as sessao:
+        sessao['logged_in'] = True
+    return c
+
+
+def linhas_csv(resposta):
+    texto = resposta.get_data(as_text=True)
+    assert texto.startswith('﻿')
+    linhas = list(csv.reader(io.StringIO(texto[1:]), delimiter=';'))
+    assert linhas[0] == main.EXPORT_COLUMNS
+    return [dict(zip(linhas[0], linha)) for linha in linhas[1:]]
+
+
+def solicitacoes(linhas):
+    return sorted(int(linha['Solicitacao']) for linha in linhas)
+
+
+def test_exportacao_exige_login(estado):
+    assert main.app.test_client().get('/admin/exportar').status_code == 401
+
+
+def test_csv_sem_filtros_traz_a_base_inteira(cliente):
+    resposta = cliente.get('/admin/exportar?formato=csv')
+    assert resposta.status_code == 200
+    assert resposta.is_streamed
+    assert resposta.mimetype == 'text/csv'
+    assert 'attachment; filename="solicitacoes_v' in resposta.headers['Content-Disposition']
+    assert solicitacoes(linhas_csv(resposta)) == list(range(1000, 1040))
+
+
+def test_filtros_combinados(cliente):
+    # Valores normalizados como na ingestão, etapa repetida, faixa de dias e datas nos dois formatos
+    resposta = cliente.get('/admin/exportar?comprador=miriam&etapa=01_SOLICITADA&etapa=05_COTADA&status=PENDENTE'
+                           '&status=cancelado&dias_min=4&dias_max=30&dtpedido_de=05/01/2024&dtpedido_ate=2024-01-28')
+    assert resposta.status_code == 200
+    esperadas = [1000 + i for i in range(4, 28) if i % 4 in (0, 2) and i % 3 in (0, 2)]
+    linhas = linhas_csv(resposta)
+    assert solicitacoes(linhas) == esperadas
+    assert {linha['Comprador'] for linha in linhas} == {'Miriam'}
+
+
+@pytest.mark.parametrize('consulta, campo', [
+    ('dtpedido_de=2024-13-01', 'dtpedido_de'),
+    ('dtreceb_ate=31/02/2024', 'dtreceb_ate'),
+    ('dias_min=muitos', 'dias_min'),
+    ('formato=pdf', 'Formato'),
+])
+def test_parametro_invalido_responde_400(cliente, consulta, campo):
+    resposta = cliente.get(f'/admin/exportar?{consulta}')
+    assert resposta.status_code == 400
+    assert campo in resposta.get_json()['error']
+
+
+def test_xlsx_tem_o_mesmo_conteudo_do_csv(cliente):
+    csv_linhas = linhas_csv(cliente.get('/admin/exportar?formato=csv&etapa=02_COTAR'))
+    resposta = cliente.get('/admin/exportar?formato=xlsx&etapa=02_COTAR')
+    assert resposta.status_code == 200
+    assert resposta.is_streamed
+    planilha = load_workbook(io.BytesIO(resposta.get_data()), read_only=True).active
+    cabecalho, *linhas = list(planilha.iter_rows(values_only=True))
+    assert list(cabecalho) == main.EXPORT_COLUMNS
+    assert len(linhas) == len(csv_linhas) == 10
+    for linha, esperada in zip(linhas, csv_linhas):
+        linha = dict(zip(cabecalho, linha))
+        for coluna in main.EXPORT_COLUMNS:
+            valor = linha.get(coluna) # Células vazias no fim da linha não voltam na leitura
+            if isinstance(valor, datetime): # Datas viram data do Excel; no CSV ficam em aaaa-mm-dd
+                assert valor.strftime('%Y-%m-%d') == esperada[coluna], coluna
+            elif isinstance(valor, (int, float)): # O .xlsx devolve 1.0 como 1
+                assert valor == float(esperada[coluna]), coluna
+            else:
+                assert ('' if valor is None else valor) == esperada[coluna], coluna
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Streaming e leitura completa do Excel devem gravar as mesmas linhas."""
+import functools
+from datetime import datetime, timedelta
+
+import pytest
+from openpyxl import Workbook
+
+import main
+
+CABECALHO = ['Solicitação', 'DtAprovSol', 'Comprador', 'Fornec', 'Descrição', 'Qt.Solicitada', 'Preço Unitário',
+             'Vlr Total', 'DtAprovPedido', 'Dt.Pedido', 'Pedido', 'Dt.EntregaOrig', 'Dt.Receb', 'Estado', 'Etapa',
+             'Dias Atr Sol']
+
+
+def gravar_planilha(caminho, linhas, receb_vazio):
+    # Datas como células de data do Excel (não texto); Dt.Receb vazia nas linhas de receb_vazio
+    wb = Workbook()
+    ws = wb.active
+    ws.append(CABECALHO)
+    inicio = datetime(2024, 1, 1)
+    for i in range(linhas):
+        dia = inicio + timedelta(days=i)
+        ws.append([1000 + i, dia, 'Miriam', 'FORNECEDOR', f'ITEM {i}', 1, 'R$ 10,00', 'R$ 10,00', dia, dia, 5000 + i,
+                   dia + timedelta(days=5), None if i in receb_vazio else dia + timedelta(days=7), 'aprovado',
+                   '10_RECEBIDA', 0])
+    wb.save(caminho)
+    return caminho
+
+
+def linhas_gravadas(caminho, streaming, monkeypatch, hash_conteudo):
+    monkeypatch.setattr(main, 'iter_excel_chunks', functools.partial(main.iter_excel_chunks, chunk_size=10))
+    ok, message = main.process_and_load_excel(str(caminho), streaming=streaming, content_hash=hash_conteudo)
+    assert ok, message
+    return main.get_read_db().execute("SELECT COUNT(*) FROM solicitacoes").fetchone()[0]
+
+
+@pytest.mark.parametrize('receb_vazio, esperadas', [
+    (range(0, 10), 20), # Um bloco inteiro sem Dt.Receb: NaT descarta as linhas, como no read_excel
+    (range(12, 18), 24),
+    (range(0, 30), 30), # Coluna vazia na planilha inteira: o read_excel a lê como float e nada é descartado
+])
+def test_streaming_grava_as_mesmas_linhas(tmp_path, monkeypatch, receb_vazio, esperadas):
+    caminho = gravar_planilha(tmp_path / 'datas.xlsx', 30, set(receb_vazio))
+    completo = linhas_gravadas(caminho, False, monkeypatch, f'{tmp_path.name}-completo')
+    streaming = linhas_gravadas(caminho, True, monkeypatch, f'{tmp_path.name}-streaming')
+    assert completo == streaming == esperadas
+
+
+def gravar_pasta(caminho, abas):
+    # abas: [(título, linhas)]; linhas None grava uma aba de resumo sem as colunas essenciais
+    wb = Workbook()
+    wb.remove(wb.active)
+    dia = datetime(2024, 1, 1)
+    inicio = 0
+    for titulo, linhas in abas:
+        ws = wb.create_sheet(titulo)
+        if linhas is None:
+            ws.append(['Resumo', 'Total'])
+            ws.append(['Miriam', 10])
+            continue
+        ws.append(CABECALHO)
+        for i in range(inicio, inicio + linhas):
+            ws.append([1000 + i, dia, 'Miriam', 'FORNECEDOR', f'ITEM {i}', 1, 'R$ 10,00', 'R$ 10,00', dia, dia, 5000 + i,
+                       dia, dia, 'aprovado', '10_RECEBIDA', 0])
+        inicio += linhas
+    wb.save(caminho)
+    return caminho
+
+
+@pytest.mark.parametrize('processos', [1, 2])
+def test_varias_planilhas_carregadas_na_ordem(tmp_path, monkeypatch, processos):
+    monkeypatch.setattr(main, 'INGESTION_PROCESSES', processos)
+    caminho = gravar_pasta(tmp_path / 'abas.xlsx', [('A', 12), ('Resumo', None), ('B', 7), ('C', 5)])
+    ok, message, relatorio = main.process_and_load_workbooks([(str(caminho), 'abas.xlsx', f'{tmp_path.name}-abas')])
+    assert ok, message
+    assert [(r['planilha'], r['linhas'], bool(r['erro'])) for r in relatorio] == [
+        ('A', 12, False), ('Resumo', 0, True), ('B', 7, False), ('C', 5, False)]
+    solicitacoes = main.get_read_db().execute("SELECT Solicitacao FROM solicitacoes ORDER BY id").fetchall()
+    assert [int(row[0]) for row in solicitacoes] == list(range(1000, 1024))
+
+
+def test_nenhuma_planilha_valida_nao_publica_versao(tmp_path):
+    antes = main.get_dataset_state()
+    caminho = gravar_pasta(tmp_path / 'resumos.xlsx', [('Resumo', None), ('Outro', None)])
+    ok, _, relatorio = main.process_and_load_workbooks([(str(caminho), 'resumos.xlsx', f'{tmp_path.name}-resumos')])
+    assert not ok
+    assert len(relatorio) == 2
+    assert main.get_dataset_state() == antes
+
+
+def gravar_planilha_mista(caminho, linhas):
+    # Colunas de data com datas do Excel, texto dd/mm/aaaa, texto ISO, vazios, lixo e seriais inteiros
+    wb = Workbook()
+    ws = wb.active
+    ws.append(CABECALHO)
+    inicio = datetime(2024, 1, 1)
+    for i in range(linhas):
+        dia = inicio + timedelta(days=i % 60)
+        formas = [dia, dia.strftime('%d/%m/%Y'), dia.strftime('%Y-%m-%d'), None, 'sem data', 45000 + i % 30]
+        data = lambda deslocamento: formas[(i + deslocamento) % len(formas)]
+        ws.append([1000 + i, data(0), 'Miriam', 'FORNECEDOR', f'ITEM {i}', 1, 'R$ 10,00', 'R$ 10,00', data(1), data(2),
+                   5000 + i, data(3), data(4), 'aprovado', '10_RECEBIDA', 0])
+    wb.save(caminho)
+    return caminho
+
+
+def linhas_carregadas(caminho, streaming, monkeypatch, hash_conteudo, **opcoes):
+    monkeypatch.setattr(main, 'iter_excel_chunks', functools.partial(main.iter_excel_chunks, chunk_size=25, **opcoes))
+    ok, message = main.process_and_load_excel(str(caminho), streaming=streaming, content_hash=hash_conteudo)
+    assert ok, message
+    colunas = ', '.join(main.INTERNAL_COLUMNS)
+    return main.get_read_db().execute(f"SELECT {colunas} FROM solicitacoes ORDER BY id").fetchall()
+
+
+def test_streaming_igual_ao_read_excel_com_tipos_misturados(tmp_path, monkeypatch):
+    caminho = gravar_planilha_mista(tmp_path / 'mista.xlsx', 216)
+    completo = linhas_carregadas(caminho, False, monkeypatch, f'{tmp_path.name}-completo')
+    streaming = linhas_carregadas(caminho, True, monkeypatch, f'{tmp_path.name}-streaming')
+    assert len(completo) == 216
+    assert [tuple(row) for row in streaming] == [tuple(row) for row in completo]
+    # Texto dd/mm/aaaa continua dia/mês: a linha 1 tem DtAprovSol '02/01/2024'
+    assert completo[1]['DtAprovSol'] == '2024-01-02'
+
+
+@pytest.mark.parametrize('receb_vazio', [range(12, 18), range(20, 30)])
+def test_streaming_sem_janela_decide_por_bloco(tmp_path, monkeypatch, receb_vazio):
+    # Sem a leitura antecipada, uma coluna só com datas até o bloco ainda vira datetime64 em cada bloco
+    caminho = gravar_planilha(tmp_path / 'datas.xlsx', 30, set(receb_vazio))
+    completo = linhas_carregadas(caminho, False, monkeypatch, f'{tmp_path.name}-completo')
+    streaming = linhas_carregadas(caminho, True, monkeypatch, f'{tmp_path.name}-streaming', date_scan_rows=0)
+    assert [tuple(row) for row in streaming] == [tuple(row) for row in completo]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""/metrics só responde à sessão do admin ou ao token do coletor."""
+import pytest
+
+import main
+
+from test_ingestao import gravar_planilha
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    monkeypatch.setattr(main, 'METRICS_TOKEN', 'segredo-do-coletor')
+    return main.app.test_client()
+
+
+@pytest.mark.parametrize('cabecalhos', [{}, {'Authorization': 'Bearer outro'}, {'Authorization': 'Basic segredo-do-coletor'}])
+def test_metricas_sem_credencial(cliente, cabecalhos):
+    assert cliente.get('/metrics', headers=cabecalhos).status_code == 401
+
+
+def test_metricas_sem_token_configurado(monkeypatch):
+    monkeypatch.setattr(main, 'METRICS_TOKEN', '')
+    assert main.app.test_client().get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 401
+
+
+def test_metricas_com_token_mostram_etapa_commit(cliente, tmp_path):
+    ok, message = main.process_and_load_excel(str(gravar_planilha(tmp_path / 'commit.xlsx', 5, set())),
+                                              content_hash=f'{tmp_path.name}-commit')
+    assert ok, message
+    resposta = cliente.get('/metrics', headers={'Authorization': 'Bearer segredo-do-coletor'})
+    assert resposta.status_code == 200
+    assert 'etapa="commit"' in resposta.get_data(as_text=True)
+
+
+def test_metricas_com_sessao_do_admin(cliente):
+    with cliente.session_transaction() as sessao:
+        sessao['logged_in'] = True
+    assert cliente.get('/metrics').status_code == 200
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Um banco criado antes das migrações chega ao esquema atual com as mesmas chaves de uma carga nova."""
+import sqlite3
+
+import main
+
+# Esquema de 'solicitacoes' anterior à versão 1: LeadTimeCompra em texto e sem LeadTimeCompraContrato
+COLUNAS_V0 = [col for col in main.INTERNAL_COLUMNS if col != 'LeadTimeCompraContrato']
+TIPOS_V0 = {'DiasAtrSol': 'INTEGER', 'LeadTimeEntrega': 'INTEGER', 'AtrasoEntrega': 'INTEGER',
+            'Qtde': 'REAL', 'PrecoUnitario': 'REAL', 'VlrTotal': 'REAL'}
+
+
+def linha_v0(i, lead_time_compra):
+    valores = {col: None for col in COLUNAS_V0}
+    valores.update(Solicitacao=str(1000 + i), Comprador='Miriam', Produto=f'ITEM {i}', Pedido=str(5000 + i), Qtde=2.0,
+                   VlrTotal=20.0, Status='aprovado', Etapa='10_RECEBIDA', DiasAtrSol=i, LeadTimeCompra=lead_time_compra,
+                   LeadTimeEntrega=3, AtrasoEntrega=0)
+    return [valores[col] for col in COLUNAS_V0]
+
+
+def test_migracao_do_esquema_original(tmp_path):
+    conn = main._configure_connection(sqlite3.connect(tmp_path / 'v0.db'))
+    definicoes = ', '.join(f"{col} {TIPOS_V0.get(col, 'TEXT')}" for col in COLUNAS_V0)
+    conn.execute(f"CREATE TABLE solicitacoes (id INTEGER PRIMARY KEY AUTOINCREMENT, {definicoes})")
+    conn.executemany(f"INSERT INTO solicitacoes ({', '.join(COLUNAS_V0)}) VALUES ({', '.join('?' * len(COLUNAS_V0))})",
+                     [linha_v0(0, '12'), linha_v0(1, 'contrato'), linha_v0(2, '12')])
+    conn.commit()
+
+    main.migrate_db(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == main.SCHEMA_VERSION
+    colunas = [row[1] for row in conn.execute("PRAGMA table_info(solicitacoes)")]
+    assert colunas == ['id'] + main.INTERNAL_COLUMNS + main.ROW_KEY_COLUMNS
+    indices = {row[1] for row in conn.execute("PRAGMA index_list(solicitacoes)")}
+    assert set(main.SOLICITACOES_INDEXES) <= indices
+
+    linhas = conn.execute(f"SELECT {', '.join(main.INTERNAL_COLUMNS + main.ROW_KEY_COLUMNS)} FROM solicitacoes ORDER BY id").fetchall()
+    assert [(row['LeadTimeCompra'], row['LeadTimeCompraContrato']) for row in linhas] == [(12, 0), (None, 1), (12, 0)]
+    # Chaves iguais às que uma carga calcularia hoje para as mesmas linhas
+    esperadas = main.add_row_keys([tuple(row)[:len(main.INTERNAL_COLUMNS)] for row in linhas])
+    assert [tuple(row) for row in linhas] == esperadas
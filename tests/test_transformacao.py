@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""ColumnParsers (formato inferido, memo por coluna, blocos) deve dar o mesmo resultado de parse_date e
+clean_price valor a valor, inclusive em entradas ambíguas. Entradas aleatórias com semente fixa."""
+import math
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+
+# parse_date passa dayfirst=True também para texto ISO; o aviso do pandas é esperado aqui
+pytestmark = pytest.mark.filterwarnings('ignore:Parsing dates in:UserWarning')
+
+SEMENTES = range(4)
+
+
+FORMAS_DOMINANTES = ['{d:02d}/{m:02d}/{a}', '{a}-{m:02d}-{d:02d}', '{d}/{m}/{a}', '{d:02d}-{m:02d}-{a}', '{d:02d}.{m:02d}.{a}',
+                     '{d:02d}/{m:02d}/{a2:02d}', '{d:02d}/{m:02d}/{a} 10:30:00', '{a}-{m:02d}-{d:02d} 00:00:00']
+
+
+def data_ambigua(rnd, dominante):
+    # 80% na forma dominante da coluna (é ela que decide o formato inferido), o resto de tudo um pouco
+    dia, mes, ano = rnd.randint(1, 32), rnd.randint(1, 13), rnd.choice([2023, 2024, 1999])
+    if rnd.random() < 0.8:
+        return dominante.format(d=dia, m=mes, a=ano, a2=ano % 100)
+    forma = rnd.randrange(6)
+    if forma == 0:
+        return datetime(2024, 1, 1) + timedelta(days=rnd.randrange(400), hours=rnd.choice([0, 10]))
+    if forma == 1:
+        return rnd.choice([45000, 45000.5, True, 0])
+    if forma == 2:
+        return rnd.choice(['', ' ', 'sem data', '-', 'N/A', '00/00/0000', '2024', '31/02/2024'])
+    texto = rnd.choice(FORMAS_DOMINANTES).format(d=dia, m=mes, a=ano, a2=ano % 100)
+    return f' {texto} ' if forma == 3 else texto
+
+
+def preco_ambiguo(rnd):
+    forma = rnd.randrange(6)
+    if forma == 0:
+        return rnd.choice([None, float('nan'), 0, 12, 12.5, 1234.56, -3.0])
+    if forma == 1:
+        return rnd.choice(['', ' ', 'abc', 'nan', 'R$', '1,2,3', '--5', 'R$ -', 'US$ 10,00'])
+    inteiro, centavos = rnd.randrange(10 ** rnd.randint(1, 7)), rnd.randrange(100)
+    milhar = f'{inteiro:,}'.replace(',', rnd.choice(['.', ',', ' ', '']))
+    decimal = rnd.choice([',', '.'])
+    texto = f'{milhar}{decimal}{centavos:02d}' if rnd.random() < 0.8 else milhar
+    return rnd.choice(['', 'R$ ', 'R$', '-', 'R$ -']) + texto + rnd.choice(['', ' '])
+
+
+def blocos(rnd, valores):
+    # Mesma sequência em blocos de tamanhos variados, como o streaming entrega ao ColumnParsers
+    inicio = 0
+    while inicio < len(valores):
+        fim = inicio + rnd.randint(1, 60)
+        yield pd.Series(valores[inicio:fim], index=range(inicio, min(fim, len(valores))), dtype=object)
+        inicio = fim
+
+
+def iguais(obtido, esperado):
+    if esperado is None or (isinstance(esperado, float) and math.isnan(esperado)):
+        return obtido is None or (isinstance(obtido, float) and math.isnan(obtido))
+    return obtido == esperado
+
+
+@pytest.mark.parametrize('dominante', FORMAS_DOMINANTES)
+@pytest.mark.parametrize('semente', SEMENTES)
+def test_datas_iguais_a_parse_date(semente, dominante):
+    rnd = random.Random(semente)
+    valores = [data_ambigua(rnd, dominante) for _ in range(400)]
+    parsers = main.ColumnParsers()
+    for bloco in blocos(rnd, valores):
+        texto, normalizado, rejeitadas = parsers.dates('DtPedido', bloco)
+        assert not rejeitadas.any()
+        for valor, obtido, data in zip(bloco, texto, normalizado):
+            assert obtido == main.parse_date(valor), repr(valor)
+            assert (pd.isna(data) if obtido is None else data == pd.Timestamp(obtido)), repr(valor)
+
+
+@pytest.mark.parametrize('semente', SEMENTES)
+def test_precos_iguais_a_clean_price(semente):
+    rnd = random.Random(semente)
+    valores = [preco_ambiguo(rnd) for _ in range(400)]
+    parsers = main.ColumnParsers()
+    for bloco in blocos(rnd, valores):
+        for valor, obtido in zip(bloco, parsers.prices('PrecoUnitario', bloco)):
+            assert iguais(obtido, main.clean_price(valor)), repr(valor)
+
+
+def test_coluna_datetime64_como_parse_date():
+    # Coluna só de datas do Excel (datetime64): vazio vira NaT e a linha é rejeitada
+    serie = pd.Series([datetime(2024, 3, 5, 10, 30), None, datetime(2024, 12, 31)], dtype='datetime64[ns]')
+    texto, _, rejeitadas = main.ColumnParsers().dates('DtPedido', serie)
+    assert list(texto) == ['2024-03-05', None, '2024-12-31']
+    assert list(rejeitadas) == [False, True, False]
+    assert main.parse_date(serie[0].to_pydatetime()) == texto[0]
+    assert np.array_equal(rejeitadas, serie.isna().to_numpy())